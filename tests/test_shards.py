@@ -0,0 +1,161 @@
+""" End-to-end test of a sharded run (one shard per vendor) on SQLite
+stand-ins, with a local worker process per shard.
+"""
+
+import json
+import pickle
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+MAIN_PATH = Path(__file__).resolve().parents[1] / "validate"
+VENDOR_DBS = {
+    "loeb": ["SnippLoyalty_DW_Loeb", "bcl_loeb"],
+    "pkz": ["SnippLoyalty_DW_PKZ", "bcl_pkz"],
+}
+
+
+def _write_standins(standins_path: Path, dm_name: str, bcl_name: str) -> None:
+    """Write the DataMart and bcl stand-ins of a vendor with a few
+    hundred transactions (the same in both).
+    """
+    rng = np.random.default_rng(0)
+    n = 300
+    days = pd.DatetimeIndex(rng.choice(pd.date_range("2024-01-01", periods=900), n))
+    fact_trans = pd.DataFrame({
+        "DateSK": days.strftime("%Y%m%d").astype(int),
+        "TotalValue": rng.integers(100, 10000, n) / 100,
+        "TrxID": np.arange(1, n + 1),
+        "MemberSK": rng.integers(1, 30, n),
+        "TransactionStatusSK": 2,
+        "TransactionTypeSK": 1,
+    })
+    fact_trans_item = fact_trans.drop(columns="TotalValue").assign(
+        Amount=fact_trans["TotalValue"],
+        TransactionItemSK=np.arange(1, n + 1),
+        Quantity=1.0,
+    )
+    dim_member = pd.DataFrame({
+        "MemberSK": np.arange(1, 30),
+        "MemberAK": np.arange(1001, 1030),
+        "CreateDate": "2018-01-01",
+    })
+    dim_transaction_item = pd.DataFrame({
+        "TransactionItemSK": np.arange(1, n + 1),
+        "TransactionItemAK": np.arange(501, n + 501),
+        "TransactionItemCode": [f"{i:011d}" for i in range(1, n + 1)],
+        "AnalysisCode6": "a6",
+        "AnalysisCode8": "a8",
+        "AnalysisCode10": "a10",
+        "AnalysisCode13": "a13",
+    })
+    etl_transaction = pd.DataFrame({
+        "TrxDate": days.strftime("%Y-%m-%d 12:00:00"),
+        "TotalValue": fact_trans["TotalValue"],
+        "TrxId": fact_trans["TrxID"],
+        "UserId": fact_trans["MemberSK"],
+        "TrxStatusTypeId": 2,
+        "trxTypeid": 1,
+    })
+    with sqlite3.connect(str(standins_path / f"{dm_name}.sqlite")) as connection:
+        fact_trans.to_sql("FactTrans", connection, index=False)
+        fact_trans_item.to_sql("FactTransItem", connection, index=False)
+        dim_member.to_sql(
+            "DimMember", connection, index=False, dtype={"CreateDate": "DATETIME"}
+        )
+        dim_transaction_item.to_sql("DimTransactionItem", connection, index=False)
+    with sqlite3.connect(str(standins_path / f"{bcl_name}.sqlite")) as connection:
+        etl_transaction.to_sql(
+            "EtlTransaction", connection, index=False, dtype={"TrxDate": "DATETIME"}
+        )
+
+
+@pytest.fixture
+def run_path(tmp_path: Path) -> Path:
+    """Working directory with the config, the stand-ins of both vendors
+    and a previous run without any snapshots of tables (so that the
+    first run has something to compare with).
+    """
+    standins_path = tmp_path / "standins"
+    standins_path.mkdir()
+    for dm_name, bcl_name in VENDOR_DBS.values():
+        _write_standins(standins_path, dm_name, bcl_name)
+    db_list = [db_name for db_names in VENDOR_DBS.values() for db_name in db_names]
+    (tmp_path / "config.yaml").write_text(
+        f"SERVER: sqlite:///{standins_path.as_posix()}\n"
+        f"DB_LIST: [{', '.join(db_list)}]\n"
+        "VENDOR_LIST: [Loeb, PKZ]\n"
+        "QUERY_N_MONTHS_BACK: 6\n"
+        "SAMPLE_SIZE: 5\n"
+    )
+    (tmp_path / "logs").mkdir()
+    previous_path = tmp_path / "data" / "2000-01-01_catalyst_validation_data"
+    for sub in ["structure", "values", "drilldown", "meta"]:
+        (previous_path / sub).mkdir(parents=True)
+    for db_name in db_list:
+        for snapshot in ["tables_and_views", "empty_cols"]:
+            snapshot_file = f"{db_name}_{snapshot}_2000-01-01-00-00-00"
+            with open(previous_path / "structure" / snapshot_file, "wb") as f:
+                pickle.dump({}, f)
+    return tmp_path
+
+
+def _run_sharded(run_path: Path) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, str(MAIN_PATH), "shard-run", "--processes", "2"],
+        cwd=run_path,
+        capture_output=True,
+        text=True,
+        timeout=600,
+    )
+
+
+def _read_report(run_path: Path) -> list:
+    [report_path] = (run_path / "data").glob("*/report.jsonl")
+    with open(report_path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_sharded_run_on_standins(run_path: Path):
+    process = _run_sharded(run_path)
+    assert process.returncode == 0, process.stdout + process.stderr
+
+    report = _read_report(run_path)
+    assert {entry["shard"] for entry in report} == set(VENDOR_DBS)
+    assert not any("exception" in entry for entry in report)
+    checks = {(entry["shard"], entry.get("check")) for entry in report}
+    for vendor in VENDOR_DBS:
+        assert (vendor, "summary_DM_FactTrans") in checks
+        assert (vendor, "diff_DM_FactTrans_bcl_EtlTransaction") in checks
+
+    [actual_path] = [
+        path for path in (run_path / "data").iterdir()
+        if path.is_dir() and not path.name.startswith("2000")
+    ]
+    value_files = [file.name for file in (actual_path / "values").iterdir()]
+    for vendor in VENDOR_DBS:
+        assert any(name.startswith(f"{vendor}_DM_FactTrans_") for name in value_files)
+        assert any(
+            name.startswith(f"{vendor}_bcl_EtlTransaction_") for name in value_files
+        )
+
+
+def test_sharded_run_with_failing_shard(run_path: Path):
+    (run_path / "standins" / "bcl_pkz.sqlite").unlink()
+
+    process = _run_sharded(run_path)
+    assert process.returncode == 1
+
+    report = _read_report(run_path)
+    assert {entry["shard"] for entry in report} == set(VENDOR_DBS)
+    assert any(
+        entry["shard"] == "pkz" and "exception" in entry for entry in report
+    )
+    assert not any(
+        entry["shard"] == "loeb" and "exception" in entry for entry in report
+    )
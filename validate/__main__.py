@@ -1,62 +1,54 @@
+import argparse
 import datetime as dt
 import logging
 from pathlib import Path
 from time import sleep
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from rich.console import Console
-from rich.logging import RichHandler
 
-# from dev import dev_functions as DEVEL  # TODO Dev stand in
+# Note: The validation modules (and with them pandas, numpy, sqlalchemy
+# and pyarrow) are imported inside the functions that need them, so that
+# quick commands like `list-runs` start fast.
 import utils
-import validate_structure as struct
-import validate_values as val
-from sql_queries import query_dict
+from journal import RunJournal
+from log_utils import flush_logger, initialize_logger
 
 console = Console()
 
 CONFIG_PATH = "config.yaml"
 DATA_PATH = "data/"
+INDEX_HEALTH_TABLES = ["FactTrans", "FactTransItem", "DimTransactionItem"]
+PROFILE_TABLES = ["FactTrans", "FactTransItem", "DimMember"]
+# Value queries that only feed the diffs replaced by the server-side
+# reconciliation (DM_FactTransItem is also compared to the previous run)
+PUSHDOWN_REPLACED_QUERIES = ["bcl_EtlTransaction"]
 
 
-def initialize_logger():
-    """Initialize logging, to console using rich for formatting
-    and to file.
+def print_rule(title: str) -> None:
+    """Print a section rule to the console, after all the pending
+    log records have been rendered.
     """
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-    # Create a formatter (same for file and console)
-    fformatter = logging.Formatter(
-        fmt="%(levelname)s - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
-    cformatter = logging.Formatter(
-        fmt="%(message)s",
-        datefmt="[%X]"
-    )
-    # Create console handler
-    sh = RichHandler(show_time=False, show_path=False, markup=True)
-    sh.setLevel(logging.DEBUG)
-    sh.setFormatter(cformatter)
-    logger.addHandler(sh)
-    # Create file handler
-    filename = (
-        f"cat_val_{dt.datetime.strftime(dt.datetime.now(), '%Y-%m-%d-%H-%M-%S')}.log"
-    )
-    fh = logging.FileHandler(
-        Path.cwd() / "logs" / filename, "w", encoding=None, delay="true"
-    )
-    fh.setLevel(logging.INFO)
-    fh.setFormatter(fformatter)
-    logger.addHandler(fh)
+    flush_logger()
+    console.rule(title)
+    console.print("")
+
 
-    return logger
+def check_extra(check: str, vendor: str, data: Any) -> Dict[str, Any]:
+    """Return the `extra` dict for logging a check as data to the
+    JSONL logfile.
+    """
+    return {"check": check, "vendor": vendor, "data": data}
 
 
-def run_set_up(logger: logging.Logger) -> Tuple[Path, Path]:
+def run_set_up(
+    logger: logging.Logger,
+    resume: bool = False
+) -> Tuple[Path, Path, RunJournal]:
     """Get the path to the validation data for the latest date
     available and if it is not the actual date, create a new
-    folder for saving the data from the actual run.
+    folder for saving the data from the actual run. Return the
+    journal of the run too, resumed if requested.
     """
     console.print("")
     logger.info("[bold DARK_MAGENTA]Set-up CATALYST VALIDATION[/]",)
@@ -66,224 +58,1093 @@ def run_set_up(logger: logging.Logger) -> Tuple[Path, Path]:
     logger.info(
         f"Comparing to previous validation data from: {latest_data_path.name[:10]}\n"
     )
-    return latest_data_path, actual_data_path
+    journal = RunJournal(actual_data_path, resume)
+    return latest_data_path, actual_data_path, journal
 
 
 def run_structure_validation(
-    logger: logging.Logger, latest_data_path: Path, actual_data_path: Path
+    logger: logging.Logger,
+    config: Dict[str, Any],
+    latest_data_path: Path,
+    actual_data_path: Path,
+    journal: RunJournal,
+    schema_cache: Optional[Dict[str, Tuple]] = None
 ) -> None:
     """Run the structure validation part (schema checks and empty
-    columns checks).
+    columns checks). The snapshot of every DB is journaled as soon as
+    it is saved, and loaded from disk if already journaled (resumed
+    run). If a schema cache dict is passed (watch mode), the reflected
+    schema of a DB is kept there together with its version, and only
+    reflected again if the version has changed.
     """
+    import validate_structure as struct
+    from query_stats import QueryStats, track_query
+
     logger.info("[bold DARK_MAGENTA]STARTING STRUCTURE CHECKS ...[/]\n",)
 
-    server = utils.read_yaml(CONFIG_PATH, "SERVER")
-    db_list = utils.read_yaml(CONFIG_PATH, "DB_LIST")
+    server = config["SERVER"]
+    db_list = config["DB_LIST"]
+    empty_cols_method = config.get("EMPTY_COLS_METHOD", "sample")
+    query_stats = QueryStats(actual_data_path, config.get("ISOLATION_LEVELS"))
 
     # Structure checks for all DBs in config list
-    console.rule("[bold dark_yellow] Schema Checks for DataMarts and BCL")
-    console.print("")
+    print_rule("[bold dark_yellow] Schema Checks for DataMarts and BCL")
 
+    tables_views_by_db = {}
     for db_name in db_list:
         engine, connection = utils.connect_to_db(server, db_name)
         with connection:
-            insp = struct.inspect_db(connection)
             logger.info(f"[bold DARK_MAGENTA]Schema Check[/] {db_name.upper()}")
             tables_views_old = struct.load_latest_tables_and_views_dict(
                 db_name,
                 latest_data_path
             )
-            tables_views_new = struct.create_new_tables_and_views_dict(
-                db_name,
-                insp
-            )
+            schema_version = None
+            if schema_cache is not None:
+                schema_version = struct.get_schema_version(connection)
+            if journal.is_done(f"schema/{db_name}"):
+                tables_views_new = struct.load_latest_tables_and_views_dict(
+                    db_name,
+                    actual_data_path
+                )
+                logger.debug("Schema loaded from the resumed run.")
+            elif (
+                schema_version is not None
+                and schema_cache.get(db_name, (None, None))[0] == schema_version
+            ):
+                tables_views_new = schema_cache[db_name][1]
+                logger.debug("Schema unchanged, cached reflection used.")
+            else:
+                insp = struct.inspect_db(connection)
+                tables_views_new = struct.create_new_tables_and_views_dict(
+                    db_name,
+                    insp
+                )
+                if schema_cache is not None:
+                    schema_cache[db_name] = (schema_version, tables_views_new)
+                struct.save_new_tables_and_views_dict(
+                    tables_views_new,
+                    db_name,
+                    actual_data_path
+                )
+                journal.mark_done(f"schema/{db_name}")
             struct.compare_tables_and_views_dicts(
                 tables_views_new,
                 tables_views_old,
                 db_name
             )
-            struct.save_new_tables_and_views_dict(
-                tables_views_new,
-                db_name,
-                actual_data_path
-            )
+            tables_views_by_db[db_name] = tables_views_new
 
-    # Empty cols check for the DM DBs only
-    console.rule("[bold dark_yellow] Empty Columns Checks for DataMarts")
-    console.print("")
+    # Empty cols check for the DM DBs only (reusing the reflected schema)
+    print_rule("[bold dark_yellow] Empty Columns Checks for DataMarts")
     for db_name in [db_name for db_name in db_list if db_name.startswith("Snipp")]:
         engine, connection = utils.connect_to_db(server, db_name)
         with connection:
-            insp = struct.inspect_db(connection)
-            tables_views_new = struct.create_new_tables_and_views_dict(
-                db_name,
-                insp
-            )
+            tables_views_new = tables_views_by_db[db_name]
             logger.info(f"[bold DARK_MAGENTA]Empty Columns-Check[/] {db_name.upper()}")
             empty_cols_old = struct.load_latest_empty_cols_dict(
                 db_name,
                 latest_data_path
             )
-            empty_cols_new = struct.create_new_empty_cols_dict(
-                db_name,
-                tables_views_new,
-                connection
-            )
+            if journal.is_done(f"empty_cols/{db_name}"):
+                empty_cols_new = struct.load_latest_empty_cols_dict(
+                    db_name,
+                    actual_data_path
+                )
+                logger.debug("Empty columns loaded from the resumed run.")
+            else:
+                check = f"empty_cols[{db_name}]"
+                with track_query(connection, check, query_stats):
+                    if (
+                        empty_cols_method == "stats"
+                        and utils.get_dialect_name(connection) == "mssql"
+                    ):
+                        empty_cols_new = struct.create_new_empty_cols_dict_from_stats(
+                            db_name,
+                            tables_views_new,
+                            connection
+                        )
+                    else:
+                        empty_cols_new = struct.create_new_empty_cols_dict(
+                            db_name,
+                            tables_views_new,
+                            connection
+                        )
+                struct.save_new_empty_cols_dict(
+                    empty_cols_new,
+                    db_name,
+                    actual_data_path
+                )
+                journal.mark_done(f"empty_cols/{db_name}")
             struct.compare_empty_cols_dicts(
                 empty_cols_new,
                 empty_cols_old,
                 db_name
             )
-            struct.save_new_empty_cols_dict(
-                empty_cols_new,
-                db_name,
-                actual_data_path
+
+    # Index health check for the DM DBs only
+    print_rule("[bold dark_yellow] Index Health Checks for DataMarts")
+    for db_name in [db_name for db_name in db_list if db_name.startswith("Snipp")]:
+        engine, connection = utils.connect_to_db(server, db_name)
+        with connection:
+            logger.info(f"[bold DARK_MAGENTA]Index Health Check[/] {db_name.upper()}")
+            if journal.is_done(f"index_health/{db_name}"):
+                index_health_new = struct.load_latest_index_health_dict(
+                    db_name,
+                    actual_data_path
+                )
+                logger.debug("Index health loaded from the resumed run.")
+            else:
+                with track_query(connection, f"index_health[{db_name}]", query_stats):
+                    index_health_new = struct.create_new_index_health_dict(
+                        db_name,
+                        connection,
+                        config.get("INDEX_HEALTH_TABLES", INDEX_HEALTH_TABLES)
+                    )
+                struct.save_new_index_health_dict(
+                    index_health_new,
+                    db_name,
+                    actual_data_path
+                )
+                journal.mark_done(f"index_health/{db_name}")
+            report_index_health(
+                logger, config, db_name, index_health_new, latest_data_path
             )
 
+    # Profile check for the DM DBs only (reusing the reflected schema)
+    print_rule("[bold dark_yellow] Profile Checks for DataMarts")
+    for db_name in [db_name for db_name in db_list if db_name.startswith("Snipp")]:
+        engine, connection = utils.connect_to_db(server, db_name)
+        with connection:
+            logger.info(f"[bold DARK_MAGENTA]Profile Check[/] {db_name.upper()}")
+            if journal.is_done(f"profile/{db_name}"):
+                profile_new = struct.load_latest_profile_df(db_name, actual_data_path)
+                logger.debug("Profile loaded from the resumed run.")
+            else:
+                with track_query(connection, f"profile[{db_name}]", query_stats):
+                    profile_new = struct.create_new_profile_df(
+                        db_name,
+                        tables_views_by_db[db_name],
+                        connection,
+                        config.get("PROFILE_TABLES", PROFILE_TABLES),
+                        config.get("PROFILE_SAMPLE_PERCENT"),
+                        config.get("PROFILE_EXACT_MAX_ROWS", 1000000)
+                    )
+                struct.save_new_profile_df(profile_new, db_name, actual_data_path)
+                journal.mark_done(f"profile/{db_name}")
+            report_profile(logger, config, db_name, profile_new, latest_data_path)
+
+
+def report_index_health(
+    logger: logging.Logger,
+    config: Dict[str, Any],
+    db_name: str,
+    index_health_new: Dict[str, Any],
+    previous_data_path: Path
+) -> None:
+    """Compare the index health of a DB to the one of a previous run,
+    if there is one for that run (else only the health is output).
+    """
+    import validate_structure as struct
+
+    if len(index_health_new) == 0:
+        return
+    index_health_old = struct.load_latest_index_health_dict(db_name, previous_data_path)
+    if index_health_old is None:
+        logger.info(
+            f"No previous index health data from {previous_data_path.name[:10]}, "
+            f"comparison skipped.\n"
+        )
+        index_health_old = index_health_new
+    struct.compare_index_health_dicts(
+        index_health_new,
+        index_health_old,
+        db_name,
+        config.get("INDEX_FRAGMENTATION_THRESHOLD", 30),
+        config.get("INDEX_STATS_MAX_AGE_DAYS", 7)
+    )
+
+
+def report_profile(
+    logger: logging.Logger,
+    config: Dict[str, Any],
+    db_name: str,
+    profile_new: Any,
+    previous_data_path: Path
+) -> None:
+    """Compare the profile of a DB to the one of a previous run, if
+    there is one for that run.
+    """
+    import validate_structure as struct
+
+    if len(profile_new) == 0:
+        return
+    profile_old = struct.load_latest_profile_df(db_name, previous_data_path)
+    if profile_old is None or len(profile_old) == 0:
+        logger.info(
+            f"No previous profile from {previous_data_path.name[:10]}, "
+            f"comparison skipped.\n"
+        )
+        return
+    struct.compare_profile_dfs(
+        profile_new,
+        profile_old,
+        db_name,
+        config.get("PROFILE_NULL_RATIO_THRESHOLD", 0.05),
+        config.get("PROFILE_DISTINCT_DROP_THRESHOLD", 0.5)
+    )
+
 
 def run_value_validation(
-    logger: logging.Logger, latest_data_path: Path, actual_data_path: Path
+    logger: logging.Logger,
+    config: Dict[str, Any],
+    latest_data_path: Path,
+    actual_data_path: Path,
+    journal: RunJournal
 ) -> None:
     """Run the values validation part (consistency between DBs
-    and consistency over time).
+    and consistency over time). Every query result is saved and
+    journaled as soon as it is loaded (see `run_structure_validation`).
+    The queries run with the isolation levels of their checks. The
+    summaries provisioned for the fact tables are read instead of the
+    fact tables, once the days appended since have been summarized.
+    With the Arrow fetch backend, the results are fetched as columnar
+    tables.
     """
+    import arrow_fetch
+    import cassette
+    import summaries
+    import validate_drilldown as val_drill
+    import validate_values as val
+    from query_costs import QueryCosts
+    from query_stats import QueryStats
+    from sql_queries import query_dict
+
     logger.info("[bold DARK_MAGENTA]STARTING DATA VALUE CHECKS ...[/]\n",)
 
-    server = utils.read_yaml(CONFIG_PATH, "SERVER")
-    db_list = utils.read_yaml(CONFIG_PATH, "DB_LIST")
-    vendor_list = utils.read_yaml(CONFIG_PATH, "VENDOR_LIST")
+    # SQLite stand-ins are served by the DuckDB backend for the T-SQL queries
+    server = utils.get_value_server(config["SERVER"])
+    db_list = config["DB_LIST"]
 
+    # Only the queries for the vendors in the config (e.g. of a shard)
+    vendors = [vendor.lower() for vendor in config["VENDOR_LIST"]]
+    query_dict = {
+        q_name: query for q_name, query in query_dict.items()
+        if q_name.split("_", 1)[0] in vendors
+    }
+    is_pushdown = config.get("RECONCILIATION_MODE", "client") == "pushdown"
+    if is_pushdown:
+        query_dict = {
+            q_name: query for q_name, query in query_dict.items()
+            if q_name.split("_", 1)[1] not in PUSHDOWN_REPLACED_QUERIES
+        }
+
+    query_stats = QueryStats(actual_data_path, config.get("ISOLATION_LEVELS"))
+    if config.get("FETCH_BACKEND", "rows") == "arrow":
+        arrow_fetch.activate()
     engine, connection = utils.connect_to_db(server, db_list[0])
     with connection:
-        n_months = utils.read_yaml(CONFIG_PATH, "QUERY_N_MONTHS_BACK")
-        start_date, end_date = val.get_start_and_end_date_strings(n_months)
+        n_months = config["QUERY_N_MONTHS_BACK"]
+        start_date, end_date = val.get_start_and_end_date_strings(
+            n_months, cassette.get_run_date()
+        )
         df_full_old = val.load_old_value_dfs(latest_data_path)
-        # df_full_new = DEVEL.DEV_load_new_DEV_value_dfs()  # TODO DEV stand in
-        df_full_new = val.load_new_value_dfs(
+        query_dict = summaries.get_summary_query_dict(
             connection, query_dict, start_date, end_date
         )
-        val.save_new_value_dfs(df_full_new, actual_data_path)
+        df_full_new = val.load_new_value_dfs(
+            connection,
+            query_dict,
+            start_date,
+            end_date,
+            engine,
+            config.get("PARTITION_MONTHS"),
+            config.get("PARTITION_WORKERS", 4),
+            journal,
+            query_stats,
+            QueryCosts(actual_data_path),
+            config.get("QUERY_WORKERS", 1)
+        )
+        df_full_new.update(
+            val.load_sample_value_dfs(
+                connection,
+                config["VENDOR_LIST"],
+                df_full_old,
+                config.get("SAMPLE_SIZE", 1000),
+                journal,
+                query_stats
+            )
+        )
+        recon_dict = None
+        if is_pushdown:
+            recon_dict = val.load_reconciliation_dfs(
+                connection,
+                config["VENDOR_LIST"],
+                start_date,
+                end_date,
+                config.get("RECONCILIATION_GRANULARITY", "month"),
+                config.get("RECONCILIATION_TOLERANCE", 0),
+                query_stats
+            )
+        drilldown_dict = None
+        if config.get("DRILLDOWN", False):
+            drilldown_dict = run_drilldown(
+                config,
+                connection,
+                df_full_new,
+                recon_dict,
+                start_date,
+                end_date,
+                query_stats
+            )
+            val_drill.save_drilldown_dfs(drilldown_dict, actual_data_path)
+
+    report_value_validation(
+        logger, config, df_full_new, df_full_old, recon_dict, drilldown_dict
+    )
+
 
-        for vendor in [vendor.lower() for vendor in vendor_list]:
-            df_vendor_new, df_vendor_old = val.grab_and_truncate_df_names_for_vendor(
-                vendor, df_full_new, df_full_old
+def run_drilldown(
+    config: Dict[str, Any],
+    connection: Any,
+    df_full_new: Dict[str, Any],
+    recon_dict: Optional[Dict[str, Dict[str, Any]]],
+    start_date: str,
+    end_date: str,
+    query_stats: Optional[Any] = None
+) -> Dict[str, Any]:
+    """Drill down to the transactions missing in DM_FactTrans or in
+    bcl_EtlTransaction, for the months where their numbers of
+    transactions differ. Return the results by vendor.
+    """
+    import validate_drilldown as val_drill
+    import validate_values as val
+    from query_stats import track_query
+
+    drilldown_dict = {}
+    for vendor in [vendor.lower() for vendor in config["VENDOR_LIST"]]:
+        if recon_dict is not None:
+            df_diff = recon_dict[vendor]["bcl_EtlTransaction"]
+        else:
+            df_diff = val.return_subtraction_df(
+                df_full_new[f"{vendor}_DM_FactTrans"],
+                df_full_new[f"{vendor}_bcl_EtlTransaction"]
             )
+        with track_query(connection, f"drilldown[{vendor}]", query_stats):
+            drilldown_dict[vendor] = val_drill.drill_down_trx_differences(
+                connection,
+                vendor,
+                "DM_FactTrans",
+                "bcl_EtlTransaction",
+                start_date,
+                end_date,
+                val_drill.get_differing_months(df_diff),
+                config.get("DRILLDOWN_BUCKETS", 16),
+                config.get("DRILLDOWN_LEAF_SIZE", 1000)
+            )
+    return drilldown_dict
 
-            # Run transaction checks
-            console.rule(f"[bold dark_yellow] Fact table checks {vendor.upper()}")
-            console.print("")
-            sleep(0.5)
-            logger.info(
-                f"{vendor.upper()} - Summary of DM_FactTrans:\n"
-                f"{df_vendor_new['DM_FactTrans']}\n"
+
+def report_value_validation(
+    logger: logging.Logger,
+    config: Dict[str, Any],
+    df_full_new: Dict[str, Any],
+    df_full_old: Dict[str, Any],
+    recon_dict: Optional[Dict[str, Dict[str, Any]]] = None,
+    drilldown_dict: Optional[Dict[str, Any]] = None
+) -> None:
+    """Output the value checks for each vendor, comparing the new
+    dataframes to each other and to the ones from the previous run.
+    If a dict with the server-side reconciliations is passed (pushdown
+    mode), it is used for the comparisons between the fact tables.
+    If a dict with drill-down results is passed, the transactions
+    missing in one of the fact tables are listed too.
+    """
+    import validate_values as val
+
+    vendor_list = config["VENDOR_LIST"]
+
+    for vendor in [vendor.lower() for vendor in vendor_list]:
+        df_vendor_new, df_vendor_old = val.grab_and_truncate_df_names_for_vendor(
+            vendor, df_full_new, df_full_old
+        )
+        VENDOR = vendor.upper()
+
+        # Run transaction checks
+        print_rule(f"[bold dark_yellow] Fact table checks {VENDOR}")
+        logger.info(
+            "%s - Summary of DM_FactTrans:\n%s\n",
+            VENDOR,
+            df_vendor_new["DM_FactTrans"],
+            extra=check_extra(
+                "summary_DM_FactTrans", vendor, df_vendor_new["DM_FactTrans"]
             )
-            sleep(0.5)
+        )
+        if recon_dict is not None:
+            df_diff = recon_dict[vendor]["bcl_EtlTransaction"]
+        elif "bcl_EtlTransaction" in df_vendor_new:
             df_diff = val.return_subtraction_df(
                 df_vendor_new["DM_FactTrans"],
                 df_vendor_new["bcl_EtlTransaction"]
             )
+        else:
+            # Run in pushdown mode, re-rendered without the reconciliation
+            df_diff = None
             logger.info(
-                f"{vendor.upper()} - Difference DM_FactTrans to bcl_EtlTransactions:\n"
-                f"{df_diff}\n")
-            sleep(0.5)
-            df_diff = val.return_subtraction_df(
-                df_vendor_new["DM_FactTrans"],
-                df_vendor_new["DM_FactTransItem"]
+                "%s - Difference DM_FactTrans to bcl_EtlTransactions not "
+                "available, the run reconciled on the server.\n",
+                VENDOR
             )
+        if df_diff is not None:
             logger.info(
-                f"{vendor.upper()} - Difference DM_FactTrans to DM_FactTransItem:\n"
-                f"{df_diff}\n")
-            sleep(0.5)
+                "%s - Difference DM_FactTrans to bcl_EtlTransactions:\n%s\n",
+                VENDOR,
+                df_diff,
+                extra=check_extra(
+                    "diff_DM_FactTrans_bcl_EtlTransaction", vendor, df_diff
+                )
+            )
+        if drilldown_dict is not None:
+            df_drilldown = drilldown_dict[vendor]
+            extra = check_extra(
+                "drilldown_DM_FactTrans_bcl_EtlTransaction", vendor, df_drilldown
+            )
+            if len(df_drilldown) == 0:
+                logger.info(
+                    "%s - Drill-down: No transactions missing in "
+                    "DM_FactTrans or bcl_EtlTransaction.\n",
+                    VENDOR,
+                    extra=extra
+                )
+            else:
+                logger.warning(
+                    "%s - Drill-down: %s transactions missing in one of "
+                    "DM_FactTrans and bcl_EtlTransaction:\n%s\n",
+                    VENDOR,
+                    len(df_drilldown),
+                    df_drilldown,
+                    extra=extra
+                )
+        if recon_dict is not None:
+            df_diff = recon_dict[vendor]["DM_FactTransItem"]
+        else:
             df_diff = val.return_subtraction_df(
                 df_vendor_new["DM_FactTrans"],
-                df_vendor_old["DM_FactTrans"]
+                df_vendor_new["DM_FactTransItem"]
             )
-            logger.info(
-                f"{vendor.upper()} - Difference DM_FactTrans new to previous:\n"
-                f"{df_diff}\n")
-            sleep(0.5)
+        logger.info(
+            "%s - Difference DM_FactTrans to DM_FactTransItem:\n%s\n",
+            VENDOR,
+            df_diff,
+            extra=check_extra("diff_DM_FactTrans_DM_FactTransItem", vendor, df_diff)
+        )
+        for df_name in ["DM_FactTrans", "DM_FactTransItem"]:
+            if df_name not in df_vendor_old:
+                logger.info(
+                    "%s - No previous %s (e.g. first run), comparison skipped.\n",
+                    VENDOR,
+                    df_name
+                )
+                continue
             df_diff = val.return_subtraction_df(
-                df_vendor_new["DM_FactTransItem"],
-                df_vendor_old["DM_FactTransItem"]
+                df_vendor_new[df_name], df_vendor_old[df_name]
             )
             logger.info(
-                f"{vendor.upper()} - Difference DM_FactTransItem new to previous:\n"
-                f"{df_diff}\n")
-            sleep(0.5)
-            if vendor == "pkz":
-                n_dup_TISK = val.check_for_duplicate_TISK(df_vendor_new)
-                if n_dup_TISK == 0:
-                    logger.info(
-                        f"{vendor.upper()}, extra check - No duplicate "
-                        f"TransactionItemSK in FactTransItem.\n"
-                    )
-                else:
-                    logger.error(
-                        f"{vendor.upper()}, extra check - {n_dup_TISK} "
-                        f"duplicate TransactionItemSK in FactTransItem!\n")
-            sleep(0.5)
-            # Run member checks
-            console.rule(f"[bold dark_yellow] Member Checks {vendor.upper()}")
-            console.print("")
-            sleep(0.5)
+                "%s - Difference %s new to previous:\n%s\n",
+                VENDOR,
+                df_name,
+                df_diff,
+                extra=check_extra(f"diff_{df_name}_previous", vendor, df_diff)
+            )
+        if vendor == "pkz":
+            n_dup_TISK = val.check_for_duplicate_TISK(df_vendor_new)
+            extra = check_extra("duplicate_TISK", vendor, n_dup_TISK)
+            if n_dup_TISK == 0:
+                logger.info(
+                    "%s, extra check - No duplicate "
+                    "TransactionItemSK in FactTransItem.\n",
+                    VENDOR,
+                    extra=extra
+                )
+            else:
+                logger.error(
+                    "%s, extra check - %s "
+                    "duplicate TransactionItemSK in FactTransItem!\n",
+                    VENDOR,
+                    n_dup_TISK,
+                    extra=extra
+                )
+
+        # Run member checks
+        print_rule(f"[bold dark_yellow] Member Checks {VENDOR}")
+        logger.info(
+            "%s - Summary of MemberAK:\n%s\n",
+            VENDOR,
+            df_vendor_new["DM_DimMember_AK"],
+            extra=check_extra(
+                "summary_DM_DimMember_AK", vendor, df_vendor_new["DM_DimMember_AK"]
+            )
+        )
+        if "DM_DimMember_AK" not in df_vendor_old:
             logger.info(
-                f"{vendor.upper()} - Summary of MemberAK:\n"
-                f"{df_vendor_new['DM_DimMember_AK']}\n"
+                "%s - No previous DM_DimMember_AK (e.g. first run), "
+                "comparison skipped.\n",
+                VENDOR
             )
-            sleep(0.5)
+        else:
             diff_n_MemberAK, diff_defaultDates = val.return_diff_member_stuff(
                 df_vendor_new, df_vendor_old
             )
             logger.info(
-                f"{vendor.upper()} - Change in n MemberAK: {diff_n_MemberAK}\n"
-                f"{vendor.upper()} - Change in n Birthdates '1Jan1900': {diff_defaultDates}\n"
-            )
-            sleep(0.5)
-            logger.info(
-                f"{vendor.upper()} - 2019 Summary for 3 random customers:\n"
-                f"{df_vendor_new['DM_three_members']}\n")
-            three_members_equal = val.compare_three_members(
-                df_vendor_new,
-                df_vendor_old
+                "%s - Change in n MemberAK: %s\n"
+                "%s - Change in n Birthdates '1Jan1900': %s\n",
+                VENDOR,
+                diff_n_MemberAK,
+                VENDOR,
+                diff_defaultDates,
+                extra=check_extra(
+                    "diff_DM_DimMember_AK",
+                    vendor,
+                    {
+                        "n_MemberAK": diff_n_MemberAK,
+                        "n_dates_1Jan1900": diff_defaultDates,
+                    }
+                )
             )
-            if three_members_equal:
-                logger.info("Consistency Check for 3 MemberAK ok.\n")
-            else:
-                logger.error(
-                    f"Consistency Check for 3 MemberAK failed!\n"
-                    f"Check the previous 'DM_Three_Members' data:\n"
-                    f"{df_vendor_old['DM_Three_Members']}\n"
+        report_sample_check(
+            logger, vendor, df_vendor_new, df_vendor_old, "members", "MemberAK"
+        )
+
+        # Run product checks
+        print_rule(f"[bold dark_yellow] Product Checks {VENDOR}")
+        report_sample_check(
+            logger,
+            vendor,
+            df_vendor_new,
+            df_vendor_old,
+            "products",
+            "TransactionItemCode" if vendor == "pkz" else "ProductAK"
+        )
+
+
+def report_sample_check(
+    logger: logging.Logger,
+    vendor: str,
+    df_vendor_new: Dict[str, Any],
+    df_vendor_old: Dict[str, Any],
+    entity: str,
+    key_name: str
+) -> None:
+    """Output the 2019 summary of the sampled members or products and
+    their consistency per entity compared to the previous run.
+    """
+    import validate_values as val
+    from sql_queries import sample_query_dict
+
+    VENDOR = vendor.upper()
+    df_name = f"DM_sample_{entity}"
+    df_new = df_vendor_new[df_name]
+    logger.info(
+        "%s - 2019 Summary for %s sampled %s:\n%s\n",
+        VENDOR,
+        df_new.iloc[:, 0].nunique(),
+        entity,
+        df_new
+    )
+    if df_name not in df_vendor_old:
+        logger.info(
+            "%s - No previous sample of %s, consistency check skipped.\n",
+            VENDOR,
+            entity
+        )
+        return
+
+    df_status = val.compare_sample_dfs(
+        df_new,
+        df_vendor_old[df_name],
+        sample_query_dict[f"{vendor}_{df_name}"]["key_cols"]
+    )
+    df_failed = df_status[df_status["status"].isin(val.SAMPLE_FAILED_STATUSES)]
+    n_new = int((df_status["status"] == "new").sum())
+    n_compared = len(df_status) - n_new
+    extra = check_extra(f"consistency_{df_name}", vendor, df_status)
+    if n_new > 0:
+        logger.info(
+            "%s sampled %s new in the sample, nothing to compare yet.",
+            n_new,
+            key_name
+        )
+    if len(df_failed) == 0:
+        logger.info(
+            "Consistency Check for %s sampled %s ok.\n",
+            n_compared,
+            key_name,
+            extra=extra
+        )
+    else:
+        logger.error(
+            "Consistency Check for %s of %s sampled %s failed!\n%s\n"
+            "Check the previous '%s' data.\n",
+            len(df_failed),
+            n_compared,
+            key_name,
+            df_failed,
+            df_name,
+            extra=extra
+        )
+
+
+def run_provision(
+    logger: logging.Logger,
+    config: Dict[str, Any],
+    rebuild: bool = False
+) -> None:
+    """Create (if needed) the `validation` schema with the summary
+    tables in the DBs of the fact tables, and refresh the summaries of
+    the value queries on the fact tables for the validation window:
+    only the days after the watermark and the days of appended rows,
+    or with `rebuild` (or if a table changed otherwise) the whole
+    window (see `summaries.py`).
+    """
+    import cassette
+    import summaries
+    import validate_values as val
+    from sql_queries import query_dict
+
+    vendors = [vendor.lower() for vendor in config["VENDOR_LIST"]]
+    query_dict = {
+        q_name: query for q_name, query in query_dict.items()
+        if q_name.split("_", 1)[0] in vendors
+    }
+    start_date, end_date = val.get_start_and_end_date_strings(
+        config["QUERY_N_MONTHS_BACK"], cassette.get_run_date()
+    )
+    sources = summaries.get_summary_sources(query_dict)
+
+    print_rule("[bold dark_yellow] Provisioning of the Summaries")
+    for db_name in sorted({source["db"] for source in sources.values()}):
+        engine, connection = utils.connect_to_db(config["SERVER"], db_name)
+        with connection:
+            if utils.get_dialect_name(connection) != "mssql":
+                logger.warning(
+                    f"{db_name}: summaries are only available for SQL Server."
+                )
+                continue
+            summaries.create_summary_objects(connection)
+            for q_name, source in sources.items():
+                if source["db"] != db_name:
+                    continue
+                refresh = summaries.provision_summary(
+                    connection, q_name, source, start_date, end_date, rebuild
                 )
-            sleep(0.5)
-            # Run product checks
-            console.rule(f"[bold dark_yellow] Product Checks {vendor.upper()}")
-            console.print("")
-            sleep(0.5)
+                if refresh is None:
+                    logger.info(
+                        f"{q_name}: summary is current ({start_date}-{end_date})."
+                    )
+                else:
+                    logger.info(
+                        f"{q_name}: days {refresh['day_from']}-{refresh['day_to']} "
+                        f"summarized{' (rebuilt)' if refresh['rebuild'] else ''}."
+                    )
+
+
+def run_diff_only(logger: logging.Logger, config: Dict[str, Any]) -> None:
+    """Re-render the report of the latest stored run, comparing its
+    snapshots to the ones of the run before. No DB connection needed.
+    """
+    import validate_structure as struct
+    import validate_values as val
+
+    data_paths = utils.list_validation_data_paths(DATA_PATH)
+    if len(data_paths) < 2:
+        logger.error(f"At least two runs are needed in {DATA_PATH} for a diff.")
+        return
+    previous_data_path, latest_data_path = data_paths[-2], data_paths[-1]
+    console.print("")
+    logger.info(
+        f"[bold DARK_MAGENTA]Diff of stored validation data[/] "
+        f"{latest_data_path.name[:10]} to {previous_data_path.name[:10]}\n"
+    )
+
+    print_rule("[bold dark_yellow] Schema Checks for DataMarts and BCL")
+    for db_name in config["DB_LIST"]:
+        logger.info(f"[bold DARK_MAGENTA]Schema Check[/] {db_name.upper()}")
+        struct.compare_tables_and_views_dicts(
+            struct.load_latest_tables_and_views_dict(db_name, latest_data_path),
+            struct.load_latest_tables_and_views_dict(db_name, previous_data_path),
+            db_name
+        )
+
+    print_rule("[bold dark_yellow] Empty Columns Checks for DataMarts")
+    for db_name in [db for db in config["DB_LIST"] if db.startswith("Snipp")]:
+        logger.info(f"[bold DARK_MAGENTA]Empty Columns-Check[/] {db_name.upper()}")
+        struct.compare_empty_cols_dicts(
+            struct.load_latest_empty_cols_dict(db_name, latest_data_path),
+            struct.load_latest_empty_cols_dict(db_name, previous_data_path),
+            db_name
+        )
+
+    print_rule("[bold dark_yellow] Index Health Checks for DataMarts")
+    for db_name in [db for db in config["DB_LIST"] if db.startswith("Snipp")]:
+        index_health = struct.load_latest_index_health_dict(db_name, latest_data_path)
+        if index_health is None:
+            continue
+        logger.info(f"[bold DARK_MAGENTA]Index Health Check[/] {db_name.upper()}")
+        report_index_health(logger, config, db_name, index_health, previous_data_path)
+
+    print_rule("[bold dark_yellow] Profile Checks for DataMarts")
+    for db_name in [db for db in config["DB_LIST"] if db.startswith("Snipp")]:
+        profile = struct.load_latest_profile_df(db_name, latest_data_path)
+        if profile is None:
+            continue
+        logger.info(f"[bold DARK_MAGENTA]Profile Check[/] {db_name.upper()}")
+        report_profile(logger, config, db_name, profile, previous_data_path)
+
+    report_value_validation(
+        logger,
+        config,
+        val.load_old_value_dfs(latest_data_path),
+        val.load_old_value_dfs(previous_data_path)
+    )
+
+
+def run_sharded(
+    logger: logging.Logger,
+    config: Dict[str, Any],
+    results_dir: Optional[str],
+    phases: List[str],
+    n_processes: int,
+    merge_only: bool
+) -> None:
+    """Coordinate a sharded run: start a worker process per shard
+    (unless the workers run elsewhere and only their results have to
+    be merged), then merge the shard results into the data folder of
+    the actual run and output the outcome of every shard.
+    """
+    import shards
+
+    latest_data_path, actual_data_path, _ = run_set_up(logger)
+    results_path = Path(results_dir) if results_dir else actual_data_path / "shards"
+    shard_names = list(shards.get_shard_configs(config).keys())
+    exit_codes = None
+    if not merge_only:
+        logger.info(
+            f"[bold DARK_MAGENTA]STARTING SHARDED RUN ...[/] "
+            f"{len(shard_names)} shards, {n_processes} processes\n"
+        )
+        exit_codes = shards.start_shard_workers(
+            shard_names, results_path, phases, n_processes
+        )
+
+    shard_results = shards.merge_shard_results(
+        results_path, actual_data_path, shard_names, exit_codes
+    )
+    print_rule("[bold dark_yellow] Shard Results")
+    for shard_name, shard_result in shard_results.items():
+        extra = {"check": "shard", "data": shard_result}
+        if shard_result["status"] == "ok":
             logger.info(
-                f"{vendor.upper()} - 2019 Summary for 3 random products:\n"
-                f"{df_vendor_new['DM_three_products']}\n")
-            three_members_equal = val.compare_three_products(
-                df_vendor_new,
-                df_vendor_old
+                "Shard '%s' ok, log records per level: %s",
+                shard_name,
+                shard_result["level_counts"],
+                extra=extra
             )
-            if three_members_equal and vendor == "pkz":
-                logger.info("Consistency Check for 3 TransactionItemCode ok.\n")
-            elif three_members_equal and vendor == "loeb":
-                logger.info("Consistency Check for 3 ProductAK ok.\n")
-            else:
-                logger.error(
-                    f"Consistency Check for 3 Products failed!\n"
-                    f"Check the previous 'DM_Three_Products' data:\n"
-                    f"{df_vendor_old['DM_Three_Members']}\n"
+        else:
+            logger.error(
+                "Shard '%s' FAILED: %s",
+                shard_name,
+                shard_result["error"],
+                extra=extra
+            )
+    logger.info(f"Merged report: {actual_data_path / 'report.jsonl'}\n")
+    n_failed = sum(result["status"] != "ok" for result in shard_results.values())
+    if n_failed > 0:
+        logger.error(f"{n_failed} of {len(shard_results)} shards failed.")
+        raise SystemExit(1)
+
+
+def run_shard_worker(
+    config: Dict[str, Any],
+    shard_name: str,
+    results_dir: str,
+    phases: List[str]
+) -> None:
+    """Run the validation phases for one shard, writing snapshots,
+    logs and the outcome to the shard folder in the results location.
+    """
+    import shards
+
+    shard_config = shards.get_shard_configs(config)[shard_name]
+    shard_data_path = shards.get_shard_data_path(Path(results_dir), shard_name)
+    logger = initialize_logger(shard_data_path)
+    started = dt.datetime.now()
+    try:
+        latest_data_path = utils.get_latest_previous_validation_data_path(DATA_PATH)
+        journal = RunJournal(shard_data_path)
+        if "structure" in phases:
+            run_structure_validation(
+                logger, shard_config, latest_data_path, shard_data_path, journal
+            )
+        if "values" in phases:
+            run_value_validation(
+                logger, shard_config, latest_data_path, shard_data_path, journal
+            )
+    except Exception as e:
+        logger.exception(f"Shard '{shard_name}' failed.")
+        shards.write_shard_result(
+            shard_data_path, shard_name, "failed", started, repr(e)
+        )
+        raise SystemExit(1)
+    shards.write_shard_result(shard_data_path, shard_name, "ok", started)
+
+
+def run_watch(logger: logging.Logger, config: Dict[str, Any], run_now: bool) -> None:
+    """Keep running and trigger a validation run (structure and
+    values) whenever a new load has landed, as detected by polling the
+    load watermarks. Engines and reflected schemas are kept warm.
+    """
+    import watch
+
+    poll_seconds = config.get("WATCH_POLL_SECONDS", 300)
+    watcher = watch.Watcher(
+        config.get("WATCH_DEBOUNCE_SECONDS", 600),
+        watch.load_validated_watermarks(DATA_PATH)
+    )
+    probes = watch.get_watermark_probes(config)
+    engine = watch.get_probe_engine(config)
+    schema_cache = {}
+    logger.info(
+        f"[bold DARK_MAGENTA]WATCHING LOADS ...[/] "
+        f"{len(probes)} watermarks, polled every {poll_seconds}s\n"
+    )
+    while True:
+        try:
+            watermarks = watch.read_watermarks(engine, probes)
+        except Exception:
+            logger.exception("Reading the load watermarks failed, polling again.")
+            sleep(poll_seconds)
+            continue
+        if run_now or watcher.update(watermarks, dt.datetime.now()):
+            if run_now:
+                watcher.pending, run_now = watermarks, False
+            try:
+                latest_data_path, actual_data_path, journal = run_set_up(logger)
+                run_structure_validation(
+                    logger,
+                    config,
+                    latest_data_path,
+                    actual_data_path,
+                    journal,
+                    schema_cache
                 )
+                run_value_validation(
+                    logger, config, latest_data_path, actual_data_path, journal
+                )
+                run_compaction(logger, config, actual_data_path)
+            except Exception:
+                # Not marked as validated, so the load is retried next poll
+                logger.exception("Validation run failed, retrying at the next poll.")
+            else:
+                watcher.mark_validated()
+                watch.save_validated_watermarks(DATA_PATH, watcher.validated)
+                logger.info("Validation run done, watching loads ...\n")
+        sleep(poll_seconds)
 
 
-def main(logger):
-    latest_data_path, actual_data_path = run_set_up(logger)
-    run_structure_validation(logger, latest_data_path, actual_data_path)
-    run_value_validation(logger, latest_data_path, actual_data_path)
+def list_runs(reconcile: bool = False) -> None:
+    """Print the stored validation runs with the number of saved
+    structure and value snapshots (or the size of their archive),
+    after reconciling the runs index with the disk if requested.
+    """
+    import retention
 
+    runs = retention.load_runs_index(DATA_PATH, reconcile)
+    if len(runs) == 0:
+        console.print(f"No validation data found in {DATA_PATH}.")
+        return
+    for run_name, status in runs.items():
+        data_path = Path(DATA_PATH) / run_name
+        if status == retention.ARCHIVED:
+            archive_path = Path(DATA_PATH) / "archive" / f"{run_name}.tar.gz"
+            console.print(
+                f"{run_name}  archived: {archive_path.stat().st_size / 1024:.0f} KiB"
+            )
+            continue
+        n_files = {
+            sub: len(list((data_path / sub).iterdir()))
+            if (data_path / sub).exists() else 0
+            for sub in ["structure", "values"]
+        }
+        console.print(
+            f"{data_path.name}  structure: {n_files['structure']:>3}"
+            f"  values: {n_files['values']:>3}"
+        )
+
+
+def run_compaction(
+    logger: logging.Logger,
+    config: Dict[str, Any],
+    actual_data_path: Optional[Path] = None
+) -> None:
+    """Archive the runs older than the latest `RETENTION_KEEP_RUNS`
+    (default 30) ones, see `retention.py`.
+    """
+    import retention
+
+    retention.compact_runs(
+        DATA_PATH,
+        config.get("RETENTION_KEEP_RUNS", 30),
+        actual_data_path.name if actual_data_path is not None else None
+    )
+
+
+def parse_args(args: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse the command line arguments. Without a subcommand all
+    the validation phases are run.
+    """
+    parser = argparse.ArgumentParser(
+        prog="validate",
+        description="Validation of the DB dumps in the CAE."
+    )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record",
+        metavar="CASSETTE",
+        help="record all DB interactions of the run to a cassette file"
+    )
+    cassette_group.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="replay the DB interactions from a cassette file, no DB needed"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume today's run, skipping the units it has already done"
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("all", help="run structure and value checks (default)")
+    subparsers.add_parser("structure", help="run the structure checks only")
+    subparsers.add_parser("values", help="run the value checks only")
+    subparsers.add_parser(
+        "diff-only", help="re-render the report of the latest stored run, no DB"
+    )
+    list_runs_parser = subparsers.add_parser(
+        "list-runs", help="list the stored validation runs"
+    )
+    list_runs_parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="check the runs index against the run folders and archives first"
+    )
+    subparsers.add_parser(
+        "compact", help="archive the runs older than the retention period"
+    )
+    provision_parser = subparsers.add_parser(
+        "provision", help="create and refresh the summaries of the fact tables"
+    )
+    provision_parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="summarize the whole validation window again"
+    )
+    watch_parser = subparsers.add_parser(
+        "watch", help="keep running and validate every new load"
+    )
+    watch_parser.add_argument(
+        "--run-now", action="store_true", help="validate once at start-up too"
+    )
+    shard_run_parser = subparsers.add_parser(
+        "shard-run", help="run the checks sharded by server / vendor and merge"
+    )
+    shard_run_parser.add_argument(
+        "--processes", type=int, default=2, help="number of local worker processes"
+    )
+    shard_run_parser.add_argument(
+        "--merge-only",
+        action="store_true",
+        help="only merge the results of workers that have run elsewhere"
+    )
+    shard_worker_parser = subparsers.add_parser(
+        "shard-worker", help="run the checks for one shard (started by shard-run)"
+    )
+    shard_worker_parser.add_argument("--shard", required=True)
+    for shard_parser in [shard_run_parser, shard_worker_parser]:
+        shard_parser.add_argument(
+            "--results-dir",
+            required=shard_parser is shard_worker_parser,
+            help="shared results location of the shard workers"
+        )
+        shard_parser.add_argument(
+            "--phases",
+            nargs="+",
+            choices=["structure", "values"],
+            default=["structure", "values"]
+        )
+    parsed_args = parser.parse_args(args)
+    if parsed_args.command is None:
+        parsed_args.command = "all"
+    return parsed_args
+
+
+def main(args: Optional[List[str]] = None):
+    args = parse_args(args)
+    if args.command == "list-runs":
+        list_runs(args.reconcile)
+        return
+
+    config = utils.load_config(CONFIG_PATH)
+    if args.command == "shard-worker":
+        run_shard_worker(config, args.shard, args.results_dir, args.phases)
+        return
 
-if __name__ == "__main__":
     logger = initialize_logger()
-    main(logger)
+    if args.command == "diff-only":
+        run_diff_only(logger, config)
+        return
+    if args.command == "provision":
+        run_provision(logger, config, args.rebuild)
+        return
+    if args.command == "compact":
+        run_compaction(logger, config)
+        return
+    if args.command == "watch":
+        run_watch(logger, config, args.run_now)
+        return
+    if args.command == "shard-run":
+        run_sharded(
+            logger,
+            config,
+            args.results_dir,
+            args.phases,
+            args.processes,
+            args.merge_only
+        )
+        return
+
+    active_cassette = None
+    if args.record or args.replay:
+        import cassette
+
+        active_cassette = cassette.activate(
+            args.record or args.replay, "record" if args.record else "replay"
+        )
+    try:
+        latest_data_path, actual_data_path, journal = run_set_up(logger, args.resume)
+        if args.command in ["all", "structure"]:
+            run_structure_validation(
+                logger, config, latest_data_path, actual_data_path, journal
+            )
+        if args.command in ["all", "values"]:
+            run_value_validation(
+                logger, config, latest_data_path, actual_data_path, journal
+            )
+        run_compaction(logger, config, actual_data_path)
+    finally:
+        # Save what has been recorded so far, even if the run failed
+        if active_cassette is not None:
+            active_cassette.save()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+""" Optional columnar fetch backend (`FETCH_BACKEND: arrow` in the config).
+The result sets of the value queries are read in column batches straight
+into Arrow tables, cast to their declared schema with Arrow, written to
+parquet as they are and converted to dataframes column by column, so
+that no Python object per row is created on the way:
+
+- SQL Server: with the `arrow-odbc` driver, on an ODBC connection of its
+  own (with the isolation level of the check set in the same batch; the
+  lock wait of that session is not measured).
+- SQLite stand-in: with the ADBC SQLite driver (`adbc-driver-sqlite`).
+- Dumps (`dump_backend.py`): natively with DuckDB.
+
+Other connections (e.g. of a cassette) fetch rows as before.
+"""
+
+import logging
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+import utils
+from dump_backend import DumpConnection
+from sql_queries import query_set_isolation_level_template
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+ARROW_TYPE_DICT = {
+    "int32": "int32",
+    "int64": "int64",
+    "float64": "float64",
+}
+
+_active = False
+
+
+def activate() -> None:
+    """Activate the Arrow fetch for all the value queries of this run."""
+    global _active
+    _active = True
+
+
+def supports(connection: Any) -> bool:
+    """Return True if the Arrow fetch is active and available for the
+    kind of connection.
+    """
+    if not _active:
+        return False
+    if isinstance(connection, DumpConnection):
+        return True
+    return (
+        hasattr(connection, "engine")
+        and utils.get_dialect_name(connection) in ["mssql", "sqlite"]
+    )
+
+
+def fetch_table(
+    connection: Any,
+    query: str,
+    isolation_level: Optional[str] = None,
+    batch_size: int = 65536
+) -> "pa.Table":
+    """Run a query and return its result set as an Arrow table. On SQL
+    Server, the isolation level (if passed) is set in the same batch,
+    as the query runs on an ODBC connection of its own.
+    """
+    import pyarrow as pa
+
+    if isinstance(connection, DumpConnection):
+        return connection.fetch_arrow_table(query)
+
+    url = connection.engine.url
+    if utils.get_dialect_name(connection) == "sqlite":
+        import adbc_driver_sqlite.dbapi as adbc_sqlite
+
+        with adbc_sqlite.connect(url.database) as adbc_connection:
+            with adbc_connection.cursor() as cursor:
+                cursor.execute(query)
+                return cursor.fetch_arrow_table()
+
+    from arrow_odbc import read_arrow_batches_from_odbc
+
+    if isolation_level is not None:
+        query = (
+            "SET NOCOUNT ON;\n"
+            + query_set_isolation_level_template.format(isolation_level=isolation_level)
+            + query
+        )
+    reader = read_arrow_batches_from_odbc(
+        query=query,
+        connection_string=_get_odbc_connection_string(url),
+        batch_size=batch_size,
+    )
+    return pa.Table.from_batches(reader, schema=reader.schema)
+
+
+def cast_to_schema(
+    table: "pa.Table",
+    schema: Dict[str, str],
+    q_name: str
+) -> "pa.Table":
+    """Return the table with its columns cast with Arrow to the dtypes
+    declared in the schema of the check, with the same rules as
+    `validate_values.apply_schema` (categories as dictionary encoded
+    strings, datetimes as timestamps in ns).
+    """
+    import pyarrow as pa
+
+    missing_cols = [col for col in schema if col not in table.column_names]
+    if len(missing_cols) > 0:
+        logger.error(f"{q_name}: declared columns {missing_cols} missing in result.")
+        raise ValueError(f"Result of {q_name} does not match its declared schema.")
+    undeclared_cols = [col for col in table.column_names if col not in schema]
+    if len(undeclared_cols) > 0:
+        logger.warning(
+            f"{q_name}: no dtype declared for columns {undeclared_cols}, "
+            f"please add them to the schema_dict."
+        )
+
+    columns = []
+    for col in table.column_names:
+        column = table.column(col)
+        dtype = schema.get(col)
+        if dtype is None:
+            pass
+        elif dtype.startswith("datetime64"):
+            column = column.cast(pa.timestamp("ns"))
+        elif dtype == "category":
+            column = column.cast(pa.string()).dictionary_encode()
+        else:
+            column = column.cast(getattr(pa, ARROW_TYPE_DICT[dtype])())
+        columns.append(column)
+    return pa.Table.from_arrays(columns, names=table.column_names)
+
+
+def write_parquet(table: "pa.Table", path: Path) -> None:
+    """Write the table as it is (without conversion to a dataframe)."""
+    import pyarrow.parquet as pq
+
+    pq.write_table(table, str(path))
+
+
+def _get_odbc_connection_string(url: Any) -> str:
+    """Return the ODBC connection string for the URL of a SQLAlchemy
+    mssql+pyodbc engine (integrated security, if without user).
+    """
+    driver = url.query.get("driver", "ODBC Driver 13 for SQL Server")
+    con_string = f"Driver={{{driver}}};Server={url.host};Database={url.database};"
+    if url.username:
+        con_string += f"UID={url.username};PWD={url.password};"
+    else:
+        con_string += "Trusted_Connection=yes;"
+    return con_string
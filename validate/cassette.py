@@ -0,0 +1,277 @@
+""" Record and replay of the DB interactions of a run. In record mode
+every query result and every Inspector call of a real run is captured
+to a compact local cassette file (gzipped pickle). In replay mode they
+are served back from that file without any DB connection, which gives
+deterministic offline runs for profiling and benchmarking.
+"""
+
+import datetime as dt
+import gzip
+import logging
+import pickle
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+_active_cassette = None
+
+
+class Cassette:
+    """Container for the recorded DB interactions, keyed by DB name,
+    kind of interaction and its arguments, and of the SQL dialect of
+    every recorded DB (the checks take different paths per dialect).
+    """
+
+    def __init__(self, path: Union[str, Path], mode: str):
+        if mode not in ["record", "replay"]:
+            raise ValueError(f"Unknown cassette mode '{mode}'.")
+        self.path = Path(path)
+        self.mode = mode
+        self.run_date = dt.date.today()
+        self.entries = {}
+        self.dialects = {}
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self.load()
+
+    def load(self) -> None:
+        """Load the entries, the dialects and the run date of a
+        recorded run.
+        """
+        with gzip.open(self.path, "rb") as f:
+            content = pickle.load(f)
+        self.run_date = content["run_date"]
+        self.entries = content["entries"]
+        self.dialects = content.get("dialects", {})
+        logger.info(
+            f"Replaying {len(self.entries)} recorded DB interactions "
+            f"from {self.path} (recorded {self.run_date})."
+        )
+
+    def save(self) -> None:
+        """Save the recorded entries (only in record mode)."""
+        if self.mode != "record":
+            return
+        with self._lock:
+            content = {
+                "run_date": self.run_date,
+                "dialects": dict(self.dialects),
+                "entries": dict(self.entries),
+            }
+        with gzip.open(self.path, "wb") as f:
+            pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+        logger.info(f"{len(self.entries)} DB interactions recorded to {self.path}.")
+
+    def record(self, key: Tuple, value: Any) -> None:
+        with self._lock:
+            self.entries[key] = value
+
+    def record_dialect(self, db_name: str, dialect_name: str) -> None:
+        with self._lock:
+            self.dialects[db_name] = dialect_name
+
+    def play_dialect(self, db_name: str) -> str:
+        try:
+            return self.dialects[db_name]
+        except KeyError:
+            logger.error(
+                f"No recorded dialect for {db_name} in {self.path}, "
+                f"please record the cassette again."
+            )
+            raise
+
+    def play(self, key: Tuple) -> Any:
+        try:
+            return self.entries[key]
+        except KeyError:
+            logger.error(f"No recorded DB interaction for {key[:3]} in {self.path}.")
+            raise
+
+
+class CassetteResult:
+    """Minimal stand-in for a SQLAlchemy result, holding the column
+    names and the rows as plain tuples.
+    """
+
+    def __init__(self, keys: List[str], rows: List[Tuple]):
+        self._keys = keys
+        self._rows = rows
+
+    def keys(self) -> List[str]:
+        return self._keys
+
+    def fetchall(self) -> List[Tuple]:
+        return self._rows
+
+    def fetchone(self) -> Optional[Tuple]:
+        return self._rows[0] if len(self._rows) > 0 else None
+
+    def scalar(self) -> Any:
+        row = self.fetchone()
+        return row[0] if row is not None else None
+
+
+class CassetteConnection:
+    """Wrap a SQLAlchemy connection to record its results, or replace
+    it completely (connection is None) when replaying.
+    """
+
+    def __init__(
+        self, cassette: Cassette, db_name: str, connection: Optional[Any] = None
+    ):
+        self.cassette = cassette
+        self.db_name = db_name
+        self._connection = connection
+        if cassette.mode == "replay":
+            self.dialect = SimpleNamespace(name=cassette.play_dialect(db_name))
+        else:
+            self.dialect = connection.dialect
+            cassette.record_dialect(db_name, connection.dialect.name)
+
+    def execute(self, query: Any, *multiparams, **params) -> CassetteResult:
+        key = (
+            "execute",
+            self.db_name,
+            str(query).strip(),
+            repr(multiparams),
+            repr(sorted(params.items()))
+        )
+        return self._record_or_play(
+            key, lambda: _to_plain_result(
+                self._connection.execute(query, *multiparams, **params)
+            )
+        )
+
+    def inspect(self) -> "CassetteInspector":
+        return CassetteInspector(self)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _record_or_play(self, key: Tuple, call: Any) -> Any:
+        """Replay the recorded outcome of a call, or make the call and
+        record its outcome. Errors are recorded too, because some of
+        them are expected (e.g. tables that cannot be parsed).
+        """
+        if self.cassette.mode == "replay":
+            outcome, value = self.cassette.play(key)
+            if outcome == "error":
+                _raise_recorded_error(*value)
+            return value
+        try:
+            value = call()
+        except Exception as e:
+            self.cassette.record(key, ("error", (type(e).__name__, str(e))))
+            raise
+        self.cassette.record(key, ("ok", value))
+        return value
+
+
+class CassetteInspector:
+    """Record or replay the Inspector calls used for the structure
+    checks.
+    """
+
+    def __init__(self, connection: CassetteConnection):
+        self._connection = connection
+        self._insp = None
+        if connection.cassette.mode == "record" and hasattr(
+            connection._connection, "inspect"
+        ):
+            self._insp = connection._connection.inspect()
+        elif connection.cassette.mode == "record":
+            import sqlalchemy
+
+            self._insp = sqlalchemy.inspect(connection._connection)
+
+    def get_table_names(self) -> List[str]:
+        return self._call("get_table_names")
+
+    def get_view_names(self) -> List[str]:
+        return self._call("get_view_names")
+
+    def get_columns(self, name: str) -> List[Dict[str, Any]]:
+        return self._call("get_columns", name)
+
+    def _call(self, method: str, *args) -> Any:
+        key = ("inspect", self._connection.db_name, method, repr(args), "")
+        return self._connection._record_or_play(
+            key, lambda: getattr(self._insp, method)(*args)
+        )
+
+
+class CassetteEngine:
+    """Wrap a SQLAlchemy engine (or replace it when replaying), so
+    that every connection it hands out is a `CassetteConnection`.
+    """
+
+    def __init__(self, cassette: Cassette, db_name: str, engine: Optional[Any] = None):
+        self.cassette = cassette
+        self.db_name = db_name
+        self._engine = engine
+
+    @property
+    def dialect(self) -> Any:
+        if self._engine is not None:
+            return self._engine.dialect
+        return SimpleNamespace(name=self.cassette.play_dialect(self.db_name))
+
+    def connect(self) -> CassetteConnection:
+        connection = self._engine.connect() if self._engine is not None else None
+        return CassetteConnection(self.cassette, self.db_name, connection)
+
+    def dispose(self) -> None:
+        if self._engine is not None:
+            self._engine.dispose()
+
+
+def activate(path: Union[str, Path], mode: str) -> Cassette:
+    """Activate a cassette for all the DB connections of this run."""
+    global _active_cassette
+    _active_cassette = Cassette(path, mode)
+    return _active_cassette
+
+
+def get_active() -> Optional[Cassette]:
+    return _active_cassette
+
+
+def get_run_date() -> dt.date:
+    """Return the date of the recorded run when replaying (so that
+    the date dependent queries match), else the actual date.
+    """
+    if _active_cassette is not None and _active_cassette.mode == "replay":
+        return _active_cassette.run_date
+    return dt.date.today()
+
+
+def _to_plain_result(result: Any) -> CassetteResult:
+    """Fetch a SQLAlchemy result into plain tuples."""
+    if isinstance(result, CassetteResult):
+        # Already plain (e.g. from the dump backend)
+        return result
+    if not result.returns_rows:
+        return CassetteResult([], [])
+    keys = list(result.keys())
+    rows = [tuple(row) for row in result.fetchall()]
+    return CassetteResult(keys, rows)
+
+
+def _raise_recorded_error(error_name: str, message: str) -> None:
+    """Raise the same kind of error that has been recorded."""
+    import sqlalchemy.exc
+
+    error_class = getattr(sqlalchemy.exc, error_name, None)
+    if error_class is not None and issubclass(error_class, sqlalchemy.exc.DBAPIError):
+        raise error_class(message, None, Exception(message))
+    raise RuntimeError(f"{error_name}: {message}")
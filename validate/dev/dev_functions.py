@@ -10,11 +10,12 @@ logger = logging.getLogger(__name__)
 def DEV_load_new_DEV_value_dfs() -> Dict[str, pd.DataFrame]:
     """Load the latest available locally saved validation
     datafames into a dictionary of df_name, df value pairs.
+    Note: For complete offline runs use the replay mode instead
+    (`python validate --replay <cassette>`).
     """
     logger.warning("WORKING WITH DEV DATA FOR NEW DFs!")
     df_dict_new = {}
-    dev_values_path = Path.cwd() / "src" / "dev" / "values"
-    print(dev_values_path)
+    dev_values_path = Path(__file__).parent / "values"
     for file in dev_values_path.iterdir():
         file_name = file.name[:-11]  # truncate the timestamp
         df_dict_new[file_name] = pd.read_parquet(file)
@@ -0,0 +1,416 @@
+""" Offline backend that runs the checks against exported dumps of the
+DBs (Parquet or CSV files) with the embedded columnar engine DuckDB,
+instead of against the SQL Server. The dump folder holds one subfolder
+per DB with one file (or folder of Parquet parts) per table:
+
+    <dump folder>/SnippLoyalty_DW_Loeb/FactTrans.parquet
+    <dump folder>/bcl_loeb/EtlTransaction.csv
+
+Every DB folder is attached as a catalog with a `dbo` schema of views
+on the files, so that the three-part names of the queries resolve. The
+T-SQL specifics of `sql_queries.py` are translated by `translate_tsql`.
+Select it with a server string "duckdb:///<dump folder>" in the config.
+
+SQLite stand-in files (`<dump folder>/<db_name>.sqlite`, see
+`utils.connect_to_db`) are loaded into catalogs the same way, so that
+the value checks can run on them too (see `utils.get_value_server`).
+"""
+
+import logging
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from sqlalchemy.exc import DBAPIError
+
+from cassette import CassetteResult
+
+logger = logging.getLogger(__name__)
+
+# T-SQL types and their DuckDB counterparts, for the `CONVERT`s
+TYPE_DICT = {
+    "INT": "INTEGER",
+    "NVARCHAR": "VARCHAR",
+    "NCHAR": "VARCHAR",
+    "DATETIME": "TIMESTAMP",
+    "DATETIME2": "TIMESTAMP",
+}
+
+
+class DumpEngine:
+    """In-memory DuckDB database with views on the dump files of all
+    the DBs in the dump folder. Hands out connections (cursors of the
+    database) that use the catalog of `db_name` by default.
+    """
+
+    def __init__(self, dump_path: Union[str, Path], db_name: str):
+        import duckdb
+
+        self.dump_path = Path(dump_path)
+        self.db_name = db_name
+        self.dialect = SimpleNamespace(name="duckdb")
+        if not (
+            (self.dump_path / db_name).is_dir()
+            or (self.dump_path / f"{db_name}.sqlite").is_file()
+        ):
+            logger.error(f"No dump of {db_name} found in {self.dump_path}!")
+            raise FileNotFoundError(self.dump_path / db_name)
+        self._database = duckdb.connect(":memory:")
+        self._lock = threading.Lock()
+        for db_path in sorted(self.dump_path.iterdir()):
+            if db_path.is_dir():
+                self._attach_dump(db_path)
+            elif db_path.suffix.lower() == ".sqlite":
+                self._attach_sqlite(db_path)
+        self.temporal_columns = {
+            row[0].lower() for row in self._database.execute(
+                "SELECT DISTINCT column_name FROM information_schema.columns "
+                "WHERE data_type = 'DATE' OR data_type LIKE 'TIMESTAMP%'"
+            ).fetchall()
+        }
+
+    def connect(self) -> "DumpConnection":
+        with self._lock:
+            cursor = self._database.cursor()
+        return DumpConnection(self, cursor)
+
+    def dispose(self) -> None:
+        self._database.close()
+
+    def _attach_dump(self, db_path: Path) -> None:
+        """Attach a DB folder of the dump as catalog, with a view per
+        table file (or folder of Parquet parts).
+        """
+        catalog = _quote_identifier(db_path.name)
+        self._database.execute(f"ATTACH ':memory:' AS {catalog}")
+        self._database.execute(f"CREATE SCHEMA {catalog}.dbo")
+        n_tables = 0
+        for table_path in sorted(db_path.iterdir()):
+            if table_path.is_dir():
+                reader = f"read_parquet('{_quote_path(table_path)}/*.parquet')"
+            elif table_path.suffix.lower() == ".parquet":
+                reader = f"read_parquet('{_quote_path(table_path)}')"
+            elif table_path.suffix.lower() == ".csv":
+                reader = f"read_csv_auto('{_quote_path(table_path)}')"
+            else:
+                continue
+            self._database.execute(
+                f"CREATE VIEW {catalog}.dbo.{_quote_identifier(table_path.stem)} "
+                f"AS SELECT * FROM {reader}"
+            )
+            n_tables += 1
+        logger.debug(f"Dump of {db_path.name} attached with {n_tables} tables.")
+
+    def _attach_sqlite(self, db_path: Path) -> None:
+        """Load the tables of a SQLite stand-in file into a catalog
+        named after the file. Columns declared as dates or timestamps
+        are converted, as SQLite stores them as strings.
+        """
+        import sqlite3
+
+        import pandas as pd
+
+        catalog = _quote_identifier(db_path.stem)
+        self._database.execute(f"ATTACH ':memory:' AS {catalog}")
+        self._database.execute(f"CREATE SCHEMA {catalog}.dbo")
+        with sqlite3.connect(str(db_path)) as sqlite_connection:
+            table_names = [
+                row[0] for row in sqlite_connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' "
+                    "AND name NOT LIKE 'sqlite_%' ORDER BY name"
+                )
+            ]
+            for table_name in table_names:
+                table_df = pd.read_sql_query(
+                    f"SELECT * FROM {_quote_identifier(table_name)}",
+                    sqlite_connection
+                )
+                for row in sqlite_connection.execute(
+                    f"PRAGMA table_info({_quote_identifier(table_name)})"
+                ):
+                    if re.search(r"DATE|TIME", row[2], re.IGNORECASE):
+                        table_df[row[1]] = pd.to_datetime(table_df[row[1]])
+                self._database.register("_sqlite_table", table_df)
+                self._database.execute(
+                    f"CREATE TABLE {catalog}.dbo.{_quote_identifier(table_name)} "
+                    f"AS SELECT * FROM _sqlite_table"
+                )
+                self._database.unregister("_sqlite_table")
+        logger.debug(
+            f"SQLite stand-in {db_path.name} loaded with {len(table_names)} tables."
+        )
+
+
+class DumpConnection:
+    """Connection to the dump, with the interface of a SQLAlchemy
+    connection as used by the checks: the queries are translated from
+    T-SQL and the results are returned as plain results. DuckDB errors
+    are raised as the SQLAlchemy errors of their kind (e.g. a query
+    that does not parse or bind as `ProgrammingError`).
+    """
+
+    def __init__(self, engine: DumpEngine, cursor: Any):
+        self.engine = engine
+        self.db_name = engine.db_name
+        self.dialect = SimpleNamespace(name="duckdb")
+        self._cursor = cursor
+        self._cursor.execute(f"USE {_quote_identifier(self.db_name)}.dbo")
+        # Integer division as in T-SQL (e.g. `DateSK / 100`)
+        self._cursor.execute("SET integer_division = true")
+
+    def execute(self, query: Any, *multiparams) -> CassetteResult:
+        query = translate_tsql(str(query), self.engine.temporal_columns)
+        with _wrap_duckdb_errors(query, multiparams):
+            if len(multiparams) == 1 and isinstance(multiparams[0], list):
+                self._cursor.executemany(query, multiparams[0])
+            elif len(multiparams) > 0:
+                self._cursor.execute(query, list(multiparams))
+            else:
+                self._cursor.execute(query)
+        if self._cursor.description is None:
+            return CassetteResult([], [])
+        keys = [col[0] for col in self._cursor.description]
+        return CassetteResult(keys, self._cursor.fetchall())
+
+    def fetch_arrow_table(self, query: str) -> Any:
+        """Run a query and return its result set as an Arrow table
+        (see `arrow_fetch.py`).
+        """
+        query = translate_tsql(query, self.engine.temporal_columns)
+        with _wrap_duckdb_errors(query):
+            self._cursor.execute(query)
+            return self._cursor.to_arrow_table()
+
+    def inspect(self) -> "DumpInspector":
+        return DumpInspector(self)
+
+    def close(self) -> None:
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class DumpInspector:
+    """Stand-in for the SQLAlchemy Inspector calls used for the
+    structure checks. All the dumped objects count as tables.
+    """
+
+    def __init__(self, connection: DumpConnection):
+        self._connection = connection
+
+    def get_table_names(self) -> List[str]:
+        return [row[0] for row in self._query_catalog("table_name", "tables")]
+
+    def get_view_names(self) -> List[str]:
+        return []
+
+    def get_columns(self, name: str) -> List[Dict[str, Any]]:
+        rows = self._query_catalog(
+            "column_name, data_type",
+            "columns",
+            f"AND table_name = '{_quote_literal(name)}'"
+        )
+        return [{"name": row[0], "type": row[1]} for row in rows]
+
+    def _query_catalog(
+        self, columns: str, view: str, condition: str = ""
+    ) -> List[Tuple]:
+        cursor = self._connection._cursor
+        query = (
+            f"SELECT {columns} FROM information_schema.{view} "
+            f"WHERE table_catalog = '{_quote_literal(self._connection.db_name)}' "
+            f"AND table_schema = 'dbo' {condition} ORDER BY 1"
+        )
+        with _wrap_duckdb_errors(query):
+            cursor.execute(query)
+            return cursor.fetchall()
+
+
+@contextmanager
+def _wrap_duckdb_errors(query: str, params: Any = None) -> Iterator[None]:
+    """Raise the DuckDB errors as the SQLAlchemy errors of the same
+    DB-API kind, as the checks (and the cassettes) expect them.
+    """
+    import duckdb
+
+    try:
+        yield
+    except duckdb.Error as e:
+        raise DBAPIError.instance(query, params, e, duckdb.Error) from e
+
+
+def translate_tsql(query: str, temporal_columns: Optional[Set[str]] = None) -> str:
+    """Translate the T-SQL specifics used in `sql_queries.py` to the
+    DuckDB dialect: `DECLARE`d variables, temp tables (`#name`), `TOP`,
+    bracket quoted names, `AS 'alias'`, and the functions `CONVERT`,
+    `LEFT`, `HASHBYTES`, `ISNULL`, `CHECKSUM` and `CHECKSUM_AGG`.
+    Date strings like '20201101' compared to DATE or TIMESTAMP columns
+    (`temporal_columns`) are written as ISO dates, as DuckDB does not
+    cast them implicitly. `TOP` is only supported in the outer SELECT.
+    """
+    query = _substitute_declared_variables(query)
+    query = re.sub(
+        r"IF OBJECT_ID\('tempdb\.\.#(\w+)'\) IS NOT NULL DROP TABLE #\w+;",
+        r"DROP TABLE IF EXISTS \1;",
+        query,
+        flags=re.IGNORECASE,
+    )
+    query = re.sub(r"CREATE TABLE #(\w+)", r"CREATE TEMP TABLE \1", query, flags=re.I)
+    query = re.sub(r"#(\w+)", r"\1", query)
+    query = re.sub(
+        r"\[((?:[^\]]|\]\])+)\]",
+        lambda m: _quote_identifier(m.group(1).replace("]]", "]")),
+        query,
+    )
+    query = re.sub(r"\bAS\s+'(\w+)'", r'AS "\1"', query, flags=re.IGNORECASE)
+    query = re.sub(r"\bISNULL\s*\(", "COALESCE(", query, flags=re.IGNORECASE)
+    query = re.sub(r"\bCHECKSUM_AGG\s*\(", "bit_xor(", query, flags=re.IGNORECASE)
+    query = re.sub(r"\bCHECKSUM\s*\(", "hash(", query, flags=re.IGNORECASE)
+    query = _rewrite_calls(query)
+    query = _rewrite_top(query)
+    if temporal_columns:
+        query = _rewrite_date_literals(query, temporal_columns)
+    return query
+
+
+def _substitute_declared_variables(query: str) -> str:
+    """Drop the `DECLARE @var type = expr` lines and put the
+    expression in place of the variable.
+    """
+    variables = {}
+
+    def _declare(match: re.Match) -> str:
+        variables[match.group(1)] = match.group(2).strip()
+        return ""
+
+    query = re.sub(
+        r"^\s*DECLARE\s+@(\w+)\s+\w+(?:\s*\([\d,\s]+\))?\s*=\s*(.+?);?\s*$",
+        _declare,
+        query,
+        flags=re.IGNORECASE | re.MULTILINE,
+    )
+    for name, expr in variables.items():
+        query = re.sub(rf"@{name}\b", lambda m: f"({expr})", query)
+    return query
+
+
+def _rewrite_calls(query: str) -> str:
+    """Rewrite the calls of `CONVERT`, `LEFT` and `HASHBYTES` (also
+    nested ones), parsing their arguments with balanced parentheses.
+    """
+    pattern = re.compile(r"\b(CONVERT|LEFT|HASHBYTES)\s*\(", re.IGNORECASE)
+    result = []
+    pos = 0
+    while True:
+        match = pattern.search(query, pos)
+        if match is None:
+            result.append(query[pos:])
+            return "".join(result)
+        args, end = _split_args(query, match.end())
+        args = [_rewrite_calls(arg) for arg in args]
+        result.append(query[pos:match.start()])
+        result.append(_translate_call(match.group(1).upper(), args))
+        pos = end
+
+
+def _translate_call(function: str, args: List[str]) -> str:
+    if function == "LEFT":
+        return f"left(CAST({args[0]} AS VARCHAR), {args[1]})"
+    if function == "HASHBYTES":
+        return f"sha256(CAST({args[1]} AS VARCHAR))"
+
+    # CONVERT(type, expr[, style])
+    sql_type = re.sub(r"\s*\(.*\)", "", args[0]).upper()
+    expr = args[1]
+    style = args[2] if len(args) > 2 else None
+    if sql_type == "DATE":
+        # Date strings are expected as YYYYMMDD (or ISO)
+        return (
+            f"CAST(COALESCE(TRY_STRPTIME(CAST({expr} AS VARCHAR), '%Y%m%d'), "
+            f"TRY_CAST(CAST({expr} AS VARCHAR) AS TIMESTAMP)) AS DATE)"
+        )
+    if sql_type in ["VARCHAR", "NVARCHAR"] and style == "112":
+        return f"strftime(CAST({expr} AS TIMESTAMP), '%Y%m%d')"
+    return f"CAST({expr} AS {TYPE_DICT.get(sql_type, sql_type)})"
+
+
+def _split_args(query: str, start: int) -> Tuple[List[str], int]:
+    """Return the top-level arguments of a call whose opening
+    parenthesis ends at `start`, and the position after the call.
+    """
+    args = []
+    depth = 0
+    in_string = False
+    arg_start = start
+    for pos in range(start, len(query)):
+        char = query[pos]
+        if char == "'":
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "(":
+            depth += 1
+        elif char == ")" and depth > 0:
+            depth -= 1
+        elif char == ")":
+            args.append(query[arg_start:pos].strip())
+            return args, pos + 1
+        elif char == "," and depth == 0:
+            args.append(query[arg_start:pos].strip())
+            arg_start = pos + 1
+    logger.error(f"Unbalanced parentheses in query:\n{query}")
+    raise ValueError("Query cannot be translated to DuckDB.")
+
+
+def _rewrite_top(query: str) -> str:
+    """Replace `SELECT TOP (n)` by a `LIMIT n` at the end of the query."""
+    match = re.search(r"\bSELECT\s+TOP\s*\(?\s*(\w+)\s*\)?", query, re.IGNORECASE)
+    if match is None:
+        return query
+    query = query[:match.start()] + "SELECT " + query[match.end():]
+    return query.rstrip().rstrip(";") + f"\nLIMIT {match.group(1)};\n"
+
+
+def _rewrite_date_literals(query: str, temporal_columns: Set[str]) -> str:
+    """Write the date strings compared to DATE or TIMESTAMP columns
+    (e.g. `TrxDate BETWEEN '20201101' AND '20210430'`) as ISO dates.
+    """
+
+    def _iso(date_str: str) -> str:
+        return f"'{date_str[:4]}-{date_str[4:6]}-{date_str[6:]}'"
+
+    def _rewrite(match: re.Match) -> str:
+        column = match.group(1).split(".")[-1].strip('"').lower()
+        if column not in temporal_columns:
+            return match.group(0)
+        rewritten = f"{match.group(1)} {match.group(2)} {_iso(match.group(3))}"
+        if match.group(4) is not None:
+            rewritten += f" AND {_iso(match.group(4))}"
+        return rewritten
+
+    return re.sub(
+        r"([\w\.\"]+)\s*(BETWEEN|>=|<=|<>|!=|=|<|>)\s*'(\d{8})'"
+        r"(?:\s+AND\s+'(\d{8})')?",
+        _rewrite,
+        query,
+        flags=re.IGNORECASE,
+    )
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_literal(value: str) -> str:
+    return value.replace("'", "''")
+
+
+def _quote_path(path: Path) -> str:
+    return _quote_literal(path.as_posix())
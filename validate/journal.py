@@ -0,0 +1,63 @@
+""" Journal of the completed units of work of a run (the schema and the
+empty columns snapshot of a DB, the result of a value query). Every
+unit is saved to the data folder of the actual run as soon as it is
+done and then appended to the journal, so that a run that died can be
+resumed (`--resume`), skipping the units that are already done.
+"""
+
+import datetime as dt
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE = "journal.jsonl"
+
+
+class RunJournal:
+    """Append-only journal in the 'meta' subfolder of a data folder.
+    A new run starts with an empty journal, a resumed run takes the
+    units already journaled as done.
+    """
+
+    def __init__(self, data_path: Path, resume: bool = False):
+        self.data_path = Path(data_path)
+        self.path = self.data_path / "meta" / JOURNAL_FILE
+        self.completed = set()
+        self._lock = threading.Lock()
+        if resume and self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.completed = {
+                    json.loads(line)["unit"] for line in f if line.strip()
+                }
+            logger.info(
+                f"Resuming run from {self.data_path.name}: "
+                f"{len(self.completed)} units already done."
+            )
+        elif resume:
+            logger.warning(
+                f"No journal found in {self.data_path.name}, nothing to resume."
+            )
+        else:
+            self.path.parent.mkdir(exist_ok=True)
+            self.path.write_text("", encoding="utf-8")
+
+    def is_done(self, unit: str) -> bool:
+        return unit in self.completed
+
+    def mark_done(self, unit: str, **details: Any) -> None:
+        """Append a unit to the journal, after its results have been
+        saved, with optional details (e.g. the isolation level a value
+        snapshot was read with). The line is flushed to disk right away.
+        """
+        entry = {"unit": unit, "finished": dt.datetime.now().isoformat(), **details}
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.completed.add(unit)
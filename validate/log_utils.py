@@ -0,0 +1,213 @@
+""" Logging set-up. All handlers sit behind a queue listener running in
+its own thread, so that the checks never block on console rendering or
+disk I/O. Besides the console and the text logfile there is a JSONL
+logfile, holding the checks as data (passed with `extra={"check": ...,
+"data": ...}`) instead of pre-formatted text.
+"""
+
+import atexit
+import copy
+import datetime as dt
+import json
+import logging
+import numbers
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+from rich.errors import MarkupError
+from rich.logging import RichHandler
+from rich.markup import escape
+from rich.text import Text
+
+_listener = None
+_queue = None
+
+
+class LocalQueueHandler(QueueHandler):
+    """Queue handler for the listener thread of the same process. As by
+    the stdlib handler, the message is formatted when the record is
+    logged, so that the data passed with it (e.g. a dataframe) is
+    rendered as it is at that time, not when the listener gets to it.
+    Every argument is rendered once, for the message and for a version
+    for the rich markup with the arguments escaped, so that only the
+    markup of the message itself is interpreted. The `data` of a check
+    is only copied here and converted to JSON by the listener. The
+    records never leave the process, so the exception info is kept as
+    it is.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.rich_markup = _render_message(record)
+        record.args = None
+        if hasattr(record, "data"):
+            record.data = _snapshot(record.data)
+        return record
+
+
+class SafeRichHandler(RichHandler):
+    """Rich handler that renders the markup version of the message (see
+    `LocalQueueHandler`), and the plain message if its markup is
+    invalid (e.g. closing tags in data written into the message).
+    """
+
+    def render_message(self, record: logging.LogRecord, message: str) -> Any:
+        try:
+            return super().render_message(
+                record, getattr(record, "rich_markup", message)
+            )
+        except MarkupError:
+            record.markup = False
+            return super().render_message(record, message)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format a record as one JSON object per line. The rich markup is
+    removed from the message, the structured fields of a check are
+    taken from the `extra` attributes of the record.
+    """
+
+    extra_fields = ["check", "vendor", "db", "data"]
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": dt.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _to_plain(record),
+        }
+        for field in self.extra_fields:
+            if hasattr(record, field):
+                entry[field] = _to_json_data(getattr(record, field))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def initialize_logger(log_path: Optional[Path] = None) -> logging.Logger:
+    """Initialize logging, to console using rich for formatting,
+    to a text file and to a JSONL file. The handlers are served by a
+    queue listener, which is stopped (and flushed) at exit.
+    """
+    global _listener, _queue
+
+    log_path = log_path or Path.cwd() / "logs"
+    logger = logging.getLogger()
+    logger.setLevel(logging.DEBUG)
+    # Create a formatter (same for file and console)
+    fformatter = logging.Formatter(
+        fmt="%(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+    cformatter = logging.Formatter(
+        fmt="%(message)s",
+        datefmt="[%X]"
+    )
+    # Create console handler
+    sh = SafeRichHandler(show_time=False, show_path=False, markup=True)
+    sh.setLevel(logging.DEBUG)
+    sh.setFormatter(cformatter)
+    # Create file handlers (text and JSONL)
+    filename = (
+        f"cat_val_{dt.datetime.strftime(dt.datetime.now(), '%Y-%m-%d-%H-%M-%S')}"
+    )
+    fh = logging.FileHandler(
+        log_path / f"{filename}.log", "w", encoding=None, delay="true"
+    )
+    fh.setLevel(logging.INFO)
+    fh.setFormatter(fformatter)
+    jh = logging.FileHandler(
+        log_path / f"{filename}.jsonl", "w", encoding="utf-8", delay="true"
+    )
+    jh.setLevel(logging.INFO)
+    jh.setFormatter(JsonLinesFormatter())
+
+    # Put the handlers behind the queue
+    _queue = queue.Queue(-1)
+    logger.addHandler(LocalQueueHandler(_queue))
+    _listener = QueueListener(_queue, sh, fh, jh, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logger)
+
+    return logger
+
+
+def flush_logger() -> None:
+    """Wait until all the queued records have been handled, e.g.
+    before printing directly to the console.
+    """
+    if _listener is not None:
+        _queue.join()
+
+
+def stop_logger() -> None:
+    """Process the remaining records in the queue and stop the
+    listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _render_message(record: logging.LogRecord) -> Tuple[str, str]:
+    """Return the message of a record and its version for the rich
+    markup, with the arguments escaped. Arguments other than numbers
+    (e.g. dataframes) are converted to strings once for both.
+    """
+    if not record.args:
+        return str(record.msg), str(record.msg)
+    if isinstance(record.args, tuple):
+        args = tuple(
+            arg if isinstance(arg, numbers.Number) else str(arg) for arg in record.args
+        )
+        try:
+            return (
+                str(record.msg) % args,
+                str(record.msg) % tuple(
+                    escape(arg) if isinstance(arg, str) else arg for arg in args
+                ),
+            )
+        except (TypeError, ValueError):
+            pass
+    message = record.getMessage()
+    return message, escape(message)
+
+
+def _to_plain(record: logging.LogRecord) -> str:
+    """Return the message of a record without the rich markup (or as
+    it is, if its markup is invalid).
+    """
+    message = getattr(record, "rich_markup", record.getMessage())
+    try:
+        return Text.from_markup(message).plain.strip()
+    except MarkupError:
+        return record.getMessage().strip()
+
+
+def _snapshot(value: Any) -> Any:
+    """Return a copy of the data of a check as it is when logged, for
+    the conversion to JSON by the listener (see `_to_json_data`).
+    """
+    if hasattr(value, "to_json") and hasattr(value, "copy"):
+        return value.copy()
+    if isinstance(value, dict):
+        return {k: _snapshot(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_snapshot(v) for v in value]
+    return value
+
+
+def _to_json_data(value: Any) -> Any:
+    """Return a JSON serializable version of the value. Dataframes
+    are converted with their own JSON writer (split orientation).
+    """
+    if hasattr(value, "to_json"):
+        return json.loads(value.to_json(orient="split", date_format="iso"))
+    if isinstance(value, dict):
+        return {str(k): _to_json_data(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [_to_json_data(v) for v in value]
+    return value
@@ -0,0 +1,115 @@
+""" Runtimes of the value queries, recorded per run to
+`meta/query_runtimes.json` in the data folder of the run. The mean
+runtime of a query over the latest runs is its expected cost, used to
+start the queries longest-first (so that a long query does not become
+the tail of the run) and for the ETA of the progress display.
+"""
+
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+RUNTIMES_FILE = "query_runtimes.json"
+
+
+class QueryCosts:
+    """Expected costs of the queries (from the runtimes recorded in the
+    latest n previous runs next to the actual data folder) and recorder
+    of the runtimes of the actual run.
+    """
+
+    def __init__(self, actual_data_path: Path, n_runs: int = 5):
+        actual_data_path = Path(actual_data_path)
+        self.path = actual_data_path / "meta" / RUNTIMES_FILE
+        self.runtimes = _read_runtimes(self.path)  # kept if resumed
+        previous_paths = [
+            d for d in utils.list_validation_data_paths(actual_data_path.parent)
+            if d != actual_data_path and (d / "meta" / RUNTIMES_FILE).exists()
+        ][-n_runs:]
+        history = {}
+        for data_path in previous_paths:
+            runtimes = _read_runtimes(data_path / "meta" / RUNTIMES_FILE)
+            for q_name, seconds in runtimes.items():
+                history.setdefault(q_name, []).append(seconds)
+        self.costs = {q_name: sum(s) / len(s) for q_name, s in history.items()}
+        self._lock = threading.Lock()
+
+    def get_cost(self, q_name: str) -> float:
+        """Return the expected runtime of a query in seconds. Queries
+        without history count as the most expensive known one, so that
+        they are started early.
+        """
+        return self.costs.get(q_name, max(self.costs.values(), default=1.0))
+
+    def order_longest_first(self, q_names: List[str]) -> List[str]:
+        """Return the query names sorted by decreasing expected cost,
+        the order of the queries with equal costs is kept.
+        """
+        return sorted(q_names, key=self.get_cost, reverse=True)
+
+    def record(self, q_name: str, seconds: float) -> None:
+        with self._lock:
+            self.runtimes[q_name] = round(seconds, 3)
+            self.path.parent.mkdir(exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.runtimes, f, indent=2)
+
+    @contextmanager
+    def progress(
+        self, q_names: List[str], n_workers: int
+    ) -> Iterator[Callable[[str], None]]:
+        """Show a progress bar of the queries weighted by their expected
+        costs, so that its ETA is based on the historical runtimes.
+        Yield the function to call with the name of a finished query.
+        """
+        from rich.progress import (
+            BarColumn,
+            Progress,
+            TextColumn,
+            TimeRemainingColumn,
+        )
+
+        costs = {q_name: self.get_cost(q_name) for q_name in q_names}
+        longest = ", ".join(
+            f"{q_name} ({costs[q_name]:.0f}s)"
+            for q_name in self.order_longest_first(q_names)[:3]
+        )
+        logger.debug(
+            f"Expected runtime of the value queries {sum(costs.values()):.0f}s "
+            f"on {n_workers} worker(s), longest: {longest}."
+        )
+        with Progress(
+            TextColumn("{task.description}"),
+            BarColumn(),
+            TextColumn("{task.fields[n_done]}/{task.fields[n_queries]} queries"),
+            TimeRemainingColumn(),
+            transient=True
+        ) as progress:
+            task = progress.add_task(
+                "Value queries",
+                total=sum(costs.values()),
+                n_done=0,
+                n_queries=len(costs)
+            )
+            n_done = 0
+
+            def done(q_name: str) -> None:
+                nonlocal n_done
+                n_done += 1
+                progress.update(task, advance=costs[q_name], n_done=n_done)
+
+            yield done
+
+
+def _read_runtimes(path: Path) -> Dict[str, float]:
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
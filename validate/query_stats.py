@@ -0,0 +1,172 @@
+""" Read isolation per check and instrumentation of the queries. Before
+a check runs, the isolation level configured for it is set on its
+connection, and the lock wait time of the session is read before and
+after (in the same batches as the level is set and restored), so that
+a slow query can be told to be blocked or scanning. The isolation
+level, the lock wait and the duration of every check are recorded to
+`meta/query_stats.jsonl` in the data folder of the run (the lock wait
+as null for the checks that run on a session of their own, see
+`track_query`). The level of a value snapshot is journaled with it.
+"""
+
+import datetime as dt
+import json
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import utils
+from sql_queries import (
+    query_session_isolation_level,
+    query_set_isolation_level_lock_wait_template,
+)
+
+logger = logging.getLogger(__name__)
+
+QUERY_STATS_FILE = "query_stats.jsonl"
+
+ISOLATION_LEVELS = [
+    "READ UNCOMMITTED",
+    "READ COMMITTED",
+    "REPEATABLE READ",
+    "SNAPSHOT",
+    "SERIALIZABLE",
+]
+
+# Isolation levels by their number in `sys.dm_exec_sessions`
+SESSION_ISOLATION_LEVELS = {
+    1: "READ UNCOMMITTED",
+    2: "READ COMMITTED",
+    3: "REPEATABLE READ",
+    4: "SERIALIZABLE",
+    5: "SNAPSHOT",
+}
+
+
+class QueryStats:
+    """Isolation levels of the checks (from the `ISOLATION_LEVELS`
+    section of the config, a `DEFAULT` for the run and overrides by
+    check name) and recorder of the query stats of a run. Keeps the
+    isolation level of every session, read once per connection.
+    """
+
+    def __init__(
+        self,
+        data_path: Path,
+        isolation_levels: Optional[Dict[str, str]] = None
+    ):
+        self.path = Path(data_path) / "meta" / QUERY_STATS_FILE
+        self.isolation_levels = {
+            name: level.upper() for name, level in (isolation_levels or {}).items()
+        }
+        for name, level in self.isolation_levels.items():
+            if level not in ISOLATION_LEVELS:
+                logger.error(f"Unknown isolation level '{level}' for '{name}'.")
+                raise ValueError(f"Isolation level must be one of {ISOLATION_LEVELS}.")
+        self._lock = threading.Lock()
+        self._session_levels = weakref.WeakKeyDictionary()
+
+    def get_session_isolation_level(self, connection: Any) -> str:
+        """Return the isolation level of the session of a connection
+        outside the checks, read from the DB on first use only (the
+        checks restore it when done).
+        """
+        with self._lock:
+            session_level = self._session_levels.get(connection)
+        if session_level is None:
+            session_level = SESSION_ISOLATION_LEVELS.get(
+                connection.execute(query_session_isolation_level).scalar(),
+                "READ COMMITTED"
+            )
+            with self._lock:
+                self._session_levels[connection] = session_level
+        return session_level
+
+    def get_isolation_level(self, check: str) -> str:
+        """Return the isolation level of a check. The partitions of a
+        check (`name[...]`) use the level of the check.
+        """
+        check = check.split("[", 1)[0]
+        return self.isolation_levels.get(
+            check, self.isolation_levels.get("DEFAULT", "READ COMMITTED")
+        )
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self.path.parent.mkdir(exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+
+@contextmanager
+def track_query(
+    connection: Any,
+    check: str,
+    query_stats: Optional[QueryStats],
+    on_connection: bool = True
+) -> Iterator[Optional[str]]:
+    """Set the isolation level of the check on the connection, and
+    record its lock wait time and duration when done (also if it
+    fails), then restore the previous level of the session. Yield the
+    isolation level. If the check runs on a session of its own instead
+    (`on_connection=False`, e.g. the Arrow fetch on SQL Server), the
+    isolation level is only yielded, to be set on that session, and
+    the lock wait is not measured. Without query stats (or for other
+    DBs than SQL Server) nothing is done.
+    """
+    if query_stats is None or utils.get_dialect_name(connection) != "mssql":
+        yield None
+        return
+
+    isolation_level = query_stats.get_isolation_level(check)
+    if on_connection:
+        session_level = query_stats.get_session_isolation_level(connection)
+        lock_wait_before = _set_isolation_level(connection, isolation_level)
+    started = time.perf_counter()
+    error = None
+    try:
+        yield isolation_level
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        lock_wait_ms = None
+        if on_connection:
+            try:
+                # The level stays set on the (pooled) session otherwise
+                lock_wait_after = _set_isolation_level(connection, session_level)
+                lock_wait_ms = int(lock_wait_after - lock_wait_before)
+            except Exception:
+                if error is None:
+                    raise
+                # Keep the error of the check, not the one of the clean-up
+                logger.warning(f"{check}: isolation level of the session not reset.")
+        query_stats.record({
+            "check": check,
+            "isolation_level": isolation_level,
+            "lock_wait_ms": lock_wait_ms,
+            "duration_s": round(duration, 3),
+            "finished": dt.datetime.now().isoformat(),
+            "error": error,
+        })
+    if lock_wait_ms is not None and lock_wait_ms > 1000 * duration / 2:
+        logger.warning(
+            f"{check} was blocked for {lock_wait_ms / 1000:.1f}s "
+            f"of {duration:.1f}s (isolation level {isolation_level})."
+        )
+
+
+def _set_isolation_level(connection: Any, isolation_level: str) -> int:
+    """Set the isolation level of the session and return its lock wait
+    time so far, in one round trip.
+    """
+    return connection.execute(
+        query_set_isolation_level_lock_wait_template.format(
+            isolation_level=isolation_level
+        )
+    ).scalar()
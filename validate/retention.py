@@ -0,0 +1,259 @@
+""" Index, retention and compaction of the stored validation runs. The
+runs are listed in `runs_index.json` in the data folder, together with
+their status (live or archived), so that no directory scan is needed
+to find a run. As runs may be deleted, copied or renamed by hand, the
+index is reconciled with the run folders on disk on compaction (and on
+request). The latest runs are kept as they are; older ones are packed
+into compressed archives in the `archive` subfolder. Their structure snapshots (often
+identical from run to run) are stored only once, content-addressed by
+their SHA-256 in the `objects` subfolder, and only referenced from the
+archives (objects no archive references anymore are swept on
+compaction). An archived run is restored automatically when needed.
+"""
+
+import datetime as dt
+import hashlib
+import io
+import json
+import logging
+import re
+import shutil
+import tarfile
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "runs_index.json"
+RUN_NAME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}_catalyst_validation_data$")
+OBJECTS_MANIFEST = "structure_objects.json"
+
+LIVE = "live"
+ARCHIVED = "archived"
+
+
+def load_runs_index(
+    data_path: Union[str, Path],
+    reconcile: bool = False
+) -> Dict[str, str]:
+    """Return the stored runs (name: live / archived), sorted from
+    oldest to newest, as listed in the index. The index is only
+    reconciled with the run folders and archives on disk if it is
+    missing or if requested (on compaction, or with `list-runs
+    --reconcile`), so that the lookup does not grow with the archives.
+    """
+    data_path = Path(data_path)
+    if not data_path.exists():
+        return {}
+    index_path = data_path / INDEX_FILE
+    if reconcile or not index_path.exists():
+        return reconcile_runs_index(data_path)
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)["runs"]
+
+
+def reconcile_runs_index(data_path: Union[str, Path]) -> Dict[str, str]:
+    """Rebuild the index from the run folders and archives on disk, so
+    that run folders deleted, copied or renamed by hand are taken into
+    account, and rewrite it if it is stale (or missing).
+    """
+    data_path = Path(data_path)
+    index_path = data_path / INDEX_FILE
+    runs_indexed = {}
+    if index_path.exists():
+        with open(index_path, "r", encoding="utf-8") as f:
+            runs_indexed = json.load(f)["runs"]
+    runs = {
+        d.name: LIVE for d in data_path.iterdir()
+        if d.is_dir() and RUN_NAME_PATTERN.match(d.name)
+    }
+    if (data_path / "archive").exists():
+        for archive_path in (data_path / "archive").glob("*.tar.gz"):
+            runs.setdefault(archive_path.name[:-len(".tar.gz")], ARCHIVED)
+    runs = dict(sorted(runs.items()))
+    if runs != runs_indexed and (len(runs) > 0 or index_path.exists()):
+        if index_path.exists() and set(runs) != set(runs_indexed):
+            logger.debug(
+                f"Runs index reconciled with {data_path}: "
+                f"{len(set(runs_indexed) - set(runs))} runs dropped, "
+                f"{len(set(runs) - set(runs_indexed))} runs added."
+            )
+        elif not index_path.exists():
+            logger.debug(f"Index of {len(runs)} runs built in {data_path}.")
+        save_runs_index(data_path, runs)
+    return runs
+
+
+def save_runs_index(data_path: Union[str, Path], runs: Dict[str, str]) -> None:
+    """Write the index (to a temporary file first, so that it is never
+    left half written).
+    """
+    index_path = Path(data_path) / INDEX_FILE
+    tmp_path = index_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"runs": dict(sorted(runs.items()))}, f, indent=2)
+    tmp_path.replace(index_path)
+
+
+def is_run_stored(data_path: Path, run_name: str, status: str) -> bool:
+    """Return True if the folder (or archive) of an indexed run exists."""
+    if status == ARCHIVED:
+        return (data_path / "archive" / f"{run_name}.tar.gz").exists()
+    return (data_path / run_name).is_dir()
+
+
+def register_run(data_path: Union[str, Path], run_name: str) -> None:
+    runs = load_runs_index(data_path)
+    if runs.get(run_name) != LIVE:
+        runs[run_name] = LIVE
+        save_runs_index(data_path, runs)
+
+
+def compact_runs(
+    data_path: Union[str, Path],
+    keep_runs: int,
+    actual_run_name: Optional[str] = None
+) -> List[str]:
+    """Archive all the live runs but the latest `keep_runs` ones (and
+    the actual one). Return the names of the archived runs.
+    """
+    data_path = Path(data_path)
+    runs = load_runs_index(data_path, reconcile=True)
+    live_runs = [name for name, status in runs.items() if status == LIVE]
+    to_archive = [
+        name for name in live_runs[:max(len(live_runs) - keep_runs, 0)]
+        if name != actual_run_name
+    ]
+    for run_name in to_archive:
+        archive_run(data_path, run_name)
+    if len(to_archive) > 0:
+        logger.info(
+            f"{len(to_archive)} runs archived, the latest {keep_runs} runs are kept."
+        )
+    sweep_objects(data_path)
+    return to_archive
+
+
+def sweep_objects(data_path: Union[str, Path]) -> List[str]:
+    """Remove the objects from the object store that no archive
+    references anymore (e.g. after a run has been restored or its
+    archive deleted). Return the digests of the removed objects.
+    """
+    data_path = Path(data_path)
+    objects_path = data_path / "objects"
+    if not objects_path.exists():
+        return []
+    referenced = set()
+    if (data_path / "archive").exists():
+        for archive_path in (data_path / "archive").glob("*.tar.gz"):
+            referenced.update(_read_archive_manifest(archive_path).values())
+    removed = [
+        file.name for file in objects_path.iterdir()
+        if file.is_file() and file.name not in referenced
+    ]
+    for digest in removed:
+        (objects_path / digest).unlink()
+    if len(removed) > 0:
+        logger.debug(f"{len(removed)} unreferenced structure objects removed.")
+    return removed
+
+
+def archive_run(data_path: Path, run_name: str) -> Path:
+    """Pack a run into `archive/<run>.tar.gz` and remove its folder.
+    The structure snapshots are moved to the object store, the archive
+    holds their digests only.
+    """
+    run_path = data_path / run_name
+    archive_path = data_path / "archive" / f"{run_name}.tar.gz"
+    archive_path.parent.mkdir(exist_ok=True)
+    manifest = {}
+    if (run_path / "structure").exists():
+        for file in sorted((run_path / "structure").iterdir()):
+            manifest[file.name] = _store_object(data_path, file)
+
+    tmp_path = archive_path.with_suffix(".tmp")
+    with tarfile.open(tmp_path, "w:gz") as tar:
+        for file in sorted(run_path.rglob("*")):
+            if file.is_file() and file.parent != run_path / "structure":
+                tar.add(file, arcname=file.relative_to(run_path).as_posix())
+        manifest_bytes = json.dumps(manifest, indent=2).encode("utf-8")
+        tar_info = tarfile.TarInfo(OBJECTS_MANIFEST)
+        tar_info.size = len(manifest_bytes)
+        tar_info.mtime = int(dt.datetime.now().timestamp())
+        tar.addfile(tar_info, io.BytesIO(manifest_bytes))
+    # Check the archive before the run folder is removed
+    with tarfile.open(tmp_path, "r:gz") as tar:
+        tar.getmembers()
+    tmp_path.replace(archive_path)
+    # Copy of the manifest next to the archive, for the object sweep
+    with open(_get_manifest_path(archive_path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(run_path)
+
+    runs = load_runs_index(data_path)
+    runs[run_name] = ARCHIVED
+    save_runs_index(data_path, runs)
+    logger.debug(f"{run_name} archived ({len(manifest)} structure objects).")
+    return archive_path
+
+
+def restore_run(data_path: Path, run_name: str) -> Path:
+    """Unpack an archived run into its folder again, with its
+    structure snapshots taken from the object store.
+    """
+    run_path = data_path / run_name
+    archive_path = data_path / "archive" / f"{run_name}.tar.gz"
+    with tarfile.open(archive_path, "r:gz") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(run_path, filter="data")
+        else:
+            tar.extractall(run_path)
+    manifest_path = run_path / OBJECTS_MANIFEST
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    (run_path / "structure").mkdir(exist_ok=True)
+    for file_name, digest in manifest.items():
+        shutil.copy2(data_path / "objects" / digest, run_path / "structure" / file_name)
+    manifest_path.unlink()
+    archive_path.unlink()
+    if _get_manifest_path(archive_path).exists():
+        _get_manifest_path(archive_path).unlink()
+
+    runs = load_runs_index(data_path)
+    runs[run_name] = LIVE
+    save_runs_index(data_path, runs)
+    logger.info(f"{run_name} restored from its archive.")
+    return run_path
+
+
+def _read_archive_manifest(archive_path: Path) -> Dict[str, str]:
+    """Return the structure objects (file name: digest) referenced by
+    an archive, from the copy of its manifest next to it if there is
+    one (else from the archive itself).
+    """
+    manifest_path = _get_manifest_path(archive_path)
+    if manifest_path.exists():
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    with tarfile.open(archive_path, "r:gz") as tar:
+        return json.load(tar.extractfile(OBJECTS_MANIFEST))
+
+
+def _get_manifest_path(archive_path: Path) -> Path:
+    return archive_path.with_name(
+        archive_path.name[:-len(".tar.gz")] + "." + OBJECTS_MANIFEST
+    )
+
+
+def _store_object(data_path: Path, file: Path) -> str:
+    """Store a file in the object store (if not there yet) and return
+    its digest.
+    """
+    digest = hashlib.sha256(file.read_bytes()).hexdigest()
+    object_path = data_path / "objects" / digest
+    if not object_path.exists():
+        object_path.parent.mkdir(exist_ok=True)
+        tmp_path = object_path.with_suffix(".tmp")
+        shutil.copy2(file, tmp_path)
+        tmp_path.replace(object_path)
+    return digest
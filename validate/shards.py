@@ -0,0 +1,207 @@
+""" Sharded execution of the validation. The DBs are split into shards
+(by server or by vendor), each shard is validated by its own worker
+process, which writes its snapshots and its JSONL report to a shared
+results location. The coordinator merges the shard results into the
+data folder of the actual run (one snapshot) and into one report.
+"""
+
+import datetime as dt
+import json
+import logging
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+SHARD_RESULT_FILE = "shard_result.json"
+
+
+def get_shard_configs(config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return a config per shard, with the settings SERVER, DB_LIST
+    and VENDOR_LIST of the shard. The shards are either defined
+    explicitly in the `SHARDS` section of the config (a list with a
+    NAME and the settings above for each shard), or derived by vendor
+    from the DB_LIST, using the vendor name contained in the DB names.
+    """
+    shard_configs = {}
+    if "SHARDS" in config:
+        for shard in config["SHARDS"]:
+            shard_config = dict(config)
+            shard_config.pop("SHARDS")
+            for section in ["SERVER", "DB_LIST", "VENDOR_LIST"]:
+                if section in shard:
+                    shard_config[section] = shard[section]
+            shard_configs[shard["NAME"]] = shard_config
+        return shard_configs
+
+    for vendor in config["VENDOR_LIST"]:
+        db_list = [db for db in config["DB_LIST"] if vendor.lower() in db.lower()]
+        if len(db_list) == 0:
+            logger.warning(f"No DBs found for vendor {vendor}, shard skipped.")
+            continue
+        shard_config = dict(config)
+        shard_config["DB_LIST"] = db_list
+        shard_config["VENDOR_LIST"] = [vendor]
+        shard_configs[vendor.lower()] = shard_config
+    return shard_configs
+
+
+def get_shard_data_path(results_path: Path, shard_name: str) -> Path:
+    """Create (if needed) and return the data folder of a shard in
+    the results location, with the same subfolders as the data
+    folder of a run.
+    """
+    shard_data_path = Path(results_path) / shard_name
+    shard_data_path.mkdir(parents=True, exist_ok=True)
+    utils.create_validation_data_subdirs(shard_data_path)
+    return shard_data_path
+
+
+def write_shard_result(
+    shard_data_path: Path,
+    shard_name: str,
+    status: str,
+    started: dt.datetime,
+    error: Optional[str] = None
+) -> None:
+    """Write the outcome of a shard worker next to its results."""
+    shard_result = {
+        "shard": shard_name,
+        "status": status,
+        "started": started.isoformat(),
+        "finished": dt.datetime.now().isoformat(),
+        "error": error,
+    }
+    with open(shard_data_path / SHARD_RESULT_FILE, "w") as f:
+        json.dump(shard_result, f, indent=2)
+
+
+def start_shard_workers(
+    shard_names: List[str],
+    results_path: Path,
+    phases: List[str],
+    n_processes: int
+) -> Dict[str, int]:
+    """Run a local worker process per shard (at most n_processes at
+    the same time) and return the exit codes by shard name. The
+    console output of every worker goes to a file in its shard folder.
+    """
+    main_path = Path(__file__).resolve().parent
+    pending = list(shard_names)
+    running = {}
+    exit_codes = {}
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < n_processes:
+            shard_name = pending.pop(0)
+            # Start from scratch, results of an earlier run are replaced
+            shutil.rmtree(Path(results_path) / shard_name, ignore_errors=True)
+            shard_data_path = get_shard_data_path(results_path, shard_name)
+            console_file = open(shard_data_path / "console.txt", "w")
+            process = subprocess.Popen(
+                [
+                    sys.executable, str(main_path), "shard-worker",
+                    "--shard", shard_name,
+                    "--results-dir", str(results_path),
+                    "--phases", *phases,
+                ],
+                stdout=console_file,
+                stderr=subprocess.STDOUT
+            )
+            running[shard_name] = (process, console_file)
+            logger.info(f"Worker for shard '{shard_name}' started (pid {process.pid}).")
+        for shard_name, (process, console_file) in list(running.items()):
+            try:
+                exit_codes[shard_name] = process.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                continue
+            console_file.close()
+            running.pop(shard_name)
+            logger.info(
+                f"Worker for shard '{shard_name}' finished "
+                f"with exit code {exit_codes[shard_name]}."
+            )
+    return exit_codes
+
+
+def merge_shard_results(
+    results_path: Path,
+    actual_data_path: Path,
+    shard_names: Optional[List[str]] = None,
+    exit_codes: Optional[Dict[str, int]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """Merge the snapshots of all the shards in the results location
+    into the data folder of the actual run, and their JSONL reports
+    into one `report.jsonl` in that folder (each line tagged with the
+    shard name). Return the outcome of every shard, including the
+    number of log records per level. Expected shards without a result
+    (e.g. their worker crashed or was killed) and shards whose worker
+    exited with an error code count as failed.
+    """
+    exit_codes = exit_codes or {}
+    shard_names = shard_names or []
+    shard_data_paths = {
+        shard_name: Path(results_path) / shard_name for shard_name in shard_names
+    }
+    if Path(results_path).exists():
+        for path in Path(results_path).iterdir():
+            if path.is_dir():
+                shard_data_paths.setdefault(path.name, path)
+
+    shard_results = {}
+    report_lines = []
+    for shard_name, shard_data_path in sorted(shard_data_paths.items()):
+        result_file = shard_data_path / SHARD_RESULT_FILE
+        if result_file.exists():
+            with open(result_file, "r") as f:
+                shard_result = json.load(f)
+            shard_name = shard_result["shard"]
+        elif shard_name in shard_names:
+            shard_result = {
+                "shard": shard_name,
+                "status": "failed",
+                "started": None,
+                "finished": None,
+                "error": "no shard result, the worker crashed or was killed",
+            }
+        else:
+            continue
+        exit_code = exit_codes.get(shard_name, 0)
+        if exit_code != 0 and shard_result["status"] == "ok":
+            shard_result["status"] = "failed"
+            shard_result["error"] = f"worker exited with code {exit_code}"
+        if shard_name in exit_codes:
+            shard_result["exit_code"] = exit_code
+
+        if not shard_data_path.exists():
+            shard_result["level_counts"] = {}
+            shard_results[shard_name] = shard_result
+            continue
+        for sub in ["structure", "values", "drilldown"]:
+            if not (shard_data_path / sub).exists():
+                continue
+            for file in (shard_data_path / sub).iterdir():
+                shutil.copy2(file, actual_data_path / sub / file.name)
+
+        level_counts = {}
+        for jsonl_file in sorted(shard_data_path.glob("*.jsonl")):
+            with open(jsonl_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    entry["shard"] = shard_name
+                    level = entry["level"]
+                    level_counts[level] = level_counts.get(level, 0) + 1
+                    report_lines.append(json.dumps(entry, default=str))
+        shard_result["level_counts"] = level_counts
+        shard_results[shard_name] = shard_result
+
+    with open(actual_data_path / "report.jsonl", "w", encoding="utf-8") as f:
+        f.write("\n".join(report_lines) + ("\n" if len(report_lines) > 0 else ""))
+    logger.debug(
+        f"{len(shard_results)} shard results merged into {actual_data_path}."
+    )
+    return shard_results
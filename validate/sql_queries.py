@@ -147,7 +147,28 @@ FROM SnippLoyalty_DW_PKZ.dbo.DimMember
 WHERE MemberAK > 0;
 """
 
-# 3 Random Customers (AKs), DM Loeb
+# Note: The member and product checks run on a sample of entities. The
+# `pick` queries select the sample, the first time, as the entities
+# with 2019 transactions and the lowest hashes of their keys, so that
+# the sample is stable. The sample keys are shipped to the temp table
+# `#sample_keys` in one batch, and the `summary` queries join on it.
+
+# Sampled Customers (AKs), DM Loeb
+query_pick_loeb_dm_members = """
+SELECT TOP ({sample_size})
+    dm.MemberAK AS "sample_key"
+FROM SnippLoyalty_DW_LOEB.dbo.DimMember AS dm
+WHERE dm.MemberAK > 0
+    AND EXISTS (
+        SELECT 1
+        FROM SnippLoyalty_DW_LOEB.dbo.FactTrans AS ft
+        WHERE ft.MemberSK = dm.MemberSK
+            AND ft.DateSK BETWEEN 20190101 AND 20191231
+    )
+GROUP BY dm.MemberAK
+ORDER BY HASHBYTES('SHA2_256', CONVERT(VARCHAR(20), dm.MemberAK));
+"""
+
 query_val_loeb_dm_members = """
 SELECT
     dm.MemberAK AS "member_AK",
@@ -155,16 +176,32 @@ SELECT
     SUM(ft.TotalValue) AS "total_value_19",
     COUNT(DISTINCT ft.TrxID) AS "n_trx_19",
     CONVERT(DATE, CURRENT_TIMESTAMP, 23) AS "date_db_check"
-FROM SnippLoyalty_DW_LOEB.dbo.DimMember AS dm
+FROM #sample_keys AS sk
+JOIN SnippLoyalty_DW_LOEB.dbo.DimMember AS dm
+    ON dm.MemberAK = sk.sample_key
 JOIN SnippLoyalty_DW_LOEB.dbo.FactTrans AS ft
     ON dm.MemberSK = ft.MemberSK
-WHERE dm.MemberAK IN (1217116, 1454182, 1812069)
-    AND ft.DateSK BETWEEN 20190101 AND 20191231
+WHERE ft.DateSK BETWEEN 20190101 AND 20191231
 GROUP BY dm.MemberAK
 ORDER BY "member_AK";
 """
 
-# 3 Random Customers (AKs), DM PKZ
+# Sampled Customers (AKs), DM PKZ
+query_pick_pkz_dm_members = """
+SELECT TOP ({sample_size})
+    dm.MemberAK AS "sample_key"
+FROM SnippLoyalty_DW_PKZ.dbo.DimMember AS dm
+WHERE dm.MemberAK > 0
+    AND EXISTS (
+        SELECT 1
+        FROM SnippLoyalty_DW_PKZ.dbo.FactTrans AS ft
+        WHERE ft.MemberSK = dm.MemberSK
+            AND ft.DateSK BETWEEN 20190101 AND 20191231
+    )
+GROUP BY dm.MemberAK
+ORDER BY HASHBYTES('SHA2_256', CONVERT(VARCHAR(20), dm.MemberAK));
+"""
+
 query_val_pkz_dm_members = """
 SELECT
     dm.MemberAK AS "member_AK",
@@ -172,11 +209,12 @@ SELECT
     SUM(ft.TotalValue) AS "total_value_19",
     COUNT(DISTINCT ft.TrxID) AS "n_trx_19",
     CONVERT(DATE, CURRENT_TIMESTAMP, 23) AS "date_db_check"
-FROM SnippLoyalty_DW_PKZ.dbo.FactTrans AS ft
+FROM #sample_keys AS sk
 JOIN SnippLoyalty_DW_PKZ.dbo.DimMember AS dm
+    ON dm.MemberAK = sk.sample_key
+JOIN SnippLoyalty_DW_PKZ.dbo.FactTrans AS ft
     ON dm.MemberSK = ft.MemberSK
-WHERE dm.MemberAK IN (864669, 1088855, 1750360)
-    AND ft.DateSK BETWEEN 20190101 AND 20191231
+WHERE ft.DateSK BETWEEN 20190101 AND 20191231
 GROUP BY dm.MemberAK
 ORDER BY dm.MemberAK;
 """
@@ -186,23 +224,54 @@ ORDER BY dm.MemberAK;
 # PRODUCTS #
 ############
 
-# 3 Random Products (AKs), DM Loeb - join on DimProd
+# Sampled Products (AKs), DM Loeb - join on DimProd
+query_pick_loeb_dm_products = """
+SELECT TOP ({sample_size})
+    dti.TransactionItemAK AS "sample_key"
+FROM SnippLoyalty_DW_LOEB.dbo.DimTransactionItem AS dti
+WHERE EXISTS (
+        SELECT 1
+        FROM SnippLoyalty_DW_LOEB.dbo.FactTransItem AS fti
+        WHERE fti.TransactionItemSK = dti.TransactionItemSK
+            AND fti.DateSK BETWEEN 20190101 AND 20191231
+    )
+GROUP BY dti.TransactionItemAK
+ORDER BY HASHBYTES('SHA2_256', CONVERT(VARCHAR(20), dti.TransactionItemAK));
+"""
+
 query_val_loeb_dm_products = """
 SELECT
     dti.TransactionItemAK AS "transaction_item_AK",
     SUM(fti.Amount) AS "total_value_19",
     COUNT(DISTINCT fti.TrxID) AS "n_trx_19",
     CONVERT(DATE, CURRENT_TIMESTAMP, 23) AS "date_db_check"
-FROM SnippLoyalty_DW_LOEB.dbo.DimTransactionItem AS dti
+FROM #sample_keys AS sk
+JOIN SnippLoyalty_DW_LOEB.dbo.DimTransactionItem AS dti
+    ON dti.TransactionItemAK = sk.sample_key
 JOIN SnippLoyalty_DW_LOEB.dbo.FactTransItem AS fti
     ON dti.TransactionItemSK = fti.TransactionItemSK
-WHERE dti.TransactionItemAK IN (59742179, 64335210, 64767450)
-    AND fti.DateSK BETWEEN 20190101 AND 20191231
+WHERE fti.DateSK BETWEEN 20190101 AND 20191231
 GROUP BY dti.TransactionItemAK
 ORDER BY transaction_item_AK;
 """
 
-# 3 Random Products (TICode), DM PKZ - join on DTI
+# Sampled Products (TICode), DM PKZ - join on DTI
+query_pick_pkz_dm_products = """
+SELECT TOP ({sample_size})
+    dti.TransactionItemCode AS "sample_key"
+FROM SnippLoyalty_DW_PKZ.dbo.DimTransactionItem AS dti
+WHERE EXISTS (
+        SELECT 1
+        FROM SnippLoyalty_DW_PKZ.dbo.FactTransItem AS fti
+        WHERE fti.TransactionItemSK = dti.TransactionItemSK
+            AND fti.TransactionStatusSK = 2
+            AND fti.TransactionTypeSK IN (1)
+            AND fti.DateSK BETWEEN 20190101 AND 20191231
+    )
+GROUP BY dti.TransactionItemCode
+ORDER BY HASHBYTES('SHA2_256', dti.TransactionItemCode);
+"""
+
 query_val_pkz_dm_products = """
 WITH trx_2019 AS (
 SELECT
@@ -215,13 +284,14 @@ SELECT
        AnalysisCode13,
     fti.Quantity,
     fti.Amount
-FROM SnippLoyalty_DW_PKZ.dbo.FactTransItem AS fti
+FROM #sample_keys AS sk
    JOIN SnippLoyalty_DW_PKZ.dbo.DimTransactionItem AS dti
+    ON dti.TransactionItemCode = sk.sample_key
+   JOIN SnippLoyalty_DW_PKZ.dbo.FactTransItem AS fti
     ON dti.TransactionItemSK = fti. TransactionItemSK
 WHERE fti.TransactionStatusSK = 2
     AND fti.TransactionTypeSK IN (1)
     AND fti.DateSK BETWEEN 20190101 AND 20191231
-    AND dti.TransactionItemCode in ('04240169996', '17207270743', '00506038507')
 )
 
 SELECT
@@ -263,18 +333,763 @@ SELECT ISNULL(
 """
 
 
+#############
+# STRUCTURE #
+#############
+
+# Histogram steps of all user table statistics in the dbo schema (as
+# reflected by the inspector), by leading column (used for the empty
+# columns check based on statistics)
+query_stats_histograms = """
+SELECT
+    o.name AS "table_name",
+    c.name AS "column_name",
+    CONVERT(NVARCHAR(4000), h.range_high_key) AS "range_high_key",
+    h.equal_rows AS "equal_rows",
+    h.range_rows AS "range_rows"
+FROM sys.stats AS s
+JOIN sys.objects AS o
+    ON s.object_id = o.object_id
+JOIN sys.schemas AS sch
+    ON o.schema_id = sch.schema_id
+JOIN sys.stats_columns AS sc
+    ON s.object_id = sc.object_id
+    AND s.stats_id = sc.stats_id
+    AND sc.stats_column_id = 1
+JOIN sys.columns AS c
+    ON sc.object_id = c.object_id
+    AND sc.column_id = c.column_id
+CROSS APPLY sys.dm_db_stats_histogram(s.object_id, s.stats_id) AS h
+WHERE o.type = 'U'
+    AND sch.name = 'dbo';
+"""
+
+
+# Indexes of the given tables (completed with `str.format()`) with key
+# and included columns, disabled flag, fragmentation (max over the
+# partitions, LIMITED scan) and the last update of their statistics
+query_index_health_template = """
+SELECT
+    t.name AS "table_name",
+    i.name AS "index_name",
+    i.type_desc AS "index_type",
+    i.is_disabled AS "is_disabled",
+    STUFF((
+        SELECT ', ' + c.name
+        FROM sys.index_columns AS ic
+        JOIN sys.columns AS c
+            ON ic.object_id = c.object_id
+            AND ic.column_id = c.column_id
+        WHERE ic.object_id = i.object_id
+            AND ic.index_id = i.index_id
+            AND ic.is_included_column = 0
+        ORDER BY ic.key_ordinal
+        FOR XML PATH('')
+    ), 1, 2, '') AS "key_columns",
+    STUFF((
+        SELECT ', ' + c.name
+        FROM sys.index_columns AS ic
+        JOIN sys.columns AS c
+            ON ic.object_id = c.object_id
+            AND ic.column_id = c.column_id
+        WHERE ic.object_id = i.object_id
+            AND ic.index_id = i.index_id
+            AND ic.is_included_column = 1
+        ORDER BY c.name
+        FOR XML PATH('')
+    ), 1, 2, '') AS "included_columns",
+    ps.fragmentation_pct AS "fragmentation_pct",
+    ps.page_count AS "page_count",
+    STATS_DATE(i.object_id, i.index_id) AS "stats_updated"
+FROM sys.indexes AS i
+JOIN sys.tables AS t
+    ON t.object_id = i.object_id
+OUTER APPLY (
+    SELECT
+        MAX(avg_fragmentation_in_percent) AS fragmentation_pct,
+        SUM(page_count) AS page_count
+    FROM sys.dm_db_index_physical_stats(
+        DB_ID(), i.object_id, i.index_id, NULL, 'LIMITED'
+    )
+) AS ps
+WHERE t.name IN ({table_names})
+    AND i.type > 0
+ORDER BY t.name, i.name;
+"""
+
+# Number of rows of a table from the partition metadata, without a scan
+# (completed with `str.format()`, used to choose an exact profile for
+# small tables)
+query_table_row_count_template = """
+SELECT SUM(row_count) AS "n_rows"
+FROM sys.dm_db_partition_stats
+WHERE object_id = OBJECT_ID({table_name})
+    AND index_id IN (0, 1);
+"""
+
+
+##################
+# RECONCILIATION #
+##################
+
+# Note: The templates below are completed with `str.format()` for the
+# server-side reconciliation of two fact tables (pushdown mode). They
+# use the same filters as the value queries above.
+
+# DB names per vendor, as used in the three-part names of the queries
+vendor_db_dict = {
+    "loeb": {"DM": "SnippLoyalty_DW_Loeb", "bcl": "bcl_loeb"},
+    "pkz": {"DM": "SnippLoyalty_DW_PKZ", "bcl": "bcl_pkz"},
+}
+
+# Period expressions per granularity, for DateSK and TrxDate columns
+period_expr_dict = {
+    "month": {
+        "DateSK": "LEFT(DateSK, 6)",
+        "TrxDate": "LEFT(CONVERT(VARCHAR, TrxDate, 112), 6)",
+    },
+    "day": {
+        "DateSK": "CONVERT(VARCHAR(8), DateSK)",
+        "TrxDate": "CONVERT(VARCHAR(8), TrxDate, 112)",
+    },
+}
+
+# Aggregates per period for each reconcilable source
+reconciliation_source_dict = {
+    "DM_FactTrans": """
+    SELECT
+        {period_DateSK} AS period,
+        SUM(TotalValue) AS total_value,
+        COUNT(DISTINCT TrxID) AS n_trx,
+        COUNT(DISTINCT MemberSK) AS n_members
+    FROM {DM}.dbo.FactTrans
+    WHERE DateSK BETWEEN 'start_date' AND 'end_date'
+        AND MemberSK >= 0
+        AND TransactionStatusSK = 2
+        AND TransactionTypeSK IN (1, 2)
+    GROUP BY {period_DateSK}
+    """,
+    "DM_FactTransItem": """
+    SELECT
+        {period_DateSK} AS period,
+        SUM(Amount) AS total_value,
+        COUNT(DISTINCT TrxID) AS n_trx,
+        COUNT(DISTINCT MemberSK) AS n_members
+    FROM {DM}.dbo.FactTransItem
+    WHERE DateSK BETWEEN 'start_date' AND 'end_date'
+        AND MemberSK >= 0
+        AND TransactionStatusSK = 2
+        AND TransactionTypeSK IN (1, 2)
+    GROUP BY {period_DateSK}
+    """,
+    "bcl_EtlTransaction": """
+    SELECT
+        {period_TrxDate} AS period,
+        SUM(TotalValue) AS total_value,
+        COUNT(DISTINCT TrxId) AS n_trx,
+        COUNT(DISTINCT UserId) AS n_members
+    FROM {bcl}.dbo.EtlTransaction
+    WHERE TrxDate BETWEEN 'start_date' AND 'end_date'
+        AND UserId >= 0
+        AND TrxStatusTypeId = 2
+        AND trxTypeid IN (1, 2)
+    GROUP BY {period_TrxDate}
+    """,
+}
+
+# Join the aggregates of two sources and return the differing periods
+# only (periods missing on one side count as zero there)
+query_reconciliation_template = """
+WITH side_1 AS ({side_1}),
+side_2 AS ({side_2})
+
+SELECT
+    COALESCE(s1.period, s2.period) AS "{period_name}",
+    ISNULL(s1.total_value, 0) - ISNULL(s2.total_value, 0) AS "total_value",
+    ISNULL(s1.n_trx, 0) - ISNULL(s2.n_trx, 0) AS "n_trx",
+    ISNULL(s1.n_members, 0) - ISNULL(s2.n_members, 0) AS "n_members"
+FROM side_1 AS s1
+FULL OUTER JOIN side_2 AS s2
+    ON s1.period = s2.period
+WHERE ABS(ISNULL(s1.total_value, 0) - ISNULL(s2.total_value, 0)) > {tolerance}
+    OR ABS(ISNULL(s1.n_trx, 0) - ISNULL(s2.n_trx, 0)) > {tolerance}
+    OR ABS(ISNULL(s1.n_members, 0) - ISNULL(s2.n_members, 0)) > {tolerance}
+ORDER BY "{period_name}";
+"""
+
+
+#########
+# WATCH #
+#########
+
+# Cheap load watermarks, polled by the watch mode (can be replaced
+# with the WATCH_PROBES section in the config.yaml)
+watermark_probe_dict = {
+    "loeb_DM_FactTrans": "SELECT MAX(DateSK) FROM SnippLoyalty_DW_Loeb.dbo.FactTrans;",
+    "loeb_bcl_EtlTransaction": "SELECT MAX(TrxDate) FROM bcl_loeb.dbo.EtlTransaction;",
+    "pkz_DM_FactTrans": "SELECT MAX(DateSK) FROM SnippLoyalty_DW_PKZ.dbo.FactTrans;",
+    "pkz_bcl_EtlTransaction": "SELECT MAX(TrxDate) FROM bcl_pkz.dbo.EtlTransaction;",
+}
+
+# Version of the schema of a DB, to know when it has to be reflected again
+query_schema_version = """
+SELECT
+    COUNT(*) AS "n_objects",
+    MAX(modify_date) AS "last_modified"
+FROM sys.objects
+WHERE is_ms_shipped = 0;
+"""
+
+
+#############
+# DRILLDOWN #
+#############
+
+# Note: The templates below are completed with `str.format()` for the
+# checksum drill-down from months to days to key ranges, comparing
+# order-independent checksums of the transaction IDs of two sources.
+# `day` is an expression for the date as integer YYYYMMDD (for the
+# output only), `day_range` the filter of a half-open range of days on
+# the raw day column (so that an index on it can be used), and the
+# `range_filter` restricts the days and (optionally) the keys.
+
+drilldown_source_dict = {
+    "DM_FactTrans": {
+        "table": "{DM}.dbo.FactTrans",
+        "key": "TrxID",
+        "value": "TotalValue",
+        "member": "MemberSK",
+        "day": "DateSK",
+        "day_range": "DateSK >= {day_from} AND DateSK < {day_next}",
+        "filter": (
+            "MemberSK >= 0 AND TransactionStatusSK = 2 AND TransactionTypeSK IN (1, 2)"
+        ),
+    },
+    "DM_FactTransItem": {
+        "table": "{DM}.dbo.FactTransItem",
+        "key": "TrxID",
+        "value": "Amount",
+        "member": "MemberSK",
+        "day": "DateSK",
+        "day_range": "DateSK >= {day_from} AND DateSK < {day_next}",
+        "filter": (
+            "MemberSK >= 0 AND TransactionStatusSK = 2 AND TransactionTypeSK IN (1, 2)"
+        ),
+    },
+    "bcl_EtlTransaction": {
+        "table": "{bcl}.dbo.EtlTransaction",
+        "key": "TrxId",
+        "value": "TotalValue",
+        "member": "UserId",
+        "day": "CONVERT(INT, CONVERT(VARCHAR(8), TrxDate, 112))",
+        "day_range": "TrxDate >= '{day_from}' AND TrxDate < '{day_next}'",
+        "filter": "UserId >= 0 AND TrxStatusTypeId = 2 AND trxTypeid IN (1, 2)",
+    },
+}
+
+# Number of keys and checksum of the key set per bucket
+query_drilldown_checksums_template = """
+SELECT
+    {bucket} AS "bucket",
+    COUNT(DISTINCT {key}) AS "n_keys",
+    CHECKSUM_AGG(DISTINCT CHECKSUM({key})) AS "checksum"
+FROM {table}
+WHERE {filter}
+    {range_filter}
+GROUP BY {bucket};
+"""
+
+# Lowest and highest key of a day
+query_drilldown_key_range_template = """
+SELECT
+    MIN({key}) AS "key_from",
+    MAX({key}) AS "key_to"
+FROM {table}
+WHERE {filter}
+    {range_filter};
+"""
+
+# The keys of a key range of a day
+query_drilldown_keys_template = """
+SELECT DISTINCT {key} AS "key"
+FROM {table}
+WHERE {filter}
+    {range_filter};
+"""
+
+
+###################
+# INSTRUMENTATION #
+###################
+
+# Isolation level of the next statements on a connection (session)
+query_set_isolation_level_template = """
+SET TRANSACTION ISOLATION LEVEL {isolation_level};
+"""
+
+# Isolation level of the own session (1 = READ UNCOMMITTED, 2 = READ
+# COMMITTED, 3 = REPEATABLE READ, 4 = SERIALIZABLE, 5 = SNAPSHOT)
+query_session_isolation_level = """
+SELECT transaction_isolation_level AS "isolation_level"
+FROM sys.dm_exec_sessions
+WHERE session_id = @@SPID;
+"""
+
+# Set the isolation level of the own session and read its cumulated
+# lock wait time (SQL Server 2016 or higher) in one batch, before a
+# query (with the level of the check) and after it (with the level of
+# the session restored)
+query_set_isolation_level_lock_wait_template = """
+SET NOCOUNT ON;
+SET TRANSACTION ISOLATION LEVEL {isolation_level};
+SELECT ISNULL(SUM(wait_time_ms), 0) AS "lock_wait_ms"
+FROM sys.dm_exec_session_wait_stats
+WHERE session_id = @@SPID
+    AND wait_type LIKE 'LCK%';
+"""
+
+
+############
+# SAMPLING #
+############
+
+# Temp table for the keys of the sampled entities, one per connection
+query_sample_keys_create_template = """
+IF OBJECT_ID('tempdb..#sample_keys') IS NOT NULL DROP TABLE #sample_keys;
+CREATE TABLE #sample_keys (sample_key {key_type} NOT NULL PRIMARY KEY);
+"""
+
+query_sample_keys_insert = """
+INSERT INTO #sample_keys (sample_key) VALUES (?);
+"""
+
+query_sample_keys_drop = """
+DROP TABLE #sample_keys;
+"""
+
+# The sampled checks: the query picking the sample, the summary query
+# joining on the sample keys, the SQL type of the keys and the columns
+# identifying a row of the summary (the first being the sample key)
+sample_query_dict = {
+    "loeb_DM_sample_members": {
+        "pick": query_pick_loeb_dm_members,
+        "summary": query_val_loeb_dm_members,
+        "key_type": "BIGINT",
+        "key_cols": ["member_AK"],
+    },
+    "loeb_DM_sample_products": {
+        "pick": query_pick_loeb_dm_products,
+        "summary": query_val_loeb_dm_products,
+        "key_type": "BIGINT",
+        "key_cols": ["transaction_item_AK"],
+    },
+    "pkz_DM_sample_members": {
+        "pick": query_pick_pkz_dm_members,
+        "summary": query_val_pkz_dm_members,
+        "key_type": "BIGINT",
+        "key_cols": ["member_AK"],
+    },
+    "pkz_DM_sample_products": {
+        "pick": query_pick_pkz_dm_products,
+        "summary": query_val_pkz_dm_products,
+        "key_type": "VARCHAR(32)",
+        "key_cols": [
+            "TransactionItemCode",
+            "AnalysisCode8",
+            "AnalysisCode6",
+            "AnalysisCode10",
+            "AnalysisCode13",
+        ],
+    },
+}
+
+
+#############
+# SUMMARIES #
+#############
+
+# Note: The summaries of the fact tables are materialized by the
+# `provision` command in a `validation` schema of the DB of the table:
+# per-day partial aggregates, the distinct members per day and the
+# monthly roll-up of both, together with the state of the table at that
+# time. The templates below are completed with `str.format()`; `{db}` is
+# the DB name and the columns are the ones of the `drilldown_source_dict`.
+
+# Schema and tables for the summaries (run in the context of the DB)
+query_summary_objects_create = """
+IF SCHEMA_ID('validation') IS NULL EXEC('CREATE SCHEMA validation');
+IF OBJECT_ID('validation.DailySummary') IS NULL
+CREATE TABLE validation.DailySummary (
+    source VARCHAR(64) NOT NULL,
+    day_sk INT NOT NULL,
+    total_value FLOAT,
+    n_trx BIGINT,
+    PRIMARY KEY (source, day_sk)
+);
+IF OBJECT_ID('validation.DailyMembers') IS NULL
+CREATE TABLE validation.DailyMembers (
+    source VARCHAR(64) NOT NULL,
+    day_sk INT NOT NULL,
+    member_sk BIGINT NOT NULL,
+    PRIMARY KEY (source, day_sk, member_sk)
+);
+IF OBJECT_ID('validation.MonthlySummary') IS NULL
+CREATE TABLE validation.MonthlySummary (
+    source VARCHAR(64) NOT NULL,
+    month_sk INT NOT NULL,
+    yearmon INT NOT NULL,
+    total_value FLOAT,
+    n_trx BIGINT,
+    n_members BIGINT,
+    max_date DATE,
+    PRIMARY KEY (source, month_sk)
+);
+IF OBJECT_ID('validation.SummaryState') IS NULL
+CREATE TABLE validation.SummaryState (
+    source VARCHAR(64) NOT NULL PRIMARY KEY,
+    start_date INT NOT NULL,
+    end_date INT NOT NULL,
+    row_count BIGINT,
+    max_key BIGINT,
+    provisioned DATETIME NOT NULL
+);
+"""
+
+# Refresh of the days from `day_from` to `day_to` (the days from
+# `delete_from` are removed first) and roll-up of their months. A
+# transaction falls on one day, so the distinct transactions of a month
+# are the sum over its days; the distinct members need the member-days.
+query_summary_refresh_template = """
+SET NOCOUNT ON;
+DELETE FROM {db}.validation.DailySummary
+WHERE source = '{source}' AND day_sk >= {delete_from};
+DELETE FROM {db}.validation.DailyMembers
+WHERE source = '{source}' AND day_sk >= {delete_from};
+INSERT INTO {db}.validation.DailySummary (source, day_sk, total_value, n_trx)
+SELECT '{source}', {day}, SUM({value}), COUNT(DISTINCT {key})
+FROM {table}
+WHERE {filter}
+    AND {day_range}
+GROUP BY {day};
+INSERT INTO {db}.validation.DailyMembers (source, day_sk, member_sk)
+SELECT DISTINCT '{source}', {day}, {member}
+FROM {table}
+WHERE {filter}
+    AND {day_range};
+DELETE FROM {db}.validation.MonthlySummary
+WHERE source = '{source}' AND month_sk >= {month_from};
+INSERT INTO {db}.validation.MonthlySummary
+    (source, month_sk, yearmon, total_value, n_trx, n_members, max_date)
+SELECT
+    ds.source,
+    ds.yearmon * 100 + 1,
+    ds.yearmon,
+    ds.total_value,
+    ds.n_trx,
+    dm.n_members,
+    CONVERT(DATE, CONVERT(VARCHAR(8), ds.max_day), 112)
+FROM (
+    SELECT source, day_sk / 100 AS yearmon, SUM(total_value) AS total_value,
+        SUM(n_trx) AS n_trx, MAX(day_sk) AS max_day
+    FROM {db}.validation.DailySummary
+    WHERE source = '{source}' AND day_sk >= {month_from}
+    GROUP BY source, day_sk / 100
+) AS ds
+JOIN (
+    SELECT day_sk / 100 AS yearmon, COUNT(DISTINCT member_sk) AS n_members
+    FROM {db}.validation.DailyMembers
+    WHERE source = '{source}' AND day_sk >= {month_from}
+    GROUP BY day_sk / 100
+) AS dm
+    ON dm.yearmon = ds.yearmon;
+"""
+
+# State of the table the summary was refreshed from, and the summarized
+# days (`end_date` is the watermark, the last summarized day)
+query_summary_state_merge_template = """
+MERGE {db}.validation.SummaryState AS st
+USING (SELECT ? AS source, ? AS start_date, ? AS end_date,
+              ? AS row_count, ? AS max_key) AS new
+    ON st.source = new.source
+WHEN MATCHED THEN UPDATE SET
+    start_date = new.start_date,
+    end_date = new.end_date,
+    row_count = new.row_count,
+    max_key = new.max_key,
+    provisioned = CURRENT_TIMESTAMP
+WHEN NOT MATCHED THEN
+    INSERT (source, start_date, end_date, row_count, max_key, provisioned)
+    VALUES (new.source, new.start_date, new.end_date,
+            new.row_count, new.max_key, CURRENT_TIMESTAMP);
+"""
+
+query_summary_state_exists_template = """
+SELECT OBJECT_ID('{db}.validation.SummaryState') AS "object_id";
+"""
+
+query_summary_state_template = """
+SELECT start_date, end_date, row_count, max_key, provisioned
+FROM {db}.validation.SummaryState
+WHERE source = '{source}';
+"""
+
+# Consistency probe: the row count (from the partition stats, no scan),
+# the highest key and the last update (since the server start) of a
+# table, and the number and first day of the rows above the key
+# recorded (a seek on the key)
+query_summary_probe_template = """
+SELECT
+    (SELECT SUM(ps.row_count)
+     FROM {db}.sys.dm_db_partition_stats AS ps
+     WHERE ps.object_id = OBJECT_ID('{table}')
+        AND ps.index_id IN (0, 1)) AS "row_count",
+    (SELECT MAX({key}) FROM {table}) AS "max_key",
+    (SELECT MAX(us.last_user_update)
+     FROM sys.dm_db_index_usage_stats AS us
+     WHERE us.database_id = DB_ID('{db}')
+        AND us.object_id = OBJECT_ID('{table}')) AS "last_user_update",
+    (SELECT COUNT_BIG(*) FROM {table} WHERE {key} > {max_key}) AS "n_new",
+    (SELECT MIN({day}) FROM {table} WHERE {key} > {max_key}) AS "first_new_day";
+"""
+
+# Monthly summary read in place of the value query on the fact table
+# (same result schema, same date placeholders)
+query_summary_read_template = """
+SELECT
+    yearmon AS "yearmon",
+    total_value AS "total_value",
+    n_trx AS "n_trx",
+    n_members AS "n_members",
+    max_date AS "max_date",
+    CONVERT(DATE, CURRENT_TIMESTAMP, 23) AS "date_db_check"
+FROM {db}.validation.MonthlySummary
+WHERE source = '{source}'
+    AND month_sk BETWEEN 'start_date' AND 'end_date'
+ORDER BY "yearmon";
+"""
+
+
+query_dict = {
+    "loeb_DM_sample_members": {
+        "pick": query_pick_loeb_dm_members,
+        "summary": query_val_loeb_dm_members,
+        "key_type": "BIGINT",
+        "key_cols": ["member_AK"],
+    },
+    "loeb_DM_sample_products": {
+        "pick": query_pick_loeb_dm_products,
+        "summary": query_val_loeb_dm_products,
+        "key_type": "BIGINT",
+        "key_cols": ["transaction_item_AK"],
+    },
+    "pkz_DM_sample_members": {
+        "pick": query_pick_pkz_dm_members,
+        "summary": query_val_pkz_dm_members,
+        "key_type": "BIGINT",
+        "key_cols": ["member_AK"],
+    },
+    "pkz_DM_sample_products": {
+        "pick": query_pick_pkz_dm_products,
+        "summary": query_val_pkz_dm_products,
+        "key_type": "VARCHAR(32)",
+        "key_cols": [
+            "TransactionItemCode",
+            "AnalysisCode8",
+            "AnalysisCode6",
+            "AnalysisCode10",
+            "AnalysisCode13",
+        ],
+    },
+}
+
+
+#############
+# SUMMARIES #
+#############
+
+# Note: The monthly summaries of the fact tables are materialized by the
+# `provision` command in a `validation` schema of the DB of the table,
+# together with the state of the table at that time. The templates
+# below are completed with `str.format()`; `{db}` is the DB name.
+
+# Schema and tables for the summaries (run in the context of the DB)
+query_summary_objects_create = """
+IF SCHEMA_ID('validation') IS NULL EXEC('CREATE SCHEMA validation');
+IF OBJECT_ID('validation.MonthlySummary') IS NULL
+CREATE TABLE validation.MonthlySummary (
+    source VARCHAR(64) NOT NULL,
+    month_sk INT NOT NULL,
+    yearmon INT NOT NULL,
+    total_value FLOAT,
+    n_trx BIGINT,
+    n_members BIGINT,
+    max_date DATE,
+    PRIMARY KEY (source, month_sk)
+);
+IF OBJECT_ID('validation.SummaryState') IS NULL
+CREATE TABLE validation.SummaryState (
+    source VARCHAR(64) NOT NULL PRIMARY KEY,
+    start_date INT NOT NULL,
+    end_date INT NOT NULL,
+    row_count BIGINT,
+    max_key BIGINT,
+    provisioned DATETIME NOT NULL
+);
+"""
+
+query_summary_delete_template = """
+DELETE FROM validation.MonthlySummary
+WHERE source = '{source}'
+    AND month_sk BETWEEN {start_date} AND {end_date};
+"""
+
+query_summary_insert = """
+INSERT INTO validation.MonthlySummary
+    (source, month_sk, yearmon, total_value, n_trx, n_members, max_date)
+VALUES (?, ?, ?, ?, ?, ?, ?);
+"""
+
+# State of the table the summary was provisioned from, and its window
+query_summary_state_merge = """
+MERGE validation.SummaryState AS st
+USING (SELECT ? AS source, ? AS start_date, ? AS end_date,
+              ? AS row_count, ? AS max_key) AS new
+    ON st.source = new.source
+WHEN MATCHED THEN UPDATE SET
+    start_date = new.start_date,
+    end_date = new.end_date,
+    row_count = new.row_count,
+    max_key = new.max_key,
+    provisioned = CURRENT_TIMESTAMP
+WHEN NOT MATCHED THEN
+    INSERT (source, start_date, end_date, row_count, max_key, provisioned)
+    VALUES (new.source, new.start_date, new.end_date,
+            new.row_count, new.max_key, CURRENT_TIMESTAMP);
+"""
+
+query_summary_state_exists_template = """
+SELECT OBJECT_ID('{db}.validation.SummaryState') AS "object_id";
+"""
+
+query_summary_state_template = """
+SELECT start_date, end_date, row_count, max_key, provisioned
+FROM {db}.validation.SummaryState
+WHERE source = '{source}';
+"""
+
+# Consistency probe: the row count (from the partition stats, no scan),
+# the highest key and the last update (since the server start) of a table
+query_summary_probe_template = """
+SELECT
+    (SELECT SUM(ps.row_count)
+     FROM {db}.sys.dm_db_partition_stats AS ps
+     WHERE ps.object_id = OBJECT_ID('{table}')
+        AND ps.index_id IN (0, 1)) AS "row_count",
+    (SELECT MAX({key}) FROM {table}) AS "max_key",
+    (SELECT MAX(us.last_user_update)
+     FROM sys.dm_db_index_usage_stats AS us
+     WHERE us.database_id = DB_ID('{db}')
+        AND us.object_id = OBJECT_ID('{table}')) AS "last_user_update";
+"""
+
+# Monthly summary read in place of the value query on the fact table
+# (same result schema, same date placeholders)
+query_summary_read_template = """
+SELECT
+    yearmon AS "yearmon",
+    total_value AS "total_value",
+    n_trx AS "n_trx",
+    n_members AS "n_members",
+    max_date AS "max_date",
+    CONVERT(DATE, CURRENT_TIMESTAMP, 23) AS "date_db_check"
+FROM {db}.validation.MonthlySummary
+WHERE source = '{source}'
+    AND month_sk BETWEEN 'start_date' AND 'end_date'
+ORDER BY "yearmon";
+"""
+
+
 query_dict = {
     "loeb_bcl_EtlTransaction": query_val_loeb_bcl_EtlTransaction,
     "loeb_DM_FactTrans": query_val_loeb_dm_FactTrans,
     "loeb_DM_FactTransItem": query_val_loeb_dm_FactTransItem,
     "loeb_DM_DimMember_AK": query_val_loeb_dm_DimMember,
-    "loeb_DM_three_members": query_val_loeb_dm_members,
-    "loeb_DM_three_products": query_val_loeb_dm_products,
     "pkz_bcl_EtlTransaction": query_val_pkz_bcl_EtlTransaction,
     "pkz_DM_FactTrans": query_val_pkz_dm_FactTrans,
     "pkz_DM_FactTransItem": query_val_pkz_dm_FactTransItem,
     "pkz_DM_DimMember_AK": query_val_pkz_dm_DimMember,
-    "pkz_DM_three_members": query_val_pkz_dm_members,
-    "pkz_DM_three_products": query_val_pkz_dm_products,
     "pkz_DM_duplicate_TISK": query_val_pkz_duplicate_TISK,
 }
+
+
+###########
+# SCHEMAS #
+###########
+
+# Declared result schema (column: dtype) for every query in the
+# `query_dict`. The dtypes are enforced when the dataframes are built
+# and when they are read from or written to parquet.
+
+schema_monthly_summary = {
+    "yearmon": "int32",
+    "total_value": "float64",
+    "n_trx": "int64",
+    "n_members": "int64",
+    "max_date": "datetime64[ns]",
+    "date_db_check": "datetime64[ns]",
+}
+
+schema_dim_member = {
+    "AK_lowest": "int64",
+    "AK_highest": "int64",
+    "n_MemberAK": "int64",
+    "n_dates_1Jan1900": "int64",
+    "date_db_check": "datetime64[ns]",
+}
+
+schema_members = {
+    "member_AK": "int64",
+    "create_date": "datetime64[ns]",
+    "total_value_19": "float64",
+    "n_trx_19": "int64",
+    "date_db_check": "datetime64[ns]",
+}
+
+schema_loeb_products = {
+    "transaction_item_AK": "int64",
+    "total_value_19": "float64",
+    "n_trx_19": "int64",
+    "date_db_check": "datetime64[ns]",
+}
+
+schema_pkz_products = {
+    "TransactionItemCode": "category",
+    "AnalysisCode8": "category",
+    "AnalysisCode6": "category",
+    "AnalysisCode10": "category",
+    "AnalysisCode13": "category",
+    "n_items": "float64",
+    "sum_amount": "float64",
+    "date_db_check": "datetime64[ns]",
+}
+
+schema_duplicate_TISK = {
+    "dup_TISK_count": "int64",
+}
+
+
+schema_dict = {
+    "loeb_bcl_EtlTransaction": schema_monthly_summary,
+    "loeb_DM_FactTrans": schema_monthly_summary,
+    "loeb_DM_FactTransItem": schema_monthly_summary,
+    "loeb_DM_DimMember_AK": schema_dim_member,
+    "loeb_DM_sample_members": schema_members,
+    "loeb_DM_sample_products": schema_loeb_products,
+    "pkz_bcl_EtlTransaction": schema_monthly_summary,
+    "pkz_DM_FactTrans": schema_monthly_summary,
+    "pkz_DM_FactTransItem": schema_monthly_summary,
+    "pkz_DM_DimMember_AK": schema_dim_member,
+    "pkz_DM_sample_members": schema_members,
+    "pkz_DM_sample_products": schema_pkz_products,
+    "pkz_DM_duplicate_TISK": schema_duplicate_TISK,
+}
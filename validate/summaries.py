@@ -0,0 +1,279 @@
+""" Managed summaries of the fact tables. The `provision` command
+materializes per-day partial aggregates (sum and distinct transactions
+per day, distinct members per day) of the month-grouped value queries
+on the fact tables in the `validation` schema of the DB of each table,
+rolls them up to months in `validation.MonthlySummary`, and records the
+state of the table (row count and highest key) and the last summarized
+day (the watermark) in `validation.SummaryState`.
+A consistency probe compares the table with the recorded state. If
+rows have only been appended since (the row count grew by the number
+of rows above the recorded key), only the days after the watermark and
+the days of the appended rows are summarized again, and their months
+rolled up. The value checks do the same refresh, and then read the
+summary (one row per month) instead of aggregating the fact table. If
+the table changed otherwise, they fall back to the query on the fact
+table, and `provision` summarizes the whole window again.
+Note: SQL Server only. COUNT DISTINCT is not allowed in indexed views,
+hence tables maintained by the command.
+"""
+
+import datetime as dt
+import logging
+from typing import Any, Dict, Optional
+
+import sqlalchemy
+from sqlalchemy.exc import DBAPIError
+
+import utils
+from sql_queries import (
+    drilldown_source_dict,
+    query_summary_objects_create,
+    query_summary_probe_template,
+    query_summary_read_template,
+    query_summary_refresh_template,
+    query_summary_state_exists_template,
+    query_summary_state_merge_template,
+    query_summary_state_template,
+    schema_dict,
+    vendor_db_dict,
+)
+
+logger = logging.getLogger(__name__)
+
+# Lowest BIGINT, the recorded key of a table without a summary
+NO_KEY = -(2 ** 63)
+
+
+def get_summary_sources(query_dict: Dict[str, str]) -> Dict[str, Dict[str, str]]:
+    """Return the value queries that can be summarized (the month-
+    grouped ones on the fact tables), with the DB, the table and the
+    columns of their fact table.
+    """
+    sources = {}
+    for q_name in query_dict:
+        vendor, source = q_name.split("_", 1)
+        if source not in drilldown_source_dict or vendor not in vendor_db_dict:
+            continue
+        if "yearmon" not in schema_dict.get(q_name, {}):
+            continue
+        table = drilldown_source_dict[source]["table"].format(**vendor_db_dict[vendor])
+        sources[q_name] = dict(
+            drilldown_source_dict[source], db=table.split(".", 1)[0], table=table
+        )
+    return sources
+
+
+def create_summary_objects(connection: sqlalchemy.engine.Connection) -> None:
+    """Create the `validation` schema and the summary and state tables
+    in the DB of the connection (if they don't exist yet).
+    """
+    with connection.begin():
+        connection.execute(query_summary_objects_create)
+
+
+def provision_summary(
+    connection: sqlalchemy.engine.Connection,
+    q_name: str,
+    source: Dict[str, str],
+    start_date: str,
+    end_date: str,
+    rebuild: bool = False
+) -> Optional[Dict[str, Any]]:
+    """Refresh the summary of a value query so that it covers the
+    window from start to end date (with `rebuild`, summarize the whole
+    window again). Return the refresh (see `plan_refresh`), or None if
+    the summary was current.
+    """
+    state = load_summary_state(connection, q_name, source)
+    refresh = plan_refresh(
+        connection, q_name, source, state, start_date, end_date, rebuild
+    )
+    if refresh is not None:
+        refresh_summary(connection, q_name, source, refresh)
+    return refresh
+
+
+def plan_refresh(
+    connection: sqlalchemy.engine.Connection,
+    q_name: str,
+    source: Dict[str, str],
+    state: Optional[Dict[str, Any]],
+    start_date: str,
+    end_date: str,
+    rebuild: bool = False
+) -> Optional[Dict[str, Any]]:
+    """Return the refresh needed for the summary of a value query (with
+    its recorded state) to cover the window from start to end date, or
+    None if the summary is current. The refresh holds the first and
+    last day to summarize, the first day of the summary afterwards and
+    the probe of the table. If rows have only been appended to the
+    table since the summary was refreshed, these are the days after the
+    watermark and the days of the appended rows. Otherwise (or with
+    `rebuild`) it is the whole window, flagged as a rebuild.
+    """
+    max_key = NO_KEY if state is None or state["max_key"] is None else state["max_key"]
+    probe = probe_source(connection, source, max_key)
+    rebuild_refresh = {
+        "day_from": int(start_date),
+        "day_to": int(end_date),
+        "start_date": int(start_date),
+        "rebuild": True,
+        "probe": probe,
+    }
+    if rebuild or state is None:
+        return rebuild_refresh
+    if state["start_date"] > int(start_date):
+        logger.debug(f"{q_name}: summary does not cover {start_date}-{end_date}.")
+        return rebuild_refresh
+    is_appended_only = probe["row_count"] == state["row_count"] + probe["n_new"] and (
+        # Appended rows update the table too, else it must not be updated
+        probe["n_new"] > 0
+        or probe["last_user_update"] is None
+        or probe["last_user_update"] <= state["provisioned"]
+    )
+    if not is_appended_only:
+        logger.debug(
+            f"{q_name}: {source['table']} changed since the summary was refreshed "
+            f"({state['provisioned']:%Y-%m-%d %H:%M}), not only by appended rows."
+        )
+        return rebuild_refresh
+    day_from = _next_day(state["end_date"])
+    if probe["n_new"] > 0:
+        day_from = min(day_from, max(probe["first_new_day"], state["start_date"]))
+    day_to = max(int(end_date), state["end_date"])
+    if day_from > day_to:
+        return None
+    return {
+        "day_from": day_from,
+        "day_to": day_to,
+        "start_date": state["start_date"],
+        "rebuild": False,
+        "probe": probe,
+    }
+
+
+def refresh_summary(
+    connection: sqlalchemy.engine.Connection,
+    q_name: str,
+    source: Dict[str, str],
+    refresh: Dict[str, Any]
+) -> None:
+    """Summarize the days of a refresh (see `plan_refresh`) of the
+    summary of a value query, roll up their months, and record the
+    probed state of the table, in one transaction. The table is probed
+    before the aggregation, so that rows loaded meanwhile are
+    summarized again by the next refresh rather than missed.
+    """
+    delete_from = 0 if refresh["rebuild"] else refresh["day_from"]
+    day_range = source["day_range"].format(
+        day_from=refresh["day_from"], day_next=_next_day(refresh["day_to"])
+    )
+    probe = refresh["probe"]
+    with connection.begin():
+        connection.execute(
+            query_summary_refresh_template.format(
+                **dict(source, day_range=day_range),
+                source=q_name,
+                delete_from=delete_from,
+                month_from=delete_from // 100 * 100 + 1,
+            )
+        )
+        connection.execute(
+            query_summary_state_merge_template.format(db=source["db"]),
+            (
+                q_name,
+                refresh["start_date"],
+                refresh["day_to"],
+                probe["row_count"],
+                probe["max_key"],
+            )
+        )
+    logger.debug(
+        f"{q_name}: days {refresh['day_from']}-{refresh['day_to']} summarized."
+    )
+
+
+def probe_source(
+    connection: sqlalchemy.engine.Connection,
+    source: Dict[str, str],
+    max_key: int
+) -> Dict[str, Any]:
+    """Return the row count (from the partition stats), the highest
+    key, the last update (since the server start, else None), and the
+    number and first day of the rows with a key above `max_key` of the
+    fact table of a source.
+    """
+    result_proxy = connection.execute(
+        query_summary_probe_template.format(**source, max_key=max_key)
+    )
+    return dict(zip(list(result_proxy.keys()), result_proxy.fetchone()))
+
+
+def get_summary_query_dict(
+    connection: sqlalchemy.engine.Connection,
+    query_dict: Dict[str, str],
+    start_date: str,
+    end_date: str
+) -> Dict[str, str]:
+    """Return the query dict with the value queries that have a summary
+    replaced by a read of the summary, after the days appended since
+    its last refresh have been summarized. The other queries (and all of
+    them for other DBs than SQL Server) stay as they are, as do the ones
+    whose fact table changed otherwise or whose refresh failed.
+    """
+    if utils.get_dialect_name(connection) != "mssql":
+        return query_dict
+    query_dict = dict(query_dict)
+    summarized = []
+    for q_name, source in get_summary_sources(query_dict).items():
+        state = load_summary_state(connection, q_name, source)
+        if state is None:
+            continue
+        refresh = plan_refresh(connection, q_name, source, state, start_date, end_date)
+        if refresh is not None and refresh["rebuild"]:
+            continue
+        if refresh is not None:
+            try:
+                refresh_summary(connection, q_name, source, refresh)
+            except DBAPIError as e:
+                logger.warning(
+                    f"{q_name}: refresh of the summary failed, the fact table is "
+                    f"read instead ({e.orig})."
+                )
+                continue
+        query_dict[q_name] = query_summary_read_template.format(
+            db=source["db"], source=q_name
+        )
+        summarized.append(q_name)
+    if len(summarized) > 0:
+        logger.info(f"Value checks read from the summaries: {', '.join(summarized)}")
+    else:
+        logger.debug("No current summaries, the value checks read the fact tables.")
+    return query_dict
+
+
+def load_summary_state(
+    connection: sqlalchemy.engine.Connection,
+    q_name: str,
+    source: Dict[str, str]
+) -> Optional[Dict[str, Any]]:
+    """Return the recorded state of the summary of a value query, or
+    None if it has not been provisioned.
+    """
+    if connection.execute(
+        query_summary_state_exists_template.format(db=source["db"])
+    ).scalar() is None:
+        return None
+    result_proxy = connection.execute(
+        query_summary_state_template.format(db=source["db"], source=q_name)
+    )
+    row = result_proxy.fetchone()
+    if row is None:
+        return None
+    return dict(zip(list(result_proxy.keys()), row))
+
+
+def _next_day(day: int) -> int:
+    """Return the day after a day given as YYYYMMDD integer."""
+    next_day = dt.datetime.strptime(str(day), "%Y%m%d") + dt.timedelta(days=1)
+    return int(next_day.strftime("%Y%m%d"))
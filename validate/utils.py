@@ -1,19 +1,27 @@
 import datetime as dt
 import logging
-import yaml
 from pathlib import Path
-from typing import Dict, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
 
-import sqlalchemy
+import retention
+
+# Heavy dependencies are imported where they are used, so that quick
+# commands like `list-runs` start fast.
+if TYPE_CHECKING:
+    import sqlalchemy
 
 logger = logging.getLogger(__name__)
 
+_engine_cache = {}
+
 
 def read_yaml(file_path: Union[str, Path], section: Optional[str]) -> Dict:
     """Return the key-value-pairs from a YAML file, or, if the
     optional `section` parameter is passed, only from a specific
     section of that file.
     """
+    import yaml
+
     with open(file_path, "r") as f:
         yaml_content = yaml.safe_load(f)
     if not section:
@@ -26,44 +34,122 @@ def read_yaml(file_path: Union[str, Path], section: Optional[str]) -> Dict:
             raise
 
 
+def load_config(file_path: Union[str, Path]) -> Dict[str, Any]:
+    """Parse the config file once and return its content. Fail early
+    if one of the mandatory settings is missing. Optional settings are
+    read with `config.get(<key>, <default>)` by the caller.
+    """
+    config = read_yaml(file_path, None)
+    for section in ["SERVER", "DB_LIST", "VENDOR_LIST", "QUERY_N_MONTHS_BACK"]:
+        if section not in config:
+            logging.error(f"Section {section} not found in config file. Please check.")
+            raise KeyError(section)
+    return config
+
+
 def connect_to_db(
     server: str,
     db_name: str
-) -> Tuple[sqlalchemy.engine.Engine, sqlalchemy.engine.Connection]:
+) -> Tuple["sqlalchemy.engine.Engine", "sqlalchemy.engine.Connection"]:
     """Connect to DB and open a persistent connection. The param
     `fast_exectuemany` is active for bulk operations. Return engine
-    and connection objects.
+    and connection objects. If a cassette is active, the DB
+    interactions are recorded or replayed (see `cassette.py`).
+    A server string like "sqlite:///<folder>" connects to a local
+    SQLite stand-in file named after the DB instead, and a server
+    string like "duckdb:///<folder>" to the exported dumps of the DBs
+    in that folder (see `dump_backend.py`). The engines are
+    cached, so that their connection pools stay warm between runs
+    (e.g. in watch mode).
     """
-    con_string = (
-        f"mssql+pyodbc://{server}/{db_name}?driver=ODBC Driver 13 for SQL Server"
-    )
+    import sqlalchemy
+
+    import cassette
+
+    active_cassette = cassette.get_active()
+    if active_cassette is not None and active_cassette.mode == "replay":
+        engine = cassette.CassetteEngine(active_cassette, db_name)
+        return engine, engine.connect()
 
-    engine = sqlalchemy.create_engine(con_string, fast_executemany=True)
+    engine = _engine_cache.get((server, db_name))
+    if engine is None:
+        if server.startswith("sqlite:///"):
+            # Local stand-in: one SQLite file per DB in the folder `server`
+            engine = sqlalchemy.create_engine(f"{server}/{db_name}.sqlite")
+        elif server.startswith("duckdb:///"):
+            # Offline: exported dumps (Parquet / CSV) in the folder `server`
+            from dump_backend import DumpEngine
+
+            engine = DumpEngine(server[len("duckdb:///"):], db_name)
+        else:
+            con_string = (
+                f"mssql+pyodbc://{server}/{db_name}"
+                f"?driver=ODBC Driver 13 for SQL Server"
+            )
+            engine = sqlalchemy.create_engine(con_string, fast_executemany=True)
+        _engine_cache[(server, db_name)] = engine
+    if active_cassette is not None:
+        engine = cassette.CassetteEngine(active_cassette, db_name, engine)
     connection = engine.connect()
     return engine, connection
 
 
+def get_value_server(server: str) -> str:
+    """Return the server string for the value checks. Their T-SQL
+    queries cannot run on SQLite stand-ins, so the stand-in files are
+    loaded into the DuckDB backend instead, which translates them (see
+    `dump_backend.py`).
+    """
+    if server.startswith("sqlite:///"):
+        return "duckdb:///" + server[len("sqlite:///"):]
+    return server
+
+
+def list_validation_data_paths(data_path: str) -> List[Path]:
+    """Return the paths of all the (not archived) validation data
+    folders from previous and actual runs, sorted from oldest to
+    newest, as listed in the runs index (see `retention.py`).
+    """
+    return [
+        Path(data_path) / run_name
+        for run_name, status in retention.load_runs_index(data_path).items()
+        if status == retention.LIVE
+    ]
+
+
 def get_latest_previous_validation_data_path(data_path: str) -> Path:
     """Return the path to the latest available validation data from
     previous runs. Has to be from before the actual date. This data
     will be used for the comparison with the results of the actual run.
+    The run is looked up in the runs index (reconciled with the disk
+    only if the indexed run is gone), and restored if it has been
+    archived in the meantime.
     """
     date_today_str = dt.datetime.strftime(dt.date.today(), "%Y-%m-%d")
-    data_path = Path(data_path)
-    data_dirs = [d.name for d in data_path.iterdir() if d.is_dir()]
-    previous_data_dirs = [d for d in data_dirs if d[:10] != date_today_str]
+    runs = retention.load_runs_index(data_path)
+    previous_runs = [name for name in runs if name[:10] != date_today_str]
+    if len(previous_runs) > 0 and not retention.is_run_stored(
+        Path(data_path), previous_runs[-1], runs[previous_runs[-1]]
+    ):
+        # Run folder deleted or renamed by hand since the index was written
+        runs = retention.load_runs_index(data_path, reconcile=True)
+        previous_runs = [name for name in runs if name[:10] != date_today_str]
     try:
-        latest_data_path = data_path / sorted(previous_data_dirs)[-1]
+        latest_run_name = previous_runs[-1]
     except IndexError:
-        logging.error("No previous validation data found in {data_path}!")
+        logging.error(f"No previous validation data found in {data_path}!")
         raise
+    latest_data_path = Path(data_path) / latest_run_name
+    if runs[latest_run_name] == retention.ARCHIVED:
+        retention.restore_run(Path(data_path), latest_run_name)
+        create_validation_data_subdirs(latest_data_path)
     return latest_data_path
 
 
 def create_actual_validation_data_path(data_path: str) -> Path:
     """Create a new data directory that is named with today's date
-    string. If there is already such a directory name, output a warning
-    and use the existing directory.
+    string and register it in the runs index. If there is already such
+    a directory name, output a warning and use the existing directory.
     """
     date_today_str = dt.datetime.strftime(dt.date.today(), "%Y-%m-%d")
     actual_data_path = Path(data_path) / f"{date_today_str}_catalyst_validation_data"
@@ -74,13 +160,31 @@ def create_actual_validation_data_path(data_path: str) -> Path:
         )
     actual_data_path.mkdir(exist_ok=True)
     # Create the subdirectories too
-    actual_structure_path = actual_data_path / "structure"
-    actual_structure_path.mkdir(exist_ok=True)
-    actual_values_path = actual_data_path / "values"
-    actual_values_path.mkdir(exist_ok=True)
+    create_validation_data_subdirs(actual_data_path)
+    retention.register_run(data_path, actual_data_path.name)
     return actual_data_path
 
 
+def create_validation_data_subdirs(data_path: Path) -> None:
+    """Create the subdirectories for the structure, values and
+    drill-down data and for the meta data of the run (e.g. the journal)
+    in a validation data directory (if they don't exist yet).
+    """
+    for sub in ["structure", "values", "drilldown", "meta"]:
+        (Path(data_path) / sub).mkdir(exist_ok=True)
+
+
+def get_dialect_name(connection: Any) -> str:
+    """Return the name of the SQL dialect of a connection (replayed
+    connections have the dialect recorded in their cassette).
+    """
+    dialect = getattr(connection, "dialect", None)
+    if dialect is None:
+        logging.error(f"Unknown SQL dialect of connection {connection!r}.")
+        raise ValueError("Connection without SQL dialect.")
+    return dialect.name
+
+
 # def close(cur, conn):
 #     """Close the communication with the database."""
 #     try:
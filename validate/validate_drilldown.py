@@ -0,0 +1,246 @@
+""" Checksum drill-down to localize the transactions that differ between
+two fact tables (e.g. DM_FactTrans and bcl_EtlTransaction). Instead of
+fetching the transactions, only the number and an order-independent
+checksum of the transaction IDs are compared per bucket, first per
+month, then per day, then per (recursively subdivided) TrxID range.
+Only for small differing key ranges the keys themselves are fetched.
+Note: Integer transaction IDs are assumed for the key ranges.
+"""
+
+import datetime as dt
+import logging
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import sqlalchemy
+
+from sql_queries import (
+    drilldown_source_dict,
+    query_drilldown_checksums_template,
+    query_drilldown_key_range_template,
+    query_drilldown_keys_template,
+    vendor_db_dict,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def drill_down_trx_differences(
+    connection: sqlalchemy.engine.Connection,
+    vendor: str,
+    source_1: str,
+    source_2: str,
+    start_date: str,
+    end_date: str,
+    months: Optional[List[int]] = None,
+    n_buckets: int = 16,
+    leaf_size: int = 1000
+) -> pd.DataFrame:
+    """Return a dataframe with the transaction IDs that are in one of
+    the two sources only, with the columns `yearmonday`, `trx_id` and
+    `missing_in` (name of the source lacking the transaction). If the
+    differing months are already known (e.g. from the value checks),
+    they can be passed to skip the month level.
+    """
+    sides = [_get_side(vendor, source) for source in [source_1, source_2]]
+    if months is None:
+        months = list(
+            _get_differing_buckets(
+                connection,
+                sides,
+                lambda side: f"{side['day']} / 100",
+                lambda side: _day_range_filter(side, int(start_date), int(end_date))
+            ).keys()
+        )
+
+    diff_rows = []
+    for month in sorted(months):
+        days = _get_differing_buckets(
+            connection,
+            sides,
+            lambda side: side["day"],
+            lambda side: _day_range_filter(
+                side, month * 100 + 1, _get_last_day_of_month(month)
+            )
+        )
+        for day in sorted(days.keys()):
+            key_from, key_to = _get_key_range(connection, sides, day)
+            diff_rows += _drill_down_key_range(
+                connection, sides, day, key_from, key_to, n_buckets, leaf_size
+            )
+
+    df_drilldown = pd.DataFrame(diff_rows, columns=["yearmonday", "trx_id", "missing_in"])
+    logger.debug(
+        f"{vendor.upper()} - Drill-down {source_1} to {source_2}: "
+        f"{len(df_drilldown)} differing transactions in {len(months)} months."
+    )
+    return df_drilldown
+
+
+def get_differing_months(df_diff: pd.DataFrame) -> List[int]:
+    """Return the months (as yyyymm) with a difference in the number
+    of transactions, from a difference dataframe indexed by `yearmon`
+    or (pushdown mode with day granularity) by `yearmonday`.
+    """
+    months = [int(period) for period in df_diff.index[df_diff["n_trx"] != 0]]
+    return sorted({month // 100 if month > 999999 else month for month in months})
+
+
+def save_drilldown_dfs(
+    drilldown_dict: Dict[str, pd.DataFrame],
+    actual_data_path: Path
+) -> None:
+    """Save the drill-down results, timestamped, to parquet files in
+    the 'drilldown' subfolder of the actual data folder.
+    """
+    date_today_str = dt.datetime.strftime(dt.date.today(), "%Y-%m-%d")
+    for vendor, df in drilldown_dict.items():
+        filename = f"{vendor}_trx_drilldown_{date_today_str}"
+        df.to_parquet(f"{actual_data_path / 'drilldown' / filename}", index=False)
+    logger.debug(f"{len(drilldown_dict)} drill-down dataframes saved to disc.\n")
+
+
+def _drill_down_key_range(
+    connection: sqlalchemy.engine.Connection,
+    sides: List[Dict[str, str]],
+    day: int,
+    key_from: int,
+    key_to: int,
+    n_buckets: int,
+    leaf_size: int
+) -> List[Tuple[int, Any, str]]:
+    """Split the key range of a day into n buckets, and for every
+    bucket with differing checksums either fetch and compare the keys
+    (if there are few enough) or subdivide it again.
+    """
+    width = max(1, -(-(key_to - key_from + 1) // n_buckets))  # ceil division
+    differing_buckets = _get_differing_buckets(
+        connection,
+        sides,
+        lambda side: f"({side['key']} - {key_from}) / {width}",
+        lambda side: _day_and_key_filter(side, day, key_from, key_to)
+    )
+    diff_rows = []
+    for bucket, n_keys in sorted(differing_buckets.items()):
+        sub_from = key_from + int(bucket) * width
+        sub_to = min(sub_from + width - 1, key_to)
+        if n_keys <= leaf_size or width == 1:
+            diff_rows += _get_differing_keys(connection, sides, day, sub_from, sub_to)
+        else:
+            diff_rows += _drill_down_key_range(
+                connection, sides, day, sub_from, sub_to, n_buckets, leaf_size
+            )
+    return diff_rows
+
+
+def _get_differing_buckets(
+    connection: sqlalchemy.engine.Connection,
+    sides: List[Dict[str, str]],
+    bucket_expr: Callable[[Dict[str, str]], str],
+    range_filter: Callable[[Dict[str, str]], str]
+) -> Dict[int, int]:
+    """Return the buckets where the number of keys or the checksum of
+    the keys differ between the two sides (or that are missing on one
+    side), with the higher of the two numbers of keys.
+    """
+    checksum_dfs = []
+    for side in sides:
+        query = query_drilldown_checksums_template.format(
+            bucket=bucket_expr(side), range_filter=range_filter(side), **side
+        )
+        result_proxy = connection.execute(query)
+        checksum_df = pd.DataFrame(
+            result_proxy.fetchall(), columns=list(result_proxy.keys())
+        )
+        checksum_dfs.append(checksum_df.set_index("bucket"))
+
+    df = checksum_dfs[0].join(checksum_dfs[1], how="outer", lsuffix="_1", rsuffix="_2")
+    df[["n_keys_1", "n_keys_2"]] = df[["n_keys_1", "n_keys_2"]].fillna(0)
+    is_differing = (
+        (df["n_keys_1"] != df["n_keys_2"])
+        | (df["checksum_1"] != df["checksum_2"])
+        | df["checksum_1"].isnull()
+        | df["checksum_2"].isnull()
+    )
+    n_keys = df.loc[is_differing, ["n_keys_1", "n_keys_2"]].max(axis=1)
+    return {int(bucket): int(n) for bucket, n in n_keys.items()}
+
+
+def _get_key_range(
+    connection: sqlalchemy.engine.Connection,
+    sides: List[Dict[str, str]],
+    day: int
+) -> Tuple[int, int]:
+    """Return the lowest and highest key of a day over both sides."""
+    key_bounds = []
+    for side in sides:
+        query = query_drilldown_key_range_template.format(
+            range_filter=_day_range_filter(side, day, day), **side
+        )
+        key_bounds += [
+            int(bound) for bound in connection.execute(query).fetchone()
+            if bound is not None
+        ]
+    return min(key_bounds), max(key_bounds)
+
+
+def _get_differing_keys(
+    connection: sqlalchemy.engine.Connection,
+    sides: List[Dict[str, str]],
+    day: int,
+    key_from: int,
+    key_to: int
+) -> List[Tuple[int, Any, str]]:
+    """Fetch the keys of a small key range of a day from both sides
+    and return the ones that are missing on one side.
+    """
+    key_sets = []
+    for side in sides:
+        query = query_drilldown_keys_template.format(
+            range_filter=_day_and_key_filter(side, day, key_from, key_to), **side
+        )
+        key_sets.append({row[0] for row in connection.execute(query).fetchall()})
+    return (
+        [(day, key, sides[1]["name"]) for key in sorted(key_sets[0] - key_sets[1])]
+        + [(day, key, sides[0]["name"]) for key in sorted(key_sets[1] - key_sets[0])]
+    )
+
+
+def _day_and_key_filter(
+    side: Dict[str, str],
+    day: int,
+    key_from: int,
+    key_to: int
+) -> str:
+    return (
+        f"{_day_range_filter(side, day, day)} "
+        f"AND {side['key']} BETWEEN {key_from} AND {key_to}"
+    )
+
+
+def _day_range_filter(side: Dict[str, str], day_from: int, day_to: int) -> str:
+    """Return the filter of the days from day_from to day_to (both as
+    integer YYYYMMDD) on the raw day column of a side, as half-open
+    range up to the day after day_to.
+    """
+    day_next = dt.datetime.strptime(str(day_to), "%Y%m%d") + dt.timedelta(days=1)
+    return "AND " + side["day_range"].format(
+        day_from=day_from, day_next=dt.datetime.strftime(day_next, "%Y%m%d")
+    )
+
+
+def _get_last_day_of_month(month: int) -> int:
+    """Return the last day (YYYYMMDD) of a month given as YYYYMM."""
+    first_of_next = dt.date(month // 100 + month % 100 // 12, month % 100 % 12 + 1, 1)
+    return int(dt.datetime.strftime(first_of_next - dt.timedelta(days=1), "%Y%m%d"))
+
+
+def _get_side(vendor: str, source: str) -> Dict[str, str]:
+    """Return the table, key, day expression and filter of a source,
+    with the DB names of the vendor filled in.
+    """
+    side = dict(drilldown_source_dict[source])
+    side["table"] = side["table"].format(**vendor_db_dict[vendor])
+    side["name"] = source
+    return side
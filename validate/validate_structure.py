@@ -6,27 +6,64 @@ column names like "epos User$" that cause the latter to break.
 import datetime as dt
 import logging
 import pickle
+import re
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 import sqlalchemy
 from sqlalchemy.exc import ProgrammingError
 
+import cassette
+import utils
+from cassette import CassetteConnection
+from dump_backend import DumpConnection
+from sql_queries import (
+    query_index_health_template,
+    query_schema_version,
+    query_stats_histograms,
+    query_table_row_count_template,
+)
+
 logger = logging.getLogger(__name__)
 
+# Column types (base names, as reflected) handled apart by the profile
+PROFILE_CHAR_TYPES = ["CHAR", "VARCHAR", "NCHAR", "NVARCHAR"]
+PROFILE_UNORDERED_TYPES = ["BIT", "BOOLEAN"]
+PROFILE_LOB_TYPES = [
+    "TEXT", "NTEXT", "IMAGE", "XML", "GEOGRAPHY", "GEOMETRY", "SQL_VARIANT"
+]
+PROFILE_TEMPORAL_TYPES = [
+    "DATE", "DATETIME", "DATETIME2", "SMALLDATETIME", "DATETIMEOFFSET", "TIMESTAMP"
+]
+
 
 def inspect_db(
     connection: sqlalchemy.engine.Connection
 ) -> sqlalchemy.engine.reflection.Inspector:
     """Get and return MetaData of DB using SQLAlchemy's
-    inspect() method.
+    inspect() method (or the recording / replaying stand-in if the
+    connection belongs to a cassette, or the stand-in for the dumps).
     """
+    if isinstance(connection, (CassetteConnection, DumpConnection)):
+        return connection.inspect()
     insp = sqlalchemy.inspect(connection)
     return insp
 
 
+def get_schema_version(
+    connection: sqlalchemy.engine.Connection
+) -> Optional[Tuple]:
+    """Return a cheap version of the schema of the DB (number of user
+    objects and their latest modification date), to know if a cached
+    reflection is still valid. Returns None if not available.
+    """
+    if utils.get_dialect_name(connection) != "mssql":
+        return None
+    return tuple(connection.execute(query_schema_version).fetchone())
+
+
 def load_latest_tables_and_views_dict(db_name: str, latest_data_path: str):
     """Load the latest available locally saved dictionary containing
     all the views and tables with their columns.
@@ -86,7 +123,10 @@ def compare_tables_and_views_dicts(
 ):
     """Compare new and old dicts and output the differences."""
     if dict_new == dict_old:
-        logger.info("No changes detected in tables and / or views since last run.\n")
+        logger.info(
+            "No changes detected in tables and / or views since last run.\n",
+            extra={"check": "schema", "db": db_name, "data": {}}
+        )
         added = removed = modified = 0
     else:
         new_keys = set(dict_new.keys())
@@ -98,6 +138,11 @@ def compare_tables_and_views_dicts(
             o : (dict_new[o], dict_old[o]) for o in intersect_keys
             if dict_new[o] != dict_old[o]
         }
+        changes = {
+            "added": sorted(added),
+            "removed": sorted(removed),
+            "modified": {o: {"now": v[0], "previous": v[1]} for o, v in modified.items()},
+        }
         # Pretify the output if len of object is 0
         # Prettify the output
         if len(added) == 0:
@@ -124,7 +169,8 @@ def compare_tables_and_views_dicts(
             "[dark_red]CHANGES DETECTED in tables and / or views since last run[/]:\n"
             f"- Tables / views that have been newly added with this run: {added}\n"
             f"- Tables / views that have been removed with this run: {removed}\n"
-            f"- Tables / views whose columns have changed:{modified}\n{modified_dict}"
+            f"- Tables / views whose columns have changed:{modified}\n{modified_dict}",
+            extra={"check": "schema", "db": db_name, "data": changes}
         )
 
 
@@ -171,14 +217,7 @@ def create_new_empty_cols_dict(
     empty_cols_new = {}
     for table, columns in list(tables_views_new.items()):
         try:
-            query = f"SELECT TOP {n_rows} * FROM [{table}]"
-            result = connection.execute(query).fetchall()
-            result_df = pd.DataFrame(result, columns=columns)
-            result_df.replace("", np.NaN, inplace=True)
-            empty_cols = [
-                col for col in result_df.columns
-                if result_df[col].isnull().all() == True  # noqa: E712, does not work with 'is'!
-            ]
+            empty_cols = _sample_empty_cols(connection, table, columns, n_rows)
             if len(empty_cols) > 0:
                 empty_cols_new[table] = empty_cols
         except ProgrammingError:
@@ -187,7 +226,121 @@ def create_new_empty_cols_dict(
             )
             pass
 
-    # This is for output summary only
+    _log_empty_cols_summary(tables_views_new, empty_cols_new)
+    return empty_cols_new
+
+
+def create_new_empty_cols_dict_from_stats(
+    db_name: str,
+    tables_views_new: Dict[str, List[str]],
+    connection: sqlalchemy.engine.Connection,
+    n_rows: int = 50
+) -> Dict[str, List[str]]:
+    """Alternative to `create_new_empty_cols_dict` that reads the
+    histograms of the existing column statistics instead of sampling
+    rows. A column counts as empty if its histogram only contains NULL
+    and / or empty string steps. Only the columns without statistics
+    (e.g. all columns of views) are checked by sampling the first n rows.
+    Note: The result is only as fresh as the statistics are.
+    """
+    stats_df = _load_stats_histogram_df(connection)
+    empty_cols_new = {}
+    for table, columns in list(tables_views_new.items()):
+        table_stats = stats_df[stats_df["table_name"] == table]
+        columns_with_stats = set(table_stats["column_name"])
+        empty_cols = sorted(
+            table_stats.loc[table_stats["is_empty"], "column_name"].tolist()
+        )
+        columns_without_stats = [
+            col for col in columns if col not in columns_with_stats
+        ]
+        try:
+            if len(columns_without_stats) > 0:
+                empty_cols = sorted(
+                    empty_cols + _sample_empty_cols(
+                        connection, table, columns_without_stats, n_rows
+                    )
+                )
+            if len(empty_cols) > 0:
+                empty_cols_new[table] = empty_cols
+        except ProgrammingError:
+            logger.warning(
+                f"Table / view '{table}' NOT PARSED! It is not included in analysis.\n"
+            )
+            pass
+
+    logger.debug(
+        f"Statistics available for {stats_df['column_name'].count()} columns "
+        f"in {stats_df['table_name'].nunique()} tables."
+    )
+    _log_empty_cols_summary(tables_views_new, empty_cols_new)
+    return empty_cols_new
+
+
+def _sample_empty_cols(
+    connection: sqlalchemy.engine.Connection,
+    table: str,
+    columns: List[str],
+    n_rows: int
+) -> List[str]:
+    """Return the columns of a table or view that have only empty
+    values in the first n rows. The columns are selected explicitly,
+    so that the values are labeled correctly.
+    """
+    col_list = ", ".join([_quote_name(col) for col in columns])
+    if utils.get_dialect_name(connection) == "mssql":
+        query = f"SELECT TOP {n_rows} {col_list} FROM {_quote_name(table)}"
+    else:
+        query = f"SELECT {col_list} FROM {_quote_name(table)} LIMIT {n_rows}"
+    result = connection.execute(query).fetchall()
+    result_df = pd.DataFrame(result, columns=columns)
+    result_df.replace("", np.nan, inplace=True)
+    return [
+        col for col in result_df.columns
+        if result_df[col].isnull().all() == True  # noqa: E712, does not work with 'is'!
+    ]
+
+
+def _load_stats_histogram_df(
+    connection: sqlalchemy.engine.Connection
+) -> pd.DataFrame:
+    """Return a dataframe with one row per column that is the leading
+    column of at least one statistics object, and a flag telling if
+    all its histogram steps are NULL or empty strings. Columns of
+    empty tables have no histogram and are therefore not included.
+    """
+    result = connection.execute(query_stats_histograms).fetchall()
+    hist_df = pd.DataFrame(
+        result,
+        columns=[
+            "table_name", "column_name", "range_high_key", "equal_rows", "range_rows"
+        ]
+    )
+    hist_df["is_empty_step"] = (
+        hist_df["range_high_key"].isnull() | (hist_df["range_high_key"] == "")
+        | (hist_df["equal_rows"] == 0)
+    ) & (hist_df["range_rows"] == 0)
+    stats_df = (
+        hist_df.groupby(["table_name", "column_name"])["is_empty_step"]
+        .all()
+        .rename("is_empty")
+        .reset_index()
+    )
+    return stats_df
+
+
+def _quote_name(name: str) -> str:
+    """Return a bracket quoted T-SQL identifier, so that invalid
+    names like "epos User$" can be queried too.
+    """
+    return "[" + name.replace("]", "]]") + "]"
+
+
+def _log_empty_cols_summary(
+    tables_views_new: Dict[str, List[str]],
+    empty_cols_new: Dict[str, List[str]]
+) -> None:
+    """Output a summary of the empty columns check."""
     count_total = len(list(tables_views_new.keys()))
     count_empty = len(list(empty_cols_new.keys()))
     count_empty_cols = sum([len(v) for v in empty_cols_new.values()])
@@ -195,7 +348,6 @@ def create_new_empty_cols_dict(
         f"{count_empty} out of total {count_total} tables have "
         f"a total of {count_empty_cols} empty columns.\n"
     )
-    return empty_cols_new
 
 
 def compare_empty_cols_dicts(
@@ -205,7 +357,10 @@ def compare_empty_cols_dicts(
 ):
     """Compare new and old dicts and output the differences."""
     if dict_new == dict_old:
-        logger.info("No changes detected in empty columns since last run.")
+        logger.info(
+            "No changes detected in empty columns since last run.",
+            extra={"check": "empty_cols", "db": db_name, "data": {}}
+        )
         added = removed = modified = 0
     else:
         new_keys = set(dict_new.keys())
@@ -217,6 +372,11 @@ def compare_empty_cols_dicts(
             o : (dict_new[o], dict_old[o]) for o in intersect_keys
             if dict_new[o] != dict_old[o]
         }
+        changes = {
+            "added": sorted(added),
+            "removed": sorted(removed),
+            "modified": {o: {"now": v[0], "previous": v[1]} for o, v in modified.items()},
+        }
         # Prettify the output
         if len(added) == 0:
             added = "-"
@@ -242,7 +402,8 @@ def compare_empty_cols_dicts(
             "[dark_red]CHANGES DETECTED in empty columns since last run.[/]\n"
             f"- Tables / views that got empty columns only with this run: {added}\n"
             f"- Tables / views that have no more empty columns with this run: {removed}\n"
-            f"- Tables / views whose empty columns have changed: {modified}\n{modified_dict}"
+            f"- Tables / views whose empty columns have changed: {modified}\n{modified_dict}",
+            extra={"check": "empty_cols", "db": db_name, "data": changes}
         )
 
 
@@ -259,3 +420,481 @@ def save_new_empty_cols_dict(
     actual_structure_path = Path(actual_data_path / "structure")
     with open(actual_structure_path / filename, "wb") as savepath:
         pickle.dump(dict_new, savepath)
+
+
+def load_latest_index_health_dict(
+    db_name: str,
+    latest_data_path: str
+) -> Optional[Dict[str, Dict[str, Dict[str, Any]]]]:
+    """Load the latest available locally saved index health dict.
+    Returns None if there is none (e.g. for runs from before the
+    index health check was added).
+    """
+    name_pattern = f"{db_name}_index_health"
+    latest_structure_path = Path(latest_data_path) / "structure"
+    file_list = [
+        file.name for file in latest_structure_path.iterdir()
+        if file.name.startswith(name_pattern)
+    ]
+    if len(file_list) == 0:
+        return None
+    with open(latest_structure_path / sorted(file_list)[-1], "rb") as f:
+        dict_old = pickle.load(f)
+    return dict_old
+
+
+def create_new_index_health_dict(
+    db_name: str,
+    connection: sqlalchemy.engine.Connection,
+    table_names: List[str]
+) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """Create and return a new dict with the given tables as keys and
+    a dict per index as values, with its definition (type, key and
+    included columns, disabled flag) and its health (fragmentation in
+    percent, number of pages, last update of its statistics).
+    Only available for SQL Server.
+    """
+    if utils.get_dialect_name(connection) != "mssql":
+        logger.warning("Index health check is only available for SQL Server.")
+        return {}
+    query = query_index_health_template.format(
+        table_names=", ".join([_quote_literal(name) for name in table_names])
+    )
+    index_health_new = {}
+    for row in connection.execute(query).fetchall():
+        (
+            table, index, index_type, is_disabled, key_columns,
+            included_columns, fragmentation_pct, page_count, stats_updated
+        ) = row
+        index_health_new.setdefault(table, {})[index] = {
+            "index_type": index_type,
+            "key_columns": key_columns.split(", ") if key_columns else [],
+            "included_columns": (
+                included_columns.split(", ") if included_columns else []
+            ),
+            "is_disabled": bool(is_disabled),
+            "fragmentation_pct": (
+                round(float(fragmentation_pct), 1)
+                if fragmentation_pct is not None else None
+            ),
+            "page_count": int(page_count) if page_count is not None else 0,
+            "stats_updated": stats_updated,
+        }
+    missing_tables = sorted(set(table_names) - set(index_health_new.keys()))
+    if len(missing_tables) > 0:
+        logger.warning(
+            f"No indexes found for {', '.join(missing_tables)} in {db_name}."
+        )
+    return index_health_new
+
+
+def compare_index_health_dicts(
+    dict_new: Dict[str, Dict[str, Dict[str, Any]]],
+    dict_old: Dict[str, Dict[str, Dict[str, Any]]],
+    db_name: str,
+    fragmentation_threshold: float = 30,
+    stats_max_age_days: int = 7,
+    min_page_count: int = 1000
+):
+    """Compare the index definitions of the new and old dicts and
+    output the differences (added, removed, changed or disabled
+    indexes). Output also the indexes (with at least min_page_count
+    pages) fragmented above the threshold and the ones with statistics
+    older than the max age, together with their previous values.
+    """
+    indexes_new = _flatten_index_health_dict(dict_new)
+    indexes_old = _flatten_index_health_dict(dict_old)
+    definition_keys = ["index_type", "key_columns", "included_columns", "is_disabled"]
+
+    added = sorted(set(indexes_new) - set(indexes_old))
+    removed = sorted(set(indexes_old) - set(indexes_new))
+    modified = {
+        index: {
+            key: {"now": indexes_new[index][key], "previous": indexes_old[index][key]}
+            for key in definition_keys
+            if indexes_new[index][key] != indexes_old[index][key]
+        }
+        for index in sorted(set(indexes_new) & set(indexes_old))
+    }
+    modified = {index: changes for index, changes in modified.items() if changes}
+
+    run_date = dt.datetime.combine(cassette.get_run_date(), dt.time())
+    fragmented = {}
+    stale_stats = {}
+    for index, health in indexes_new.items():
+        health_old = indexes_old.get(index, {})
+        if health["page_count"] < min_page_count:
+            continue
+        if (health["fragmentation_pct"] or 0) > fragmentation_threshold:
+            fragmented[index] = {
+                "now": health["fragmentation_pct"],
+                "previous": health_old.get("fragmentation_pct"),
+            }
+        if (
+            health["stats_updated"] is not None
+            and (run_date - health["stats_updated"]).days > stats_max_age_days
+        ):
+            stale_stats[index] = {
+                "now": health["stats_updated"],
+                "previous": health_old.get("stats_updated"),
+            }
+    changes = {
+        "added": added,
+        "removed": removed,
+        "modified": modified,
+        "fragmented": fragmented,
+        "stale_stats": stale_stats,
+    }
+    extra = {"check": "index_health", "db": db_name, "data": changes}
+
+    n_findings = (
+        len(added) + len(removed) + len(modified) + len(fragmented) + len(stale_stats)
+    )
+    if n_findings == 0:
+        logger.info(
+            "No changes detected in indexes since last run, indexes healthy.\n",
+            extra=extra
+        )
+        return
+
+    modified_dict = "".join(
+        [
+            f"{index}:\n" + "".join(
+                [
+                    f" - {key} now: {value['now']}, previous: {value['previous']}\n"
+                    for key, value in index_changes.items()
+                ]
+            )
+            for index, index_changes in modified.items()
+        ]
+    )
+    fragmented_list = [
+        f"{index} ({frag['now']}%, previous {frag['previous']}%)"
+        for index, frag in fragmented.items()
+    ]
+    stale_stats_list = [
+        f"{index} ({stats['now']:%Y-%m-%d})" for index, stats in stale_stats.items()
+    ]
+    logger.warning(
+        "[dark_red]CHANGES DETECTED in indexes since last run, "
+        "or unhealthy indexes[/]:\n"
+        f"- Indexes that have been newly added with this run: {_list_or_dash(added)}\n"
+        f"- Indexes that have been removed with this run: {_list_or_dash(removed)}\n"
+        f"- Indexes whose definition has changed: {_list_or_dash(list(modified))}\n"
+        f"{modified_dict}"
+        f"- Indexes fragmented > {fragmentation_threshold}%: "
+        f"{_list_or_dash(fragmented_list)}\n"
+        f"- Indexes with statistics older than {stats_max_age_days} days: "
+        f"{_list_or_dash(stale_stats_list)}\n",
+        extra=extra
+    )
+
+
+def save_new_index_health_dict(
+    dict_new: Dict[str, Dict[str, Dict[str, Any]]],
+    db_name: str,
+    actual_data_path: str
+):
+    """Save the new dict, timestamped, to a pickle object.
+    (Note: Only the name_patterns differs from the functions above.)
+    """
+    dt_now_str = dt.datetime.strftime(dt.datetime.now(), "%Y-%m-%d-%H-%M-%S")
+    filename = f"{db_name}_index_health_{dt_now_str}"
+    actual_structure_path = Path(actual_data_path / "structure")
+    with open(actual_structure_path / filename, "wb") as savepath:
+        pickle.dump(dict_new, savepath)
+
+
+def load_latest_profile_df(
+    db_name: str,
+    latest_data_path: str
+) -> Optional[pd.DataFrame]:
+    """Load the latest available locally saved profile of a DB.
+    Returns None if there is none (e.g. for runs from before the
+    profile check was added).
+    """
+    name_pattern = f"{db_name}_profile"
+    latest_structure_path = Path(latest_data_path) / "structure"
+    file_list = [
+        file.name for file in latest_structure_path.iterdir()
+        if file.name.startswith(name_pattern)
+    ]
+    if len(file_list) == 0:
+        return None
+    return pd.read_parquet(latest_structure_path / sorted(file_list)[-1])
+
+
+def create_new_profile_df(
+    db_name: str,
+    tables_views_new: Dict[str, List[str]],
+    connection: sqlalchemy.engine.Connection,
+    table_names: List[str],
+    sample_percent: Optional[float] = None,
+    exact_max_rows: int = 1000000
+) -> pd.DataFrame:
+    """Create and return the profile of the given tables: one row per
+    column with the number of rows, the ratio of NULLs (and empty
+    strings), min, max (as strings) and the number of distinct values.
+    Every table is profiled with one aggregate query over all its
+    columns. Tables with up to `exact_max_rows` rows are fully scanned
+    with exact distinct counts, larger ones with approximate counts (on
+    a TABLESAMPLE of n percent of their pages, if a sample percent is
+    passed).
+    """
+    dialect = utils.get_dialect_name(connection)
+    if sample_percent is not None and dialect == "sqlite":
+        logger.warning("TABLESAMPLE not available for SQLite, tables fully scanned.")
+        sample_percent = None
+    missing_tables = [table for table in table_names if table not in tables_views_new]
+    if len(missing_tables) > 0:
+        logger.warning(
+            f"Tables {', '.join(missing_tables)} to profile not found in {db_name}."
+        )
+    insp = inspect_db(connection)
+    profile_dfs = []
+    for table in [table for table in table_names if table in tables_views_new]:
+        columns = insp.get_columns(table)
+        try:
+            is_exact = (
+                dialect == "sqlite"
+                or _get_row_count(connection, table, dialect) <= exact_max_rows
+            )
+            table_sample_percent = None if is_exact else sample_percent
+            query = _build_profile_query(
+                table, columns, dialect, table_sample_percent, is_exact
+            )
+            result_proxy = connection.execute(query)
+            row = dict(zip(list(result_proxy.keys()), result_proxy.fetchone()))
+        except ProgrammingError:
+            logger.warning(
+                f"Table '{table}' NOT PROFILED! It is not included in analysis.\n"
+            )
+            continue
+        n_cols = range(len(columns))
+        n_rows = int(row["n_rows"])
+        n_nulls = np.array([row[f"n_null_{i}"] for i in n_cols], dtype="float64")
+        profile_dfs.append(
+            pd.DataFrame(
+                {
+                    "table_name": table,
+                    "column_name": [col["name"] for col in columns],
+                    "data_type": [_get_base_type(col["type"]) for col in columns],
+                    "n_rows": n_rows,
+                    "null_ratio": n_nulls / n_rows if n_rows > 0 else np.nan,
+                    "min_value": [row[f"min_{i}"] for i in n_cols],
+                    "max_value": [row[f"max_{i}"] for i in n_cols],
+                    "n_distinct": np.array(
+                        [row[f"n_distinct_{i}"] for i in n_cols], dtype="float64"
+                    ),
+                    "is_exact": is_exact,
+                    "sample_percent": np.float64(
+                        table_sample_percent
+                        if table_sample_percent is not None else np.nan
+                    ),
+                }
+            )
+        )
+    if len(profile_dfs) == 0:
+        return pd.DataFrame()
+    profile_df = pd.concat(profile_dfs, ignore_index=True)
+    profile_df["min_value"] = profile_df["min_value"].astype("string")
+    profile_df["max_value"] = profile_df["max_value"].astype("string")
+    logger.debug(f"{len(profile_df)} columns of {len(profile_dfs)} tables profiled.")
+    return profile_df
+
+
+def compare_profile_dfs(
+    df_new: pd.DataFrame,
+    df_old: pd.DataFrame,
+    db_name: str,
+    null_ratio_threshold: float = 0.05,
+    distinct_drop_threshold: float = 0.5
+):
+    """Compare the profiles of the columns in both runs and output the
+    columns whose NULL ratio has shifted by more than the threshold,
+    whose number of distinct values has dropped by more than the
+    threshold, and the date columns whose max is unchanged although
+    the table has grown. Distinct counts are only compared between
+    profiles that are both exact, or both approximate with the same
+    sample percent, max dates for full scans only.
+    """
+    if "is_exact" not in df_old.columns:
+        # Profiles from before the exact profile of small tables
+        df_old = df_old.assign(is_exact=False)
+    df = df_new.merge(
+        df_old, on=["table_name", "column_name"], how="inner", suffixes=("", "_old")
+    )
+    df["column"] = df["table_name"] + "." + df["column_name"]
+    is_comparable = (
+        (df["is_exact"] == df["is_exact_old"])
+        & (df["sample_percent"].fillna(100) == df["sample_percent_old"].fillna(100))
+    )
+    null_shifted = df[
+        (df["null_ratio"] - df["null_ratio_old"]).abs() > null_ratio_threshold
+    ]
+    distinct_dropped = df[
+        is_comparable
+        & (df["n_distinct"] < df["n_distinct_old"] * (1 - distinct_drop_threshold))
+    ]
+    is_full_scan = df["sample_percent"].isnull() & df["sample_percent_old"].isnull()
+    max_frozen = df[
+        is_full_scan
+        & df["data_type"].isin(PROFILE_TEMPORAL_TYPES)
+        & (df["n_rows"] > df["n_rows_old"])
+        & (df["max_value"] == df["max_value_old"]).fillna(False)
+    ]
+    changes = {
+        "null_ratio_shifted": {
+            row.column: {"now": row.null_ratio, "previous": row.null_ratio_old}
+            for row in null_shifted.itertuples()
+        },
+        "distinct_dropped": {
+            row.column: {"now": row.n_distinct, "previous": row.n_distinct_old}
+            for row in distinct_dropped.itertuples()
+        },
+        "max_frozen": {
+            row.column: {"now": row.max_value, "n_rows": row.n_rows}
+            for row in max_frozen.itertuples()
+        },
+    }
+    extra = {"check": "profile", "db": db_name, "data": changes}
+
+    n_findings = len(null_shifted) + len(distinct_dropped) + len(max_frozen)
+    if n_findings == 0:
+        logger.info(
+            f"No distribution shifts detected in {df['column'].count()} profiled "
+            f"columns since last run.\n",
+            extra=extra
+        )
+        return
+
+    null_shifted_list = [
+        f"{column} ({ratio['previous']:.1%} -> {ratio['now']:.1%})"
+        for column, ratio in changes["null_ratio_shifted"].items()
+    ]
+    distinct_dropped_list = [
+        f"{column} ({n['previous']:.0f} -> {n['now']:.0f})"
+        for column, n in changes["distinct_dropped"].items()
+    ]
+    max_frozen_list = [
+        f"{column} ({frozen['now']})"
+        for column, frozen in changes["max_frozen"].items()
+    ]
+    logger.warning(
+        "[dark_red]DISTRIBUTION SHIFTS DETECTED in profiled columns "
+        "since last run[/]:\n"
+        f"- Columns with NULL ratio shifted > {null_ratio_threshold:.0%}: "
+        f"{_list_or_dash(null_shifted_list)}\n"
+        f"- Columns with distinct values dropped > {distinct_drop_threshold:.0%}: "
+        f"{_list_or_dash(distinct_dropped_list)}\n"
+        f"- Date columns with unchanged max although rows were added: "
+        f"{_list_or_dash(max_frozen_list)}\n",
+        extra=extra
+    )
+
+
+def save_new_profile_df(
+    df_new: pd.DataFrame,
+    db_name: str,
+    actual_data_path: str
+):
+    """Save the new profile, timestamped, to a parquet file."""
+    dt_now_str = dt.datetime.strftime(dt.datetime.now(), "%Y-%m-%d-%H-%M-%S")
+    filename = f"{db_name}_profile_{dt_now_str}"
+    actual_structure_path = Path(actual_data_path / "structure")
+    df_new.to_parquet(actual_structure_path / filename, index=False)
+
+
+def _build_profile_query(
+    table: str,
+    columns: List[Dict[str, Any]],
+    dialect: str,
+    sample_percent: Optional[float] = None,
+    is_exact: bool = False
+) -> str:
+    """Return the aggregate query profiling all the columns of a table
+    in one scan, with the columns `n_rows` and `n_null_<i>`, `min_<i>`,
+    `max_<i>` and `n_distinct_<i>` for the i-th column. The distinct
+    values are counted exactly if `is_exact` (or on SQLite).
+    """
+    select_list = ['COUNT(*) AS "n_rows"']
+    for i, col in enumerate(columns):
+        name = _quote_name(col["name"])
+        base_type = _get_base_type(col["type"])
+        if base_type in PROFILE_CHAR_TYPES:
+            is_null = f"{name} IS NULL OR {name} = ''"
+        else:
+            is_null = f"{name} IS NULL"
+        select_list.append(
+            f'SUM(CASE WHEN {is_null} THEN 1 ELSE 0 END) AS "n_null_{i}"'
+        )
+        for func in ["MIN", "MAX"]:
+            if base_type in PROFILE_LOB_TYPES + PROFILE_UNORDERED_TYPES:
+                expr = "NULL"
+            elif dialect == "mssql" and base_type in PROFILE_TEMPORAL_TYPES:
+                expr = f"CONVERT(NVARCHAR(100), {func}({name}), 126)"
+            elif dialect == "mssql":
+                expr = f"CAST({func}({name}) AS NVARCHAR(100))"
+            else:
+                expr = f"CAST({func}({name}) AS VARCHAR(100))"
+            select_list.append(f'{expr} AS "{func.lower()}_{i}"')
+        if base_type in PROFILE_LOB_TYPES:
+            expr = "NULL"
+        elif dialect in ["mssql", "duckdb"] and not is_exact:
+            expr = f"APPROX_COUNT_DISTINCT({name})"
+        else:
+            expr = f"COUNT(DISTINCT {name})"
+        select_list.append(f'{expr} AS "n_distinct_{i}"')
+    query = (
+        "SELECT\n    " + ",\n    ".join(select_list)
+        + f"\nFROM {_quote_name(table)}"
+    )
+    if sample_percent is not None:
+        query += f" TABLESAMPLE SYSTEM ({float(sample_percent)} PERCENT)"
+    return query
+
+
+def _get_row_count(
+    connection: sqlalchemy.engine.Connection,
+    table: str,
+    dialect: str
+) -> int:
+    """Return the number of rows of a table, from the partition metadata
+    on SQL Server (without a scan), else with a `COUNT(*)`.
+    """
+    if dialect == "mssql":
+        query = query_table_row_count_template.format(
+            table_name=_quote_literal(f"dbo.{_quote_name(table)}")
+        )
+    else:
+        query = f'SELECT COUNT(*) AS "n_rows" FROM {_quote_name(table)}'
+    n_rows = connection.execute(query).scalar()
+    return int(n_rows) if n_rows is not None else 0
+
+
+def _get_base_type(sql_type: Any) -> str:
+    """Return the upper case base name of a reflected column type,
+    e.g. NVARCHAR for `NVARCHAR(50) COLLATE ...`.
+    """
+    match = re.match(r"\s*(\w+)", str(sql_type))
+    return match.group(1).upper() if match is not None else ""
+
+
+def _flatten_index_health_dict(
+    index_health_dict: Dict[str, Dict[str, Dict[str, Any]]]
+) -> Dict[str, Dict[str, Any]]:
+    """Return the index health dict keyed by `table.index`."""
+    return {
+        f"{table}.{index}": health
+        for table, indexes in index_health_dict.items()
+        for index, health in indexes.items()
+    }
+
+
+def _quote_literal(value: str) -> str:
+    """Return a value as quoted T-SQL string literal."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _list_or_dash(items: List[str]) -> str:
+    return ", ".join(items) if len(items) > 0 else "-"
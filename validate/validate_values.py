@@ -1,23 +1,52 @@
 import datetime as dt
 import dateutil.relativedelta as rd
 import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 import sqlalchemy
 
+import arrow_fetch
+from journal import RunJournal
+from query_costs import QueryCosts
+from query_stats import QueryStats, track_query
+from sql_queries import (
+    period_expr_dict,
+    query_reconciliation_template,
+    query_sample_keys_create_template,
+    query_sample_keys_drop,
+    query_sample_keys_insert,
+    reconciliation_source_dict,
+    sample_query_dict,
+    schema_dict,
+    vendor_db_dict,
+)
+
 logger = logging.getLogger(__name__)
 
+# Statuses of sampled entities that fail the consistency check ("new"
+# entities have no previous values to compare)
+SAMPLE_FAILED_STATUSES = ["changed", "missing"]
+
 
-def get_start_and_end_date_strings(n_months: int) -> Tuple[str, str]:
+def get_start_and_end_date_strings(
+    n_months: int,
+    run_date: Optional[dt.date] = None
+) -> Tuple[str, str]:
     """Return strings for the start and end date of the validation
     queries (where applicable). The end date is the last day of the
-    previous month relative to the run date. The start day is n
-    months back. n_months can be configured in the `config.yaml`.
+    previous month relative to the run date (default is today). The
+    start day is n months back. n_months can be configured in the
+    `config.yaml`.
     """
-    end_date = dt.datetime.now().date().replace(day=1) - dt.timedelta(days=1)
+    run_date = run_date or dt.datetime.now().date()
+    end_date = run_date.replace(day=1) - dt.timedelta(days=1)
     start_date = end_date + dt.timedelta(days=1) - rd.relativedelta(months=n_months)
     start_date = dt.datetime.strftime(start_date, format="%Y%m%d")
     end_date = dt.datetime.strftime(end_date, format="%Y%m%d")
@@ -32,56 +61,302 @@ def load_old_value_dfs(latest_data_path: str) -> Dict[str, pd.DataFrame]:
     latest_values_path = Path(latest_data_path) / "values"
     for file in latest_values_path.iterdir():
         file_name = file.name[:-11]  # truncate the timestamp
+        # The fixed three members/products of older runs seed the sample
+        file_name = file_name.replace("_DM_three_", "_DM_sample_")
         df_dict_old[file_name] = pd.read_parquet(file)
+        # Cast also the dfs saved before the schemas were declared
+        if file_name in schema_dict:
+            df_dict_old[file_name] = apply_schema(
+                df_dict_old[file_name], schema_dict[file_name], file_name
+            )
 
     logger.debug(f"{len(list(df_dict_old.items()))} previous dataframes loaded.")
     return df_dict_old
 
 
+def load_saved_value_df(data_path: Path, q_name: str) -> pd.DataFrame:
+    """Load the dataframe of a query saved to the 'values' subfolder
+    of a data folder (e.g. by a run that is resumed).
+    """
+    values_path = Path(data_path) / "values"
+    file_list = sorted(values_path.glob(f"{q_name}_????-??-??"))
+    try:
+        df = pd.read_parquet(file_list[-1])
+    except IndexError:
+        logger.error(f"No saved dataframe '{q_name}' at path {values_path}.")
+        raise
+    return apply_schema(df, schema_dict.get(q_name, {}), q_name)
+
+
 def load_new_value_dfs(
     connection: sqlalchemy.engine.Connection,
     query_dict: Dict[str, str],
     start_date: str,
-    end_date: str
+    end_date: str,
+    engine: Optional[sqlalchemy.engine.Engine] = None,
+    months_per_partition: Optional[int] = None,
+    n_workers: int = 4,
+    journal: Optional[RunJournal] = None,
+    query_stats: Optional[QueryStats] = None,
+    query_costs: Optional[QueryCosts] = None,
+    n_query_workers: int = 1
 ) -> Dict[str, pd.DataFrame]:
     """Return a dict of df_name : df pairs by iterating over all
     the queries in the query dict of the `sql_queries.py` module.
+    If an engine and a number of months per partition are passed, the
+    month-grouped queries are split into partitions that run in
+    parallel (see `load_partitioned_value_df`). If a journal is
+    passed, every result is saved as soon as it is loaded, and the
+    results journaled as done are loaded from disk instead. If query
+    stats are passed, the queries run with the isolation level of
+    their check and are instrumented (see `query_stats.py`). If query
+    costs are passed, the queries are started longest-first (on
+    n_query_workers connections of the engine, if more than one), their
+    runtimes are recorded and a progress display shows the ETA.
     """
+    q_names = list(query_dict.keys())
+    if query_costs is not None:
+        q_names = query_costs.order_longest_first(q_names)
     df_dict_new = {}
-    for n, item in enumerate(list(query_dict.items())):
-        q_name, query = item[0], item[1]
-        query = query.replace('start_date', start_date)
-        query = query.replace('end_date', end_date)
-        result = connection.execute(query).fetchall()
-        result_df = pd.DataFrame(result, columns=result[0].keys())
-
-        # Fix dtypes
-        for col in result_df:
-            if col in ["total_value", "n_trx", "n_members"]:
-                result_df[col] = pd.to_numeric(result_df[col], errors="raise")
-            else:
-                result_df[col] = result_df[col].astype(str)
+
+    def load_value_df(q_name: str, connection: sqlalchemy.engine.Connection) -> None:
+        query = query_dict[q_name]
+        if journal is not None and journal.is_done(f"values/{q_name}"):
+            df_dict_new[q_name] = load_saved_value_df(journal.data_path, q_name)
+            logger.debug(f"{q_name} loaded from the resumed run.")
+            return
+        started = time.perf_counter()
+        # Month-grouped queries are the ones with `yearmon` in the schema
+        if (
+            engine is not None and months_per_partition
+            and "yearmon" in schema_dict.get(q_name, {})
+        ):
+            result_df, isolation_level = load_partitioned_value_df(
+                engine,
+                q_name,
+                query,
+                start_date,
+                end_date,
+                months_per_partition,
+                n_workers,
+                query_stats
+            )
+        elif arrow_fetch.supports(connection):
+            # Columnar: cast and saved as Arrow table, no objects per row
+            with track_query(
+                connection, q_name, query_stats, on_connection=False
+            ) as isolation_level:
+                table = arrow_fetch.fetch_table(
+                    connection,
+                    _fill_in_dates(query, start_date, end_date),
+                    isolation_level
+                )
+            if query_costs is not None:
+                query_costs.record(q_name, time.perf_counter() - started)
+            table = arrow_fetch.cast_to_schema(
+                table, schema_dict.get(q_name, {}), q_name
+            )
+            if journal is not None:
+                arrow_fetch.write_parquet(
+                    table, get_value_file_path(journal.data_path, q_name)
+                )
+                journal.mark_done(f"values/{q_name}", isolation_level=isolation_level)
+            df_dict_new[q_name] = table.to_pandas()
+            logger.debug(
+                f"{q_name} fetched as Arrow table. ({len(df_dict_new)}/{len(q_names)})"
+            )
+            return
+        else:
+            with track_query(connection, q_name, query_stats) as isolation_level:
+                result_df = _fetch_value_df(connection, query, start_date, end_date)
+        if query_costs is not None:
+            query_costs.record(q_name, time.perf_counter() - started)
+        result_df = apply_schema(result_df, schema_dict.get(q_name, {}), q_name)
+        if journal is not None:
+            save_new_value_dfs({q_name: result_df}, journal.data_path)
+            journal.mark_done(f"values/{q_name}", isolation_level=isolation_level)
 
         df_dict_new[q_name] = result_df
-        logger.debug(
-            f"{q_name} appended to dict. "
-            f"({n+1}/{len(list(query_dict.items()))})"
+        logger.debug(f"{q_name} appended to dict. ({len(df_dict_new)}/{len(q_names)})")
+
+    def load_value_df_on_own_connection(q_name: str) -> str:
+        with engine.connect() as worker_connection:
+            load_value_df(q_name, worker_connection)
+        return q_name
+
+    with (
+        query_costs.progress(q_names, n_query_workers) if query_costs is not None
+        else nullcontext(lambda q_name: None)
+    ) as done:
+        if engine is not None and n_query_workers > 1:
+            # The pool takes the queries in order, i.e. longest-first
+            with ThreadPoolExecutor(max_workers=n_query_workers) as executor:
+                futures = [
+                    executor.submit(load_value_df_on_own_connection, q_name)
+                    for q_name in q_names
+                ]
+                for future in as_completed(futures):
+                    done(future.result())
+        else:
+            for q_name in q_names:
+                load_value_df(q_name, connection)
+                done(q_name)
+
+    return {q_name: df_dict_new[q_name] for q_name in query_dict}
+
+
+def load_partitioned_value_df(
+    engine: sqlalchemy.engine.Engine,
+    q_name: str,
+    query: str,
+    start_date: str,
+    end_date: str,
+    months_per_partition: int,
+    n_workers: int,
+    query_stats: Optional[QueryStats] = None
+) -> Tuple[pd.DataFrame, Optional[str]]:
+    """Run a month-grouped query as range queries over partitions of n
+    months, concurrently on n_workers connections of the engine's pool,
+    and return the concatenated result in `yearmon` order, together
+    with the isolation level of the partitions (None if not set). The
+    merge is exact, as every month falls into exactly one partition. All but the
+    last partition are bounded half-open (< start of next partition),
+    so that datetime columns don't lose the time of the last day.
+    """
+    partitions = split_date_range(start_date, end_date, months_per_partition)
+
+    def fetch_partition(i_partition: int) -> Tuple[pd.DataFrame, Optional[str]]:
+        p_start, p_end = partitions[i_partition]
+        p_query = query
+        if i_partition < len(partitions) - 1:
+            p_query = _bound_query_half_open(query)
+            p_end = partitions[i_partition + 1][0]
+        with engine.connect() as connection:
+            check = f"{q_name}[{p_start}-{p_end}]"
+            with track_query(connection, check, query_stats) as isolation_level:
+                p_df = _fetch_value_df(connection, p_query, p_start, p_end)
+        return p_df, isolation_level
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(fetch_partition, range(len(partitions))))
+    partition_dfs = [p_df for p_df, _ in results]
+    result_df = pd.concat(partition_dfs, ignore_index=True)
+    result_df = result_df.sort_values("yearmon", kind="stable").reset_index(drop=True)
+    logger.debug(
+        f"{q_name}: {len(partitions)} partitions fetched with {n_workers} workers."
+    )
+    return result_df, results[0][1]
+
+
+def split_date_range(
+    start_date: str,
+    end_date: str,
+    months_per_partition: int
+) -> List[Tuple[str, str]]:
+    """Return a list of (start, end) date strings (format YYYYMMDD)
+    covering the range from start_date to end_date in partitions of
+    n months each (the last one can be shorter).
+    """
+    start = dt.datetime.strptime(start_date, "%Y%m%d").date()
+    end = dt.datetime.strptime(end_date, "%Y%m%d").date()
+    partitions = []
+    while start <= end:
+        next_start = start + rd.relativedelta(months=months_per_partition)
+        p_end = min(next_start - dt.timedelta(days=1), end)
+        partitions.append(
+            (
+                dt.datetime.strftime(start, format="%Y%m%d"),
+                dt.datetime.strftime(p_end, format="%Y%m%d")
+            )
         )
+        start = next_start
+    return partitions
 
-    return df_dict_new
+
+def _bound_query_half_open(query: str) -> str:
+    """Replace the `<col> BETWEEN 'start_date' AND 'end_date'` filter
+    of a query by `<col> >= 'start_date' AND <col> < 'end_date'`.
+    """
+    return re.sub(
+        r"(\w+) BETWEEN 'start_date' AND 'end_date'",
+        r"\1 >= 'start_date' AND \1 < 'end_date'",
+        query
+    )
+
+
+def _fetch_value_df(
+    connection: sqlalchemy.engine.Connection,
+    query: str,
+    start_date: str,
+    end_date: str
+) -> pd.DataFrame:
+    """Run a value query for the given dates and return the result
+    as dataframe (dtypes as delivered by the driver).
+    """
+    result_proxy = connection.execute(_fill_in_dates(query, start_date, end_date))
+    columns = list(result_proxy.keys())
+    return pd.DataFrame(result_proxy.fetchall(), columns=columns)
+
+
+def _fill_in_dates(query: str, start_date: str, end_date: str) -> str:
+    query = query.replace('start_date', start_date)
+    return query.replace('end_date', end_date)
+
+
+def apply_schema(
+    df: pd.DataFrame,
+    schema: Dict[str, str],
+    q_name: str
+) -> pd.DataFrame:
+    """Return the df with its columns cast to the dtypes declared in
+    the schema of the check (see `schema_dict` in `sql_queries.py`).
+    Declared columns that are missing raise an error, undeclared
+    columns are kept with the dtype inferred from the values, and a
+    warning is output.
+    """
+    missing_cols = [col for col in schema if col not in df.columns]
+    if len(missing_cols) > 0:
+        logger.error(f"{q_name}: declared columns {missing_cols} missing in result.")
+        raise ValueError(f"Result of {q_name} does not match its declared schema.")
+    undeclared_cols = [col for col in df.columns if col not in schema]
+    if len(undeclared_cols) > 0:
+        logger.warning(
+            f"{q_name}: no dtype declared for columns {undeclared_cols}, "
+            f"please add them to the schema_dict."
+        )
+
+    df = df.copy()
+    for col, dtype in schema.items():
+        if dtype.startswith("datetime64"):
+            df[col] = pd.to_datetime(df[col]).astype(dtype)
+        elif dtype == "category":
+            # Strings first, so that the categories are the same no
+            # matter if the values come from the DB or from parquet
+            df[col] = df[col].astype(str).where(df[col].notnull()).astype(dtype)
+        else:
+            df[col] = pd.to_numeric(df[col], errors="raise").astype(dtype)
+    for col in undeclared_cols:
+        df[col] = df[col].infer_objects()
+    return df
 
 
 def save_new_value_dfs(df_dict: Dict[str, pd.DataFrame], actual_data_path: Path):
     """Save the new dataframes, timestamped, to parquet files in
     the 'values' subfolder of the actual data folder.
     """
-    date_today_str = dt.datetime.strftime(dt.date.today(), "%Y-%m-%d")
     for q_name, df in df_dict.items():
-        filename = f"{q_name}_{date_today_str}"
-        df.to_parquet(f"{actual_data_path / 'values' / filename}", index=False)
+        if q_name in schema_dict:
+            df = apply_schema(df, schema_dict[q_name], q_name)
+        df.to_parquet(f"{get_value_file_path(actual_data_path, q_name)}", index=False)
     logger.debug(f"{len(list(df_dict.items()))} new dataframes saved to disc.\n")
 
 
+def get_value_file_path(actual_data_path: Path, q_name: str) -> Path:
+    """Return the path of today's parquet file of a value check."""
+    date_today_str = dt.datetime.strftime(dt.date.today(), "%Y-%m-%d")
+    return Path(actual_data_path) / "values" / f"{q_name}_{date_today_str}"
+
+
 def grab_and_truncate_df_names_for_vendor(
     vendor_name: str,
     df_dict_new: Dict[str, pd.DataFrame],
@@ -148,6 +423,86 @@ def return_subtraction_df(
     return df_diff
 
 
+def load_reconciliation_df(
+    connection: sqlalchemy.engine.Connection,
+    vendor: str,
+    source_1: str,
+    source_2: str,
+    start_date: str,
+    end_date: str,
+    granularity: str = "month",
+    tolerance: float = 0
+) -> pd.DataFrame:
+    """Return a dataframe with the values of the numeric cols of
+    source_2 subtracted from the ones of source_1, like the one of
+    `return_subtraction_df`, but computed in one server-side statement
+    (pushdown mode). Only the periods where at least one of the
+    differences exceeds the tolerance are returned. The granularity
+    can be "month" (index `yearmon`) or "day" (index `yearmonday`).
+    """
+    try:
+        period_exprs = period_expr_dict[granularity]
+    except KeyError:
+        logger.error(f"Unknown reconciliation granularity '{granularity}'.")
+        raise
+    format_kwargs = {
+        "DM": vendor_db_dict[vendor]["DM"],
+        "bcl": vendor_db_dict[vendor]["bcl"],
+        "period_DateSK": period_exprs["DateSK"],
+        "period_TrxDate": period_exprs["TrxDate"],
+    }
+    period_name = "yearmon" if granularity == "month" else "yearmonday"
+    query = query_reconciliation_template.format(
+        side_1=reconciliation_source_dict[source_1].format(**format_kwargs),
+        side_2=reconciliation_source_dict[source_2].format(**format_kwargs),
+        period_name=period_name,
+        tolerance=float(tolerance)
+    )
+    result_proxy = connection.execute(_fill_in_dates(query, start_date, end_date))
+    columns = list(result_proxy.keys())
+    df_diff = pd.DataFrame(result_proxy.fetchall(), columns=columns)
+    df_diff = df_diff.set_index(period_name)
+    df_diff.index = df_diff.index.astype("int32")
+    df_diff.index.name = None
+    for col in df_diff.columns:
+        df_diff[col] = pd.to_numeric(df_diff[col], errors="raise")
+    return df_diff
+
+
+def load_reconciliation_dfs(
+    connection: sqlalchemy.engine.Connection,
+    vendor_list: List[str],
+    start_date: str,
+    end_date: str,
+    granularity: str = "month",
+    tolerance: float = 0,
+    query_stats: Optional[QueryStats] = None
+) -> Dict[str, Dict[str, pd.DataFrame]]:
+    """Return a dict with the pushdown reconciliation of DM_FactTrans
+    to bcl_EtlTransaction and to DM_FactTransItem for every vendor,
+    in the form {vendor: {name of source_2: df_diff}}. The check name
+    for the isolation level is `reconciliation`.
+    """
+    recon_dict = {}
+    for vendor in [vendor.lower() for vendor in vendor_list]:
+        recon_dict[vendor] = {}
+        for source_2 in ["bcl_EtlTransaction", "DM_FactTransItem"]:
+            check = f"reconciliation[{vendor}_{source_2}]"
+            with track_query(connection, check, query_stats):
+                recon_dict[vendor][source_2] = load_reconciliation_df(
+                    connection,
+                    vendor,
+                    "DM_FactTrans",
+                    source_2,
+                    start_date,
+                    end_date,
+                    granularity,
+                    tolerance
+                )
+        logger.debug(f"Pushdown reconciliation for {vendor.upper()} done.")
+    return recon_dict
+
+
 # Member validation
 
 
@@ -166,26 +521,139 @@ def return_diff_member_stuff(df_dict_new, df_dict_old) -> Tuple[int, int]:
     return diff_n_MemberAK, diff_defaultDates
 
 
-def compare_three_members(df_dict_new, df_dict_old) -> bool:
-    """Return a boolean indicating of the 2019 summary values of 3 members
-    have changed or not. If they have, the MemberAK may have changed.
-    """
-    return df_dict_new["DM_three_members"].iloc[:, :-1].equals(
-        df_dict_old["DM_three_members"].iloc[:, :-1]
-    )
+# Sampled member and product validation
 
 
-# Product validation
+def load_sample_value_dfs(
+    connection: sqlalchemy.engine.Connection,
+    vendor_list: List[str],
+    df_dict_old: Dict[str, pd.DataFrame],
+    sample_size: int,
+    journal: Optional[RunJournal] = None,
+    query_stats: Optional[QueryStats] = None
+) -> Dict[str, pd.DataFrame]:
+    """Return a dict of df_name : df pairs with the 2019 summaries of
+    the sampled members and products (see `sample_query_dict` in
+    `sql_queries.py`), one query per check for the whole sample. A
+    journal and query stats are used like in `load_new_value_dfs`.
+    """
+    vendors = [vendor.lower() for vendor in vendor_list]
+    df_dict_new = {}
+    for q_name, sample_query in sample_query_dict.items():
+        if q_name.split("_", 1)[0] not in vendors:
+            continue
+        if journal is not None and journal.is_done(f"values/{q_name}"):
+            df_dict_new[q_name] = load_saved_value_df(journal.data_path, q_name)
+            logger.debug(f"{q_name} loaded from the resumed run.")
+            continue
+        sample_keys = get_sample_keys(
+            connection, q_name, df_dict_old.get(q_name), sample_size
+        )
+        with track_query(connection, q_name, query_stats) as isolation_level:
+            result_df = _fetch_sample_df(connection, sample_query, sample_keys)
+        df_dict_new[q_name] = apply_schema(result_df, schema_dict[q_name], q_name)
+        if journal is not None:
+            save_new_value_dfs({q_name: df_dict_new[q_name]}, journal.data_path)
+            journal.mark_done(f"values/{q_name}", isolation_level=isolation_level)
+        logger.debug(f"{q_name} for {len(sample_keys)} sampled entities loaded.")
+    return df_dict_new
 
 
-def compare_three_products(df_dict_new, df_dict_old) -> bool:
-    """Return a boolean indicating of the 2019 summary values of 3 products
-    have changed or not. If they have, the ProductAK (in the case of Loeb)
-    or the TransactionItemCode (in the case of PKZ) may have changed.
+def get_sample_keys(
+    connection: sqlalchemy.engine.Connection,
+    q_name: str,
+    df_old: Optional[pd.DataFrame],
+    sample_size: int
+) -> List[Any]:
+    """Return the keys of the sampled entities of a check. The keys
+    of the previous run are reused, so that the same entities are
+    compared even if new ones have lower hashes. Only if there are
+    fewer than sample_size of them (e.g. at the first run), the sample
+    is topped up with the entities picked by hash of their keys.
+    """
+    key_col = sample_query_dict[q_name]["key_cols"][0]
+    sample_keys = []
+    if df_old is not None and key_col in df_old.columns:
+        sample_keys = df_old[key_col].dropna().astype(object).unique().tolist()
+    if len(sample_keys) < sample_size:
+        query = sample_query_dict[q_name]["pick"].format(sample_size=int(sample_size))
+        known_keys = set(sample_keys)
+        picked_keys = [
+            row[0] for row in connection.execute(query).fetchall()
+            if row[0] not in known_keys
+        ]
+        sample_keys += picked_keys[:sample_size - len(sample_keys)]
+    return sample_keys[:sample_size]
+
+
+def _fetch_sample_df(
+    connection: sqlalchemy.engine.Connection,
+    sample_query: Dict[str, Any],
+    sample_keys: List[Any]
+) -> pd.DataFrame:
+    """Ship the sample keys in one batch to a temp table and return
+    the result of the summary query joining on it.
     """
-    return df_dict_new["DM_three_products"].iloc[:, :-1].equals(
-        df_dict_old["DM_three_products"].iloc[:, :-1]
+    connection.execute(
+        query_sample_keys_create_template.format(key_type=sample_query["key_type"])
     )
+    try:
+        if len(sample_keys) > 0:
+            connection.execute(query_sample_keys_insert, [(key,) for key in sample_keys])
+        result_proxy = connection.execute(sample_query["summary"])
+        return pd.DataFrame(result_proxy.fetchall(), columns=list(result_proxy.keys()))
+    finally:
+        connection.execute(query_sample_keys_drop)
+
+
+def compare_sample_dfs(
+    df_new: pd.DataFrame,
+    df_old: pd.DataFrame,
+    key_cols: List[str]
+) -> pd.DataFrame:
+    """Return the status of every sampled entity (identified by the
+    first of the key_cols) compared to the previous run: "ok",
+    "changed" (different values or rows), "missing" (only in the
+    previous run, e.g. re-keyed) or "new" (only in the actual run,
+    e.g. added by a top-up of the sample). Only the statuses in
+    SAMPLE_FAILED_STATUSES count as failed. The date of the DB check
+    is not compared.
+    """
+    value_cols = [
+        col for col in df_new.columns if col not in key_cols + ["date_db_check"]
+    ]
+    df = df_new.merge(
+        df_old, on=key_cols, how="outer", suffixes=("_new", "_old"), indicator=True
+    )
+    is_equal = np.array(df["_merge"] == "both")
+    for col in value_cols:
+        values_new, values_old = df[f"{col}_new"], df[f"{col}_old"]
+        if pd.api.types.is_numeric_dtype(values_new):
+            is_equal &= np.isclose(
+                values_new.astype(float), values_old.astype(float), equal_nan=True
+            )
+        else:
+            is_equal &= (
+                (values_new.astype(object) == values_old.astype(object))
+                | (values_new.isnull() & values_old.isnull())
+            ).to_numpy()
+
+    df_entities = df.assign(
+        is_equal=is_equal,
+        in_new=df["_merge"] != "right_only",
+        in_old=df["_merge"] != "left_only",
+    ).groupby(key_cols[0], observed=True).agg(
+        is_equal=("is_equal", "all"), in_new=("in_new", "any"), in_old=("in_old", "any")
+    )
+    df_entities["status"] = np.select(
+        [df_entities["is_equal"], ~df_entities["in_new"], ~df_entities["in_old"]],
+        ["ok", "missing", "new"],
+        default="changed"
+    )
+    return df_entities[["status"]].reset_index()
+
+
+# Product validation
 
 
 def check_for_duplicate_TISK(df_dict_new) -> int:
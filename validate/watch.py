@@ -0,0 +1,117 @@
+""" Watch mode: poll cheap load watermarks (e.g. the max DateSK of the
+FactTrans tables) and trigger a validation run as soon as a new load
+has landed. A changed watermark has to be stable for a debounce period
+before a run is triggered, so that a load still in progress, or several
+loads landing shortly one after the other, lead to one run only.
+"""
+
+import datetime as dt
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import utils
+from sql_queries import watermark_probe_dict
+
+logger = logging.getLogger(__name__)
+
+WATERMARKS_FILE = "watermarks.json"
+
+
+class Watcher:
+    """Keep track of the watermarks of the last validated load and of
+    a pending (changed, but maybe not yet stable) load.
+    """
+
+    def __init__(
+        self,
+        debounce_seconds: float,
+        validated: Optional[Dict[str, str]] = None
+    ):
+        self.debounce_seconds = debounce_seconds
+        self.validated = validated
+        self.pending = None
+        self.pending_since = None
+
+    def update(self, watermarks: Dict[str, str], now: dt.datetime) -> bool:
+        """Register the actual watermarks and return True if a run has
+        to be triggered. Any further change restarts the debounce period.
+        """
+        if self.validated is None:
+            # First poll without a stored state: take it as the baseline
+            self.validated = watermarks
+            return False
+        if watermarks == self.validated:
+            self.pending = self.pending_since = None
+            return False
+        if watermarks != self.pending:
+            logger.info(f"New load detected: {_changed(self.validated, watermarks)}")
+            self.pending, self.pending_since = watermarks, now
+            return False
+        return (now - self.pending_since).total_seconds() >= self.debounce_seconds
+
+    def mark_validated(self) -> None:
+        """Take the pending watermarks as validated. Loads landing
+        during the run are detected at the next poll.
+        """
+        self.validated = self.pending
+        self.pending = self.pending_since = None
+
+
+def get_watermark_probes(config: Dict[str, Any]) -> Dict[str, str]:
+    """Return the watermark probe queries, either from the WATCH_PROBES
+    section of the config, or the default ones for the configured
+    vendors.
+    """
+    if "WATCH_PROBES" in config:
+        return config["WATCH_PROBES"]
+    vendors = [vendor.lower() for vendor in config["VENDOR_LIST"]]
+    return {
+        name: query for name, query in watermark_probe_dict.items()
+        if name.split("_", 1)[0] in vendors
+    }
+
+
+def read_watermarks(
+    engine: Any,
+    probes: Dict[str, str]
+) -> Dict[str, str]:
+    """Run the probe queries and return their results as strings."""
+    with engine.connect() as connection:
+        return {
+            name: str(connection.execute(query).scalar())
+            for name, query in probes.items()
+        }
+
+
+def load_validated_watermarks(data_path: str) -> Optional[Dict[str, str]]:
+    """Return the watermarks of the last validated load, if stored."""
+    watermarks_path = Path(data_path) / WATERMARKS_FILE
+    if not watermarks_path.exists():
+        return None
+    with open(watermarks_path, "r") as f:
+        return json.load(f)
+
+
+def save_validated_watermarks(data_path: str, watermarks: Dict[str, str]) -> None:
+    """Store the watermarks of the last validated load, so that a
+    restarted watcher does not validate the same load again.
+    """
+    with open(Path(data_path) / WATERMARKS_FILE, "w") as f:
+        json.dump(watermarks, f, indent=2)
+
+
+def get_probe_engine(config: Dict[str, Any]) -> Any:
+    """Return the (cached) engine used for the probe queries."""
+    engine, connection = utils.connect_to_db(config["SERVER"], config["DB_LIST"][0])
+    connection.close()
+    return engine
+
+
+def _changed(old: Dict[str, str], new: Dict[str, str]) -> str:
+    """Return a short description of the changed watermarks."""
+    return ", ".join(
+        [f"{name} {old.get(name)} -> {value}" for name, value in new.items()
+         if old.get(name) != value]
+    )